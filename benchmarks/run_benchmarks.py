@@ -0,0 +1,350 @@
+# Benchmark Suite
+
+"""
+
+Benchmarks of the ES library:
+- es_step: latency of a single ES_function call of the 1D, 2D and ND classes, with the default (fused kernel) backend,
+  and with the reference NumPy expressions (".../reference")
+- sim_steps, sim_controllers, sim_channels: Simulation.run_simulation throughput as the number of timesteps,
+  ES controllers and ES channels grows (scenarios of benchmarks/scenarios.py)
+- linear_system: LinearSystem.step latency as the state dimension grows
+and the peak memory allocated by each configuration (traced with tracemalloc, in a separate run from the timing).
+
+The accuracy section reports the error of the gradient estimates xihat of the ND-ES scenarios against the analytic gradient of their
+built-in objective function (gradient_accuracy).
+
+Results are written as JSON, and compared against a stored baseline. Run from the repository root:
+
+    python -m benchmarks.run_benchmarks --output results.json
+    python -m benchmarks.run_benchmarks --baseline benchmarks/baseline.json
+    python -m benchmarks.run_benchmarks --quick --save-baseline benchmarks/baseline.json
+
+Timings depend on the machine, so a baseline should be recorded on the machine it is compared on.
+
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time as timer
+import tracemalloc
+
+import numpy as np
+
+from lib.ExtremumSeekingSimple1D import ExtremumSeekingSimple1D
+from lib.ExtremumSeekingSimple2D import ExtremumSeekingSimple2D
+from lib.ExtremumSeekingSimpleND import ExtremumSeekingSimpleND
+
+from benchmarks import scenarios
+
+
+# parameters of each benchmark: full and quick (--quick) sizes
+CONFIGS = {
+    "full": {
+        "es_step_steps": 20000,
+        "es_step_nc": [3, 30, 300],
+        "sim_steps": [1000, 10000, 100000],
+        "sim_controllers": [1, 10, 100],
+        "sim_channels": [3, 30, 300],
+        "linear_nx": [2, 20, 200, 2000],
+        "network_agents": [100, 1000, 10000],
+        "gradient_channels": [3, 10, 30],
+        "nonlinear_copies": [10, 100, 1000],
+        "sim_n_steps": 3001,
+        "linear_steps": 5000,
+        "repeats": 3,
+    },
+    "quick": {
+        "es_step_steps": 2000,
+        "es_step_nc": [3, 30],
+        "sim_steps": [1000, 10000],
+        "sim_controllers": [1, 10],
+        "sim_channels": [3, 30],
+        "linear_nx": [2, 20, 200],
+        "network_agents": [100, 1000],
+        "gradient_channels": [3, 10],
+        "nonlinear_copies": [10, 100],
+        "sim_n_steps": 1001,
+        "linear_steps": 1000,
+        "repeats": 3,
+    },
+}
+
+
+def measure(run, repeats=3, memory=True):
+    """
+    Time a benchmark function, and trace its peak memory
+
+    Inputs:
+    run: callable
+        run() sets up and runs the benchmark, and returns (elapsed time [s], number of timesteps)
+    repeats: int, optional
+        number of timed runs, of which the fastest is kept (default is 3)
+    memory: bool, optional
+        if True, trace the peak memory of one more run (default is True)
+
+    Outputs:
+    dict with the elapsed time, time per step, steps per second and peak memory [bytes]
+    """
+
+    elapsed = np.inf
+    for _ in range(repeats):
+        t, n_steps = run()
+        elapsed = min(elapsed, t)
+
+    result = {
+        "time": elapsed,
+        "steps": n_steps,
+        "time_per_step": elapsed/n_steps,
+        "steps_per_second": n_steps/elapsed,
+    }
+
+    if memory:
+        tracemalloc.start()
+        run()
+        result["peak_memory"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return result
+
+
+def es_step_benchmark(kind, nc, n_steps, backend="auto"):
+    """
+    Benchmark function stepping one ES controller with precomputed objective function values, timing only the ES_function calls
+    """
+
+    def run():
+        dT = 0.01
+        time = dT*np.arange(n_steps)
+        if kind == "1D":
+            es = ExtremumSeekingSimple1D(time, dT, 1, 0.2, 0.5, "minimize", backend=backend)
+        elif kind == "2D":
+            es = ExtremumSeekingSimple2D(time, dT, 1, [0.2, 0.2], [0.5, 0.5], "minimize", backend=backend)
+        else:
+            es = ExtremumSeekingSimpleND(time, dT, nc, np.linspace(1, 2, nc), 0.2, 0.5, "minimize", backend=backend)
+        psi = 1 + np.sin(np.linspace(0, 10, n_steps)) # precomputed objective function values
+        t0 = timer.perf_counter()
+        for kt in range(n_steps):
+            es.ES_function(kt, psi[kt])
+        return timer.perf_counter() - t0, n_steps
+
+    return run
+
+
+def simulation_benchmark(build):
+    """
+    Benchmark function building a Simulation with build() and timing run_simulation
+    """
+
+    def run():
+        sim = build()
+        t0 = timer.perf_counter()
+        sim.run_simulation()
+        return timer.perf_counter() - t0, len(sim.time)
+
+    return run
+
+
+def linear_system_benchmark(nx, n_steps):
+    """
+    Benchmark function stepping a LinearSystem of nx states with explicit inputs
+    """
+
+    def run():
+        sys = scenarios.random_linear_system(nx, n_steps)
+        u = np.ones(1)
+        t0 = timer.perf_counter()
+        for kt in range(n_steps):
+            sys.step(kt, u)
+        return timer.perf_counter() - t0, n_steps
+
+    return run
+
+
+def gradient_accuracy(sim, stride=10, settle=0.1):
+    """
+    Error of the gradient estimates of the ES controller of a simulation with one passthrough system and one built-in objective function
+
+    At every stride-th timestep after the first settle fraction of the run, the gradient of the objective function with respect to the
+    setpoint thetahat is computed from its analytic gradient with respect to the outputs and a central-difference Jacobian of the
+    passthrough function, and compared with the gradient estimate xihat.
+
+    Near the optimum the gradient vanishes while the estimate keeps a ripple (products of the dithers of different channels,
+    attenuated by the low-pass filter only), so the relative error grows with the fraction of the run spent converged.
+
+    Outputs:
+    dict with the RMS error of xihat, the RMS gradient, their ratio (relative error), and the number of compared timesteps
+    """
+
+    sim.run_simulation()
+    es, sys, obj = sim.es_list[0], sim.system_list[0], sim.obj_list[0]
+    f = sys.pass_through_function
+
+    error = 0.0
+    norm = 0.0
+    steps = range(int(settle*len(sim.time)), len(sim.time), stride)
+    for kt in steps:
+        thetahat = es.thetahat[:,kt:kt+1]
+        h = 1e-6*np.maximum(1, np.abs(thetahat))
+        J = np.hstack([(f(thetahat + h*e) - f(thetahat - h*e))/(2*h[k1]) for k1, e in enumerate(np.eye(es.nc)[:,:,None])])
+        gradient = J.T@obj.objective_gradient(kt, f(thetahat)[:,0])
+        error += np.sum((es.xihat[:,kt] - gradient)**2)
+        norm += np.sum(gradient**2)
+
+    return {"rms_error": float(np.sqrt(error/len(steps))), "rms_gradient": float(np.sqrt(norm/len(steps))),
+        "relative_error": float(np.sqrt(error/norm)), "steps": len(steps)}
+
+
+def run_benchmarks(quick=False, select=None, verbose=True):
+    """
+    Run the benchmark suite
+
+    Inputs:
+    quick: bool, optional
+        if True, run smaller configurations (default is False)
+    select: str, optional
+        run only the benchmarks whose name contains select (default is None, run all)
+    verbose: bool, optional
+        if True, print each result as it completes (default is True)
+
+    Outputs:
+    dict with "meta" (machine and library versions), "results" (benchmark name -> result of measure) and "accuracy"
+    (benchmark name -> result of gradient_accuracy)
+    """
+
+    config = CONFIGS["quick" if quick else "full"]
+    repeats = config["repeats"]
+
+    benchmarks = {}
+    for kind in ["1D", "2D"]:
+        benchmarks[f"es_step/{kind}"] = es_step_benchmark(kind, 1 if kind == "1D" else 2, config["es_step_steps"])
+    for nc in config["es_step_nc"]:
+        benchmarks[f"es_step/ND/nc={nc}"] = es_step_benchmark("ND", nc, config["es_step_steps"])
+    for kind in ["1D", "2D"]:
+        benchmarks[f"es_step/{kind}/reference"] = es_step_benchmark(kind, 1 if kind == "1D" else 2, config["es_step_steps"], None)
+    for nc in config["es_step_nc"]:
+        benchmarks[f"es_step/ND/nc={nc}/reference"] = es_step_benchmark("ND", nc, config["es_step_steps"], None)
+    for n_steps in config["sim_steps"]:
+        benchmarks[f"sim_steps/passthrough_1d/steps={n_steps}"] = simulation_benchmark(lambda n_steps=n_steps: scenarios.passthrough_1d(n_steps))
+    benchmarks[f"sim_steps/mass_spring_damper/steps={config['sim_steps'][-1]}"] = simulation_benchmark(lambda: scenarios.mass_spring_damper(config["sim_steps"][-1]))
+    for n_es in config["sim_controllers"]:
+        benchmarks[f"sim_controllers/parallel_1d/n_es={n_es}"] = simulation_benchmark(lambda n_es=n_es: scenarios.parallel_1d(n_es, config["sim_n_steps"]))
+    for nc in config["sim_channels"]:
+        benchmarks[f"sim_channels/passthrough_nd/nc={nc}"] = simulation_benchmark(lambda nc=nc: scenarios.passthrough_nd(nc, config["sim_n_steps"]))
+    for n_agents in config["network_agents"]:
+        benchmarks[f"sim_network/agent_network/n_agents={n_agents}"] = simulation_benchmark(lambda n_agents=n_agents: scenarios.agent_network(n_agents, config["sim_n_steps"]))
+    for M in config["nonlinear_copies"]:
+        benchmarks[f"sim_nonlinear/nonlinear_ensemble/M={M}"] = simulation_benchmark(lambda M=M: scenarios.nonlinear_ensemble(M, config["sim_n_steps"]))
+    for nx in config["linear_nx"]:
+        benchmarks[f"linear_system/nx={nx}"] = linear_system_benchmark(nx, config["linear_steps"])
+
+    results = {}
+    for name, run in benchmarks.items():
+        if select is not None and select not in name:
+            continue
+        results[name] = measure(run, repeats)
+        if verbose:
+            print(f"{name:48s} {1e6*results[name]['time_per_step']:10.2f} us/step {results[name]['peak_memory']/2**20:10.2f} MiB", flush=True)
+
+    accuracy = {}
+    for nc in config["gradient_channels"]:
+        name = f"gradient/passthrough_nd/nc={nc}"
+        if select is not None and select not in name:
+            continue
+        accuracy[name] = gradient_accuracy(scenarios.passthrough_nd(nc, config["sim_n_steps"]))
+        if verbose:
+            print(f"{name:48s} {accuracy[name]['rms_error']:10.4f} RMS error of xihat {accuracy[name]['relative_error']:10.4f} relative", flush=True)
+
+    meta = {
+        "quick": quick,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "platform": platform.platform(),
+    }
+
+    return {"meta": meta, "results": results, "accuracy": accuracy}
+
+
+def compare_results(results, baseline, tolerance=0.2, memory_tolerance=0.1):
+    """
+    Compare benchmark results against a baseline
+
+    Inputs:
+    results, baseline: dict
+        outputs of run_benchmarks
+    tolerance: float, optional
+        relative increase of the time per step flagged as a regression (default is 0.2)
+    memory_tolerance: float, optional
+        relative increase of the peak memory flagged as a regression (default is 0.1)
+
+    Outputs:
+    dict with, for each benchmark in both results, the ratios (current/baseline) of the time per step and peak memory,
+    and whether each is a regression
+    """
+
+    comparison = {}
+    for name, result in results["results"].items():
+        if name not in baseline["results"]:
+            continue
+        base = baseline["results"][name]
+        time_ratio = result["time_per_step"]/base["time_per_step"]
+        memory_ratio = None
+        if "peak_memory" in result and base.get("peak_memory", 0) > 0:
+            memory_ratio = result["peak_memory"]/base["peak_memory"]
+        comparison[name] = {
+            "time_ratio": time_ratio,
+            "time_regression": time_ratio > 1 + tolerance,
+            "memory_ratio": memory_ratio,
+            "memory_regression": memory_ratio is not None and memory_ratio > 1 + memory_tolerance,
+        }
+
+    return comparison
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description="Run the ES benchmark suite")
+    parser.add_argument("--quick", action="store_true", help="run smaller configurations")
+    parser.add_argument("--select", default=None, help="run only the benchmarks whose name contains this string")
+    parser.add_argument("--output", default=None, help="write the results to this JSON file")
+    parser.add_argument("--baseline", default=None, help="compare the results against this baseline JSON file")
+    parser.add_argument("--save-baseline", default=None, help="write the results as a baseline JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="relative slowdown flagged as a regression (default 0.2)")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.quick, args.select)
+
+    for path in [args.output, args.save_baseline]:
+        if path is not None:
+            with open(path, "w") as f:
+                json.dump(results, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["meta"].get("quick") != results["meta"]["quick"]:
+            print("warning: the baseline was recorded with different configuration sizes (--quick)")
+        comparison = compare_results(results, baseline, args.tolerance)
+        regressions = 0
+        print()
+        for name, c in comparison.items():
+            flags = []
+            if c["time_regression"]:
+                flags.append("TIME REGRESSION")
+            if c["memory_regression"]:
+                flags.append("MEMORY REGRESSION")
+            memory_ratio = "" if c["memory_ratio"] is None else f"{c['memory_ratio']:6.2f}x memory"
+            print(f"{name:48s} {c['time_ratio']:6.2f}x time {memory_ratio}  {' '.join(flags)}")
+            regressions = regressions + len(flags)
+        if regressions > 0:
+            print(f"{regressions} regression(s) against {args.baseline}")
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,184 @@
+# Benchmark Scenarios
+
+"""
+
+Simulation fixtures for the benchmark suite, based on the scenarios of the README and the example notebooks, with the number of
+timesteps, controllers and channels as parameters.
+
+Each function builds and returns a Simulation that has not been run yet.
+
+"""
+
+import numpy as np
+from scipy import sparse
+
+from lib.ExtremumSeekingSimple1D import ExtremumSeekingSimple1D
+from lib.ExtremumSeekingSimpleND import ExtremumSeekingSimpleND
+from lib.ExtremumSeekingEnsembleND import ExtremumSeekingEnsembleND
+
+from lib.System_Module import PassThroughSystem
+from lib.System_Module import LinearSystem
+from lib.System_Module import NonlinearSystem
+
+from lib.Objective_Function_Module import ObjectiveFunction
+from lib.Objective_Function_Module import NetworkObjectiveFunction
+from lib.Objective_Function_Module import SumSquaredError
+
+from lib.Network_Module import CouplingGraph
+
+from lib.Simulation_Module import Simulation
+
+
+# sum of squared errors (built-in objective function, with analytic gradient)
+objective_function_01 = SumSquaredError()
+
+
+def passthrough_1d(n_steps, dT=0.01):
+    """
+    Simple passthrough system with a 1D-ES ("ES 1D" notebook, first example), over n_steps timesteps
+    """
+
+    time = dT*np.arange(n_steps)
+    ystar = 2*np.ones(len(time))
+
+    PST01 = PassThroughSystem(time, dT, 1, 1, lambda u: 0.5*u + 4, ystar)
+    OBJ01 = ObjectiveFunction(time, dT, objective_function_01, ystar)
+    ESC01 = ExtremumSeekingSimple1D(time, dT, 1, 0.2, 0.5, "minimize", name="1DES")
+
+    PST01.set_es_list([ESC01])
+    OBJ01.set_system_list([PST01])
+
+    return Simulation(time, dT, [PST01], [ESC01], [OBJ01])
+
+
+def parallel_1d(n_es, n_steps, dT=0.01):
+    """
+    n_es passthrough systems, each with its own objective function and 1D-ES ("ES 1D" notebook, parallel ES example)
+    """
+
+    time = dT*np.arange(n_steps)
+
+    sys_list = []
+    obj_list = []
+    es_list = []
+    for k1 in range(n_es):
+        ystar = (1 + k1 % 3)*np.ones(len(time))
+        PST = PassThroughSystem(time, dT, 1, 1, lambda u: 0.5*u, ystar)
+        OBJ = ObjectiveFunction(time, dT, objective_function_01, ystar)
+        ESC = ExtremumSeekingSimple1D(time, dT, 1 + 0.01*k1, 0.2, 0.5, "minimize", name=f"1DES_{k1:02d}")
+        PST.set_es_list([ESC])
+        OBJ.set_system_list([PST])
+        sys_list.append(PST)
+        obj_list.append(OBJ)
+        es_list.append(ESC)
+
+    return Simulation(time, dT, sys_list, es_list, obj_list, np.arange(n_es))
+
+
+def passthrough_nd(nc, n_steps, dT=0.01):
+    """
+    Passthrough system with the channel outputs and their sum, and one ND-ES of nc channels ("ES ND" notebook example)
+
+    The integrator gain is scaled by 3/nc (0.2 for the 3 channels of the notebook), as the curvature along the sum output grows with nc.
+    """
+
+    time = dT*np.arange(n_steps)
+    C = np.vstack((np.eye(nc), np.ones((1,nc))))
+    ystar = np.zeros((nc + 1,len(time)))
+    ystar[:nc,:] = np.linspace(-1.5, 1.5, nc).reshape(-1,1)
+    ystar[nc,:] = np.sum(ystar[:nc,0])
+
+    PST01 = PassThroughSystem(time, dT, nc, nc + 1, lambda u: C@u, ystar)
+    OBJ01 = ObjectiveFunction(time, dT, objective_function_01, ystar)
+    ESC01 = ExtremumSeekingSimpleND(time, dT, nc, np.linspace(1, 2, nc), 0.2*np.ones(nc), 0.6/nc*np.ones(nc), "minimize", name="NDES_01")
+
+    PST01.set_es_list([ESC01])
+    OBJ01.set_system_list([PST01])
+
+    return Simulation(time, dT, [PST01], [ESC01], [OBJ01])
+
+
+def mass_spring_damper(n_steps, dT=0.001):
+    """
+    Mass-spring-damper LinearSystem with a 1D-ES ("ES 1D" notebook, linear system example)
+    """
+
+    time = dT*np.arange(n_steps)
+    ystar = np.zeros((2,len(time)))
+    ystar[0,:] = 1
+
+    m = 1 # mass
+    b = 0.1 # damping constant
+    k = 10 # spring constant
+    A = np.array([[0, 1],[-k/m, -b/m]])
+    B = np.array([[0, 1/m]]).T
+    C = np.array([[1, 0], [0, 1]])
+    D = np.array([[0]])
+
+    LS01 = LinearSystem(time, dT, A, B, C, D, np.array([1.0, 0]), ystar)
+    OBJ01 = ObjectiveFunction(time, dT, lambda y, ystar: np.sum((y[0] - ystar[0])**2), ystar)
+    ESC01 = ExtremumSeekingSimple1D(time, dT, 0.25, 0.2, 1.0, "minimize", name="1DES_01")
+
+    LS01.set_es_list([ESC01])
+    OBJ01.set_system_list([LS01])
+
+    return Simulation(time, dT, [LS01], [ESC01], [OBJ01])
+
+
+def agent_network(n_agents, n_steps, dT=0.01, hops=2, seed=0):
+    """
+    Network of n_agents agents on a ring lattice, each tracking its own reference while staying close to its neighbors,
+    with one ES ensemble, one passthrough system and one sparse network objective function for all agents (streaming)
+    """
+
+    rng = np.random.default_rng(seed)
+    time = dT*np.arange(n_steps)
+    graph = CouplingGraph.ring(n_agents, hops)
+    G, W = graph.objective_matrices(1.0, 0.25)
+    zstar = np.concatenate((rng.uniform(-1, 1, n_agents), np.zeros(graph.n_edges)))
+
+    PST01 = PassThroughSystem(time, dT, n_agents, n_agents, lambda u: u, streaming=True, history_length=10)
+    OBJ01 = NetworkObjectiveFunction(time, dT, G, W, zstar, streaming=True, history_length=10)
+    ESC01 = ExtremumSeekingEnsembleND(time, dT, n_agents, 1, rng.uniform(1.0, 1.5, n_agents), 0.05, 0.3, "minimize",
+        streaming=True, history_length=10, name="ENSES_01")
+
+    PST01.set_es_list([ESC01])
+    OBJ01.set_system_list([PST01])
+
+    return Simulation(time, dT, [PST01], [ESC01], [OBJ01])
+
+
+def nonlinear_ensemble(M, n_steps, dT=0.01, seed=0):
+    """
+    M copies of a first-order nonlinear plant dx/dt = 5*(tanh(u) - x), integrated with RK4 and driven by one ES ensemble of M members,
+    each tracking its own reference (streaming)
+    """
+
+    rng = np.random.default_rng(seed)
+    time = dT*np.arange(n_steps)
+    identity = sparse.identity(M, format="csr")
+
+    NLS01 = NonlinearSystem(time, dT, lambda x, u, t: 5*(np.tanh(u) - x), 1, 1, M=M, streaming=True, history_length=10)
+    OBJ01 = NetworkObjectiveFunction(time, dT, identity, identity, rng.uniform(-0.5, 0.5, M), streaming=True, history_length=10)
+    ESC01 = ExtremumSeekingEnsembleND(time, dT, M, 1, rng.uniform(1.0, 1.5, M), 0.05, 1.0, "minimize",
+        streaming=True, history_length=10, name="ENSES_01")
+
+    NLS01.set_es_list([ESC01])
+    OBJ01.set_system_list([NLS01])
+
+    return Simulation(time, dT, [NLS01], [ESC01], [OBJ01])
+
+
+def random_linear_system(nx, n_steps, dT=0.001, seed=0):
+    """
+    Stable random LinearSystem with nx states, one input and nx outputs (no ES controller, stepped with explicit inputs)
+    """
+
+    rng = np.random.default_rng(seed)
+    time = dT*np.arange(n_steps)
+    A = rng.standard_normal((nx,nx))/np.sqrt(nx) - 2*np.eye(nx)
+    B = rng.standard_normal((nx,1))
+    C = np.eye(nx)
+    D = np.zeros((nx,1))
+
+    return LinearSystem(time, dT, A, B, C, D, np.zeros(nx))
@@ -0,0 +1,134 @@
+# Convergence Detection Classes
+
+"""
+
+Online convergence criteria on the state of ES controllers, used by Simulation.run_simulation to stop a run early.
+
+Every interval timesteps, the monitor samples the setpoint thetahat, the gradient estimate xihat and the objective function value psi
+of every ES controller into a window of recent samples. A run has converged when every given criterion holds for every ES controller
+(and every channel) over the window:
+- thetahat_std: the standard deviation of thetahat over the window is at most thetahat_std
+- xihat_max: the magnitude of xihat over the window is at most xihat_max
+- psi_change: the mean of psi over the second half of the window differs from its mean over the first half by at most psi_change
+
+The cost is one copy of the current values of each ES controller every interval timesteps, and one reduction over the window
+every interval timesteps.
+
+"""
+
+import numpy as np
+
+
+class ConvergenceCriteria():
+    """
+    Convergence criteria on the ES state, evaluated over a window of recent timesteps
+
+    Inputs:
+    window: int, optional
+        number of (simulation) timesteps over which the criteria are evaluated (default is 1000)
+    interval: int, optional
+        number of timesteps between samples and evaluations of the criteria (default is 10)
+    thetahat_std: float, optional
+        maximum standard deviation of thetahat over the window (default is None, not checked)
+    xihat_max: float, optional
+        maximum magnitude of xihat over the window (default is None, not checked)
+    psi_change: float, optional
+        maximum change of the windowed mean of psi (default is None, not checked)
+    min_steps: int, optional
+        number of timesteps before which the run is never considered converged (default is 0)
+    """
+
+    def __init__(self, window=1000, interval=10, thetahat_std=None, xihat_max=None, psi_change=None, min_steps=0):
+
+        if thetahat_std is None and xihat_max is None and psi_change is None:
+            raise ValueError("at least one of thetahat_std, xihat_max and psi_change is required")
+
+        self.interval = max(1, int(interval)) # timesteps between samples
+
+        self.n_samples = max(2, int(window)//self.interval) # samples in the window
+
+        self.window = self.n_samples*self.interval # window [timesteps]
+
+        self.thetahat_std = thetahat_std # maximum standard deviation of thetahat
+
+        self.xihat_max = xihat_max # maximum magnitude of xihat
+
+        self.psi_change = psi_change # maximum change of the mean of psi
+
+        self.min_steps = min_steps # timesteps before convergence can be detected
+
+    def monitor(self, es_list):
+        """
+        Create a monitor evaluating these criteria on a list of ES controllers
+        """
+
+        return ConvergenceMonitor(self, es_list)
+
+
+class ConvergenceMonitor():
+    """
+    Window of recent samples of the ES controllers of a run, and evaluation of the convergence criteria
+    """
+
+    def __init__(self, criteria, es_list):
+
+        self.criteria = criteria
+
+        self.es_list = es_list
+
+        n = criteria.n_samples
+        self.thetahat = [np.zeros((n, es.thetahat[...,0].size)) for es in es_list] # samples of thetahat
+        self.xihat = [np.zeros((n, es.xihat[...,0].size)) for es in es_list] # samples of xihat
+        self.psi = [np.zeros((n, es.psi[...,0].size)) for es in es_list] # samples of psi
+
+        self.count = 0 # number of samples taken
+
+    def sample(self):
+        """
+        Store the most recent values of every ES controller in the window
+        """
+
+        ks = self.count % self.criteria.n_samples
+        for k1, es in enumerate(self.es_list):
+            k = es.buffer_index(es.kt_last)
+            self.thetahat[k1][ks] = es.thetahat[...,k].ravel()
+            self.xihat[k1][ks] = es.xihat[...,k].ravel()
+            self.psi[k1][ks] = np.ravel(es.psi[...,k])
+        self.count = self.count + 1
+
+    def converged(self):
+        """
+        True if every criterion holds for every ES controller over the window
+        """
+
+        criteria = self.criteria
+        n = criteria.n_samples
+        if self.count < n:
+            return False
+
+        for k1 in range(len(self.es_list)):
+            if criteria.thetahat_std is not None and np.max(np.std(self.thetahat[k1], axis=0)) > criteria.thetahat_std:
+                return False
+            if criteria.xihat_max is not None and np.max(np.abs(self.xihat[k1])) > criteria.xihat_max:
+                return False
+            if criteria.psi_change is not None:
+                # samples in chronological order
+                psi = np.roll(self.psi[k1], -(self.count % n), axis=0)
+                change = np.mean(psi[n//2:], axis=0) - np.mean(psi[:n//2], axis=0)
+                if np.max(np.abs(change)) > criteria.psi_change:
+                    return False
+
+        return True
+
+    def update(self, kt):
+        """
+        Sample the ES controllers if timestep kt (of the simulation) ends an interval, and evaluate the criteria
+
+        Outputs:
+        True if the run has converged at timestep kt
+        """
+
+        if (kt + 1) % self.criteria.interval != 0:
+            return False
+        self.sample()
+        return kt + 1 >= self.criteria.min_steps and self.converged()
@@ -0,0 +1,268 @@
+# Dither Generator Classes
+
+"""
+
+Dither (perturbation) generators shared by the ES classes.
+
+A dither generator gives, at each timestep, the value of the perturbation waveform of every ES channel. The ES control is
+theta = thetahat + aes*d, and the high-pass filtered objective function is demodulated with d/(aes*power), where power is the
+mean square of the waveform (1/2 for a sinusoid, giving the 2/aes of the simple ES classes; 1 for a square wave).
+
+Waveforms are not recomputed with transcendental functions at every timestep. For components holding their full history, they are
+precomputed as a table over the time array ("table" method). For components with recording policies, they are precomputed over
+blocks of the time array of chunk_length timesteps, one block at a time ("block" method), so that memory stays bounded; both
+reproduce sin(2*pi*fes*t) exactly, so that a recording policy does not change the control computation. In streaming mode, they are
+advanced by rotating a phasor by one timestep ("rotate" method), and recomputed exactly every reanchor timesteps to bound round-off
+drift (to the order of 1e-14).
+
+Each channel may have its own frequency. orthogonal_frequencies gives sets of frequencies that are orthogonal over a common period
+and free of the low-order intermodulation products that couple the gradient estimates of different channels.
+
+"""
+
+import numpy as np
+
+
+def orthogonal_frequencies(nc, f0, harmonic_start=2):
+    """
+    Distinct dither frequencies for nc channels, all integer harmonics of f0 (hence orthogonal over the period 1/f0)
+
+    The harmonics are chosen greedily from harmonic_start upwards, such that no harmonic equals the sum, difference, double
+    or half of other harmonics of the set. Products of the dithers of two channels contain their difference frequency, at least
+    f0, which the low-pass filter must reject: f0 should be well above the low-pass cutoff (wes/10 in the ES classes).
+
+    Inputs:
+    nc: int
+        number of channels
+    f0: float
+        fundamental frequency [Hz]
+    harmonic_start: int, optional
+        lowest harmonic (default is 2); frequencies lie in [harmonic_start*f0, ~ (harmonic_start + 3*nc)*f0]
+
+    Outputs:
+    array of nc frequencies [Hz]
+    """
+
+    harmonics = []
+    n = harmonic_start
+    while len(harmonics) < nc:
+        conflict = False
+        for n1 in harmonics:
+            if n == 2*n1 or 2*n == n1:
+                conflict = True
+            for n2 in harmonics:
+                if n == n1 + n2 or n == abs(n1 - n2) or n1 == n + n2:
+                    conflict = True
+        if not conflict:
+            harmonics.append(n)
+        n = n + 1
+    return f0*np.array(harmonics, dtype=float)
+
+
+class SineDither():
+    """
+    Sinusoidal dither, d = sin(2*pi*fes*t + phase), or cos(2*pi*fes*t + phase) for channels with cosine True
+
+    Inputs:
+    fes: float or array
+        dither frequency of each channel [Hz]
+    phase: float or array, optional
+        phase of each channel [rad] (default is 0.0)
+    cosine: bool or array, optional
+        channels using a cosine instead of a sine (default is False)
+    method: str, optional
+        "table" (precompute over the time array), "block" (precompute over blocks of the time array), "rotate" (incremental
+        phasor rotation), or None to choose "rotate" if the ES controller is streaming, "block" if it has a recording policy,
+        and "table" otherwise (default is None)
+    reanchor: int, optional
+        number of timesteps between exact recomputations with the "rotate" method (default is 1000)
+    """
+
+    power = 0.5 # mean square of the waveform
+
+    square_variance = 0.125 # variance of the square of the waveform (Hessian demodulation of Newton-ES)
+
+    def __init__(self, fes, phase=0.0, cosine=False, method=None, reanchor=1000):
+
+        self.fes = np.asarray(fes, dtype=float) # dither frequency [Hz]
+
+        self.wes = 2*np.pi*self.fes # dither angular frequency
+
+        self.phase = phase # phase [rad]
+
+        self.cosine = cosine # channels using a cosine
+
+        self.method_option = method # requested method (None: chosen for each ES controller)
+
+        self.method = method # "table", "block" or "rotate"
+
+        self.reanchor = reanchor # timesteps between exact recomputations when rotating
+
+    def prepare(self, es, shape=()):
+        """
+        Precompute the waveform for an ES controller, from its time array and timestep
+
+        A dither generator instance is prepared for (and used by) a single ES controller, and prepared again when a recording
+        policy is set on the controller.
+
+        Inputs:
+        es: ES controller
+        shape: tuple, optional
+            shape of the channels of the ES controller, to which frequencies and phases are broadcast (default is ())
+        """
+
+        shape = self._broadcast(shape)
+
+        self.time_at = es.time_at # time of each timestep
+        self.dT = es.dT
+
+        self.method = self.method_option
+        if self.method is None:
+            if es.streaming:
+                self.method = "rotate"
+            elif es.recording is not None:
+                self.method = "block"
+            else:
+                self.method = "table"
+
+        self.table = None
+        self.block = None
+        if self.method in ("table", "block"):
+            if es.streaming:
+                raise ValueError(f"the {self.method} method requires a time array, and cannot be used in streaming mode")
+            self.time = np.asarray(es.time) # time array
+        if self.method == "table":
+            self.table = self.evaluate(self.time.reshape((1,)*len(shape) + self.time.shape)) # waveform of each channel over time
+        elif self.method == "block":
+            # blocks of the length of the record chunks (the default chunk length without a recording policy)
+            if es.recording is not None:
+                self.block_length = es.recording.chunk_length
+            else:
+                self.block_length = 1024
+            self.block_start = 0 # timestep of the first column of the block
+        elif self.method == "rotate":
+            # rotation by one timestep
+            self.c1 = np.cos(self.wes*self.dT)
+            self.s1 = np.sin(self.wes*self.dT)
+            self.kt_state = None
+        elif self.method != "rotate":
+            raise ValueError(f"unknown dither method: {self.method}")
+
+        self.kt_value = None # timestep of the cached value
+        self.d = None # cached value
+
+    def _broadcast(self, shape):
+        """
+        Broadcast the frequencies, phases and cosine flags to the shape of the channels
+        """
+
+        shape = np.broadcast_shapes(np.shape(self.wes), np.shape(self.phase), np.shape(self.cosine), shape)
+        self.wes = np.broadcast_to(self.wes, shape)
+        self.phase = np.broadcast_to(np.asarray(self.phase, dtype=float), shape)
+        self.cosine = np.broadcast_to(np.asarray(self.cosine, dtype=bool), shape)
+        return shape
+
+    def waveform(self, time, shape=()):
+        """
+        Waveform of every channel over a time array, with the time along the last axis (the table of the "table" method)
+        """
+
+        shape = self._broadcast(shape)
+        time = np.asarray(time)
+        return self.evaluate(time.reshape((1,)*len(shape) + time.shape))
+
+    def evaluate(self, t):
+        """
+        Waveform evaluated at time(s) t (channels along the leading axes)
+        """
+
+        w = self.wes.reshape(self.wes.shape + (1,)*(np.ndim(t) - self.wes.ndim))
+        phase = self.phase.reshape(w.shape)
+        cosine = self.cosine.reshape(w.shape)
+        x = w*t
+        if np.any(phase != 0):
+            x = x + phase
+        if np.all(cosine):
+            return np.cos(x)
+        if not np.any(cosine):
+            return np.sin(x)
+        return np.where(cosine, np.cos(x), np.sin(x))
+
+    def precomputed(self, kt):
+        """
+        Waveform of every channel at timestep kt from the table, or from the block holding kt (computed when kt is outside of the
+        current block)
+        """
+
+        if self.method == "table":
+            return self.table[...,kt]
+
+        k = kt - self.block_start
+        if self.block is None or k < 0 or k >= self.block.shape[-1]:
+            self.block_start = kt
+            time = self.time[kt:kt + self.block_length]
+            self.block = self.evaluate(time.reshape((1,)*self.wes.ndim + time.shape))
+            k = 0
+        return self.block[...,k]
+
+    def _phasor(self, t):
+        """
+        Exact sine and cosine of the phase of each channel at time t
+        """
+
+        x = self.wes*t
+        if np.any(self.phase != 0):
+            x = x + self.phase
+        return np.sin(x), np.cos(x)
+
+    def value(self, kt):
+        """
+        Waveform of every channel at timestep kt
+        """
+
+        if kt == self.kt_value:
+            return self.d
+
+        if self.method in ("table", "block"):
+            self.d = self.precomputed(kt)
+        else:
+            # advance the phasor by one timestep, or recompute it exactly
+            if self.kt_state is not None and kt == self.kt_state + 1 and kt % self.reanchor != 0:
+                self.s, self.c = self.s*self.c1 + self.c*self.s1, self.c*self.c1 - self.s*self.s1
+            else:
+                self.s, self.c = self._phasor(self.time_at(kt))
+            self.kt_state = kt
+            self.d = np.where(self.cosine, self.c, self.s)
+
+        self.kt_value = kt
+        return self.d
+
+
+class SquareDither(SineDither):
+    """
+    Square-wave dither, d = sign(sin(2*pi*fes*t + phase)) (or of the cosine), with values +1 and -1
+
+    Inputs are as for SineDither.
+    """
+
+    power = 1.0 # mean square of the waveform
+
+    square_variance = 0.0 # the square of the waveform is constant: no Hessian information on the diagonal
+
+    def evaluate(self, t):
+
+        return np.where(SineDither.evaluate(self, t) >= 0, 1.0, -1.0)
+
+    def value(self, kt):
+
+        if kt == self.kt_value:
+            return self.d
+
+        if self.method in ("table", "block"):
+            self.d = self.precomputed(kt)
+            self.kt_value = kt
+            return self.d
+
+        d = SineDither.value(self, kt)
+        self.d = np.where(d >= 0, 1.0, -1.0)
+        return self.d
@@ -0,0 +1,224 @@
+# ES Kernel Backends
+
+"""
+
+Fused kernels for the ES update of one timestep (high-pass filter, eps, demodulation, low-pass filter, integrator and probe),
+used by ExtremumSeekingSimple1D/2D/ND through their backend argument.
+
+The ES classes store each signal as an array of shape (nc, buffer_length). The kernels update column k (current timestep) of
+every signal from column km1 (previous timestep) in place, without the temporaries of one NumPy expression per filter stage.
+
+Backends:
+- "numba": the kernel is compiled with numba (if installed), as a single loop over channels
+- "numpy": for a few channels, the same loop in Python on floats (cheaper than dispatching ufuncs on tiny arrays);
+  otherwise, preallocated ufunc calls writing in place
+- "auto": "numba" if numba can be imported, otherwise "numpy"
+
+Every backend performs the operations of the reference ES_function in the same order, so results are the same to round-off
+(bit for bit with the "numpy" backend).
+
+"""
+
+import numpy as np
+
+
+BACKENDS = ["auto", "numba", "numpy"]
+
+SCALAR_CHANNELS = 4 # largest number of channels updated by the scalar loop of the "numpy" backend
+
+_numba_kernel = None # compiled kernel, created on first use
+
+_numba_found = None # result of the numba import check
+
+
+def es_step_kernel(psi, rho, eps, sigma, xihat, thetahat, theta, k, km1, d, ahpf, alpf, blpf, kdt, demod_gain, aes, minimize):
+    """
+    ES update of timestep column k from column km1, one channel at a time
+
+    d holds the dither of every channel, or a single value shared by all channels.
+    The constants ahpf = 1 - whpf*dT, alpf = 1 - wlpf*dT, blpf = wlpf*dT and kdt = kint*dT are given per channel.
+    """
+
+    psik = psi[k]
+    psikm1 = psi[km1]
+    for j in range(rho.shape[0]):
+        if d.shape[0] > 1:
+            dj = d[j]
+        else:
+            dj = d[0]
+        # highpass filter
+        r = ahpf[j]*rho[j,km1] + psik - psikm1
+        rho[j,k] = r
+        # objective function error
+        eps[j,k] = psik - r
+        # demodulate
+        sigma[j,k] = demod_gain[j]*dj*r
+        # lowpass filter demodulated values
+        xihat[j,k] = alpf[j]*xihat[j,km1] + blpf[j]*sigma[j,km1]
+        # integrate to obtain setpoint
+        if minimize:
+            thetahat[j,k] = thetahat[j,km1] - kdt[j]*xihat[j,km1]
+        else:
+            thetahat[j,k] = thetahat[j,km1] + kdt[j]*xihat[j,km1]
+        # add probe to setpoint
+        theta[j,k] = thetahat[j,k] + aes[j]*dj
+
+
+def numba_available():
+    """
+    True if numba can be imported (checked once)
+    """
+
+    global _numba_found
+    if _numba_found is None:
+        try:
+            import numba # noqa: F401
+            _numba_found = True
+        except ImportError:
+            _numba_found = False
+    return _numba_found
+
+
+def get_numba_kernel():
+    """
+    es_step_kernel compiled with numba (compiled once, on first use)
+    """
+
+    global _numba_kernel
+    if _numba_kernel is None:
+        import numba
+        _numba_kernel = numba.njit(cache=True)(es_step_kernel)
+    return _numba_kernel
+
+
+class ESKernel():
+    """
+    Fused ES update of one timestep for an ES controller
+
+    The filter, integrator and probe parameters of the ES controller are read when the kernel is bound to its signal arrays,
+    at its first update (and again if the arrays are replaced, e.g. by a recording policy).
+
+    Inputs:
+    backend: str, optional
+        "auto", "numba" or "numpy" (default is "auto")
+    """
+
+    def __init__(self, backend="auto"):
+
+        if backend not in BACKENDS:
+            raise ValueError(f"unknown ES backend: {backend}, expected one of {BACKENDS}")
+        if backend == "auto":
+            backend = "numba" if numba_available() else "numpy"
+        elif backend == "numba" and not numba_available():
+            raise ImportError("the numba ES backend requires numba")
+        self.backend = backend # "numba" or "numpy"
+
+        self.rho = None # signal array the kernel is bound to
+
+    def bind(self, es):
+        """
+        Compute the per-channel constants of the update from the parameters of an ES controller, and bind its signal arrays
+        """
+
+        nc = es.rho.shape[0]
+
+        def channels(value):
+            return np.ascontiguousarray(np.broadcast_to(np.asarray(value, dtype=float), (nc,)))
+
+        self.ahpf = channels(1 - es.whpf*es.dT) # highpass filter pole
+        self.alpf = channels(1 - es.wlpf*es.dT) # lowpass filter pole
+        self.blpf = channels(es.wlpf*es.dT) # lowpass filter input gain
+        self.kdt = channels(es.kint*es.dT) # integrator gain
+        self.demod_gain = channels(es.demod_gain) # demodulation gain
+        self.aes = channels(es.aes) # dither amplitude
+
+        if es.mode not in ["minimize", "maximize"]:
+            raise ValueError(f"unknown ES mode: {es.mode}, expected minimize or maximize")
+        self.minimize = es.mode == "minimize"
+
+        if self.backend == "numba":
+            self.kernel = get_numba_kernel()
+            self.constants = (self.ahpf, self.alpf, self.blpf, self.kdt, self.demod_gain, self.aes, self.minimize)
+        elif nc <= SCALAR_CHANNELS:
+            self.kernel = self.scalar_step
+            self.constants = tuple(zip(self.ahpf.tolist(), self.alpf.tolist(), self.blpf.tolist(), self.kdt.tolist(),
+                self.demod_gain.tolist(), self.aes.tolist()))
+        else:
+            self.kernel = self.vector_step
+            self.constants = (self.ahpf, self.alpf, self.blpf, self.kdt, self.demod_gain, self.aes, self.minimize)
+            self.temp = np.zeros(nc) # preallocated temporary
+
+        self.rho = es.rho
+
+    def step(self, es, k, km1, d):
+        """
+        Update column k of the signal arrays of an ES controller from column km1, with dither d
+        """
+
+        if es.rho is not self.rho:
+            self.bind(es)
+
+        self.kernel(es.psi, es.rho, es.eps, es.sigma, es.xihat, es.thetahat, es.theta, k, km1, np.reshape(d, -1), *self.constants)
+
+    def scalar_step(self, psi, rho, eps, sigma, xihat, thetahat, theta, k, km1, d, *constants):
+        """
+        Same update as es_step_kernel, on Python floats, with the constants of each channel as a tuple
+        """
+
+        psik = psi.item(k)
+        psikm1 = psi.item(km1)
+        d = d.tolist()
+        minimize = self.minimize
+        for j, (ahpf, alpf, blpf, kdt, demod_gain, aes) in enumerate(constants):
+            dj = d[j] if len(d) > 1 else d[0]
+            # highpass filter
+            r = ahpf*rho.item(j, km1) + psik - psikm1
+            rho[j,k] = r
+            # objective function error
+            eps[j,k] = psik - r
+            # demodulate
+            sigma[j,k] = demod_gain*dj*r
+            # lowpass filter demodulated values
+            xihat[j,k] = alpf*xihat.item(j, km1) + blpf*sigma.item(j, km1)
+            # integrate to obtain setpoint
+            if minimize:
+                th = thetahat.item(j, km1) - kdt*xihat.item(j, km1)
+            else:
+                th = thetahat.item(j, km1) + kdt*xihat.item(j, km1)
+            thetahat[j,k] = th
+            # add probe to setpoint
+            theta[j,k] = th + aes*dj
+
+    def vector_step(self, psi, rho, eps, sigma, xihat, thetahat, theta, k, km1, d, ahpf, alpf, blpf, kdt, demod_gain, aes, minimize):
+        """
+        Same update as es_step_kernel, with ufuncs over all channels writing in place
+        """
+
+        temp = self.temp
+        psik = psi[k]
+
+        # highpass filter
+        r = rho[:,k]
+        np.multiply(ahpf, rho[:,km1], out=r)
+        r += psik
+        r -= psi[km1]
+        # objective function error
+        np.subtract(psik, r, out=eps[:,k])
+        # demodulate
+        s = sigma[:,k]
+        np.multiply(demod_gain, d, out=s)
+        s *= r
+        # lowpass filter demodulated values
+        x = xihat[:,k]
+        np.multiply(alpf, xihat[:,km1], out=x)
+        np.multiply(blpf, sigma[:,km1], out=temp)
+        x += temp
+        # integrate to obtain setpoint
+        np.multiply(kdt, xihat[:,km1], out=temp)
+        if minimize:
+            np.subtract(thetahat[:,km1], temp, out=thetahat[:,k])
+        else:
+            np.add(thetahat[:,km1], temp, out=thetahat[:,k])
+        # add probe to setpoint
+        np.multiply(aes, d, out=temp)
+        np.add(thetahat[:,k], temp, out=theta[:,k])
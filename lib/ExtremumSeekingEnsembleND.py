@@ -0,0 +1,207 @@
+# Ensemble Extremum Seeking Class
+
+import numpy as np
+
+from lib.Dither_Module import SineDither
+from lib.History_Module import HistoryBuffer
+
+
+class ExtremumSeekingEnsembleND(HistoryBuffer):
+    """
+    Ensemble of M independent ND-ES controllers, each with nc channels, advanced together in one vectorized step.
+
+    The state of every member is held in arrays of shape (M, nc, len(time)), so that member m of the ensemble
+    (e.g. self.thetahat[m]) matches the corresponding array of an ExtremumSeekingSimpleND instance with the same parameters.
+
+    fes, aes and kint may be scalars, arrays of shape (M,) (one value per member), (nc,) (one value per channel), or (M, nc)
+    (one value per member and channel). When M == nc > 1, a 1-D array is ambiguous and is rejected: give it as (M, 1) or (1, nc).
+    mode may be a single string, or a list of M strings ("minimize" or "maximize").
+
+    If streaming is True, the ES arrays are ring buffers holding the previous-step state plus history_length recent timesteps.
+    With a recording policy (lib.History_Module.RecordingPolicy), only the selected signals are kept, in the record dictionary.
+    With filters (lib.Filter_Module.ESFilters), the high-pass and low-pass stages are higher-order Butterworth filters discretized
+    with the bilinear transform, instead of first-order forward-Euler filters.
+    """
+
+    history_signals = ["psi", "rho", "eps", "sigma", "xihat", "thetahat", "theta"] # signal arrays (time along the last axis)
+
+    def __init__(self, time, dT, M, nc, fes, aes, kint, mode="minimize", thetahat0=None, streaming=False, history_length=None, recording=None, dither=None, filters=None, **kwargs):
+
+        self.name = ""
+        if "name" in kwargs.keys():
+            self.name = kwargs["name"]
+
+        self.M = M # number of ES controllers in the ensemble
+
+        self.nc = nc # number of ES channels per controller
+
+        self.time = time # time array
+
+        self.dT = dT # timestep
+
+        self.init_history(time, dT, streaming, history_length, recording) # number of stored timesteps
+
+        # ES algorithm parameters, one value per member and channel
+        self.fes = self._member_channel_array(fes) # ES sinusoidal modulation frequency [Hz]
+        self.wes = 2*np.pi*self.fes # ES sinusoidal modulation angular frequency
+
+        self.aes = self._member_channel_array(aes) # ES sinusoidal modulation amplitude (peak - zero)
+
+        # ES dither generator (sinusoidal modulation by default)
+        if dither is None:
+            dither = SineDither(self.fes)
+        self.dither = dither
+        self.dither.prepare(self, (self.M,self.nc))
+
+        self.demod_gain = 1/(self.aes*self.dither.power) # demodulation gain (2/aes for sinusoidal modulation)
+
+        # ES mode (minimize or maximize) of each member
+        if isinstance(mode, str):
+            self.mode = [mode]*self.M
+        else:
+            self.mode = list(mode)
+        if len(self.mode) != self.M:
+            raise ValueError(f"mode must be a string or a list of {self.M} strings")
+        for m in self.mode:
+            if m not in ("minimize", "maximize"):
+                raise ValueError(f"unknown ES mode: {m}")
+
+        # integrator direction of each member: -1 to minimize, +1 to maximize
+        self.direction = np.array([[-1.0] if m == "minimize" else [1.0] for m in self.mode])
+
+        self.whpf = self.wes/10 # ES high-pass filter angular frequency
+
+        self.wlpf = self.wes/10 # ES low-pass filter angular frequency
+
+        self.kint = self._member_channel_array(kint) # ES integrator gain
+
+        self.filters = filters # higher-order filter stages (None: first-order forward-Euler filters)
+
+        # ES algorithm arrays
+        self.psi = np.zeros((self.M,self.buffer_length)) # objective function values
+
+        self.rho = np.zeros((self.M,self.nc,self.buffer_length)) # high-pass filtered objective function
+
+        self.eps = np.zeros((self.M,self.nc,self.buffer_length)) # low-pass filtered objective function
+
+        self.sigma = np.zeros((self.M,self.nc,self.buffer_length)) # demodulated value
+
+        self.xihat = np.zeros((self.M,self.nc,self.buffer_length)) # gradient estimate (with respect to thetahat)
+
+        self.thetahat = np.zeros((self.M,self.nc,self.buffer_length)) # ES setpoint
+
+        self.theta = np.zeros((self.M,self.nc,self.buffer_length)) # ES control value
+
+        # Initialize setpoint and control states
+
+        if thetahat0 is not None:
+            self.thetahat[:,:,0] = self._member_channel_array(thetahat0)
+
+        self.theta[:,:,0] = self.thetahat[:,:,0] + self.aes*self.dither.value(0)
+
+    def _member_channel_array(self, value):
+        """
+        Broadcast a scalar, per-member (M,), per-channel (nc,) or per-member-and-channel (M, nc) parameter to shape (M, nc).
+
+        When M == nc > 1, a 1-D parameter could be per member or per channel, and a ValueError is raised: per-member values are
+        then given as (M, 1), and per-channel values as (1, nc).
+        """
+
+        value = np.asarray(value, dtype=float)
+        if value.ndim == 1 and value.shape[0] == self.M:
+            if self.M == self.nc and self.M > 1:
+                raise ValueError(f"parameter of shape ({self.M},) is ambiguous with M == nc == {self.M}: give per-member values as ({self.M}, 1) "
+                    f"or per-channel values as (1, {self.nc})")
+            value = value.reshape((self.M,1))
+        return np.array(np.broadcast_to(value, (self.M,self.nc)))
+
+    def get_objective_value(self, kt, psi):
+        """
+        Receive the objective function values of all members (computed externally to the ensemble), and store in array.
+
+        At the first timestep, set the initial value of eps (low-pass filtered objective function) to the objective function value
+        """
+
+        self.psi[:,self.buffer_index(kt)] = psi
+        if kt == 0:
+            self.eps[:,:,0] = self.psi[:,0:1]
+
+    def ES_function(self, kt, psi=None):
+        """
+        Computes the setpoint and control of every member, progressing the ensemble by one timestep
+
+        Inputs:
+        kt: int
+            the current timestep
+        psi: array of shape (M,), optional
+            objective function value of each member (default is None)
+        """
+
+        k = self.buffer_index(kt) # column of the current timestep
+        km1 = self.buffer_index(kt-1) # column of the previous timestep
+        d = self.dither.value(kt) # dither of the current timestep
+        self.kt_last = kt
+
+        # receive objective function values
+        if psi is not None:
+            self.psi[:,k] = psi
+
+        # ES controller algorithm
+        if kt == 0:
+
+            # initialize lowpass filtered objective
+            self.eps[:,:,k] = self.psi[:,k:k+1]
+
+            self.theta[:,:,k] = self.thetahat[:,:,k] + self.aes*d
+
+            # design and initialize the filter stages
+            if self.filters is not None:
+                self.filters.bind(self, k)
+
+        elif self.filters is not None:
+
+            # higher-order filter stages
+            self.filters.step(self, k, km1, d)
+
+        elif kt >= 1:
+
+            psi_k = self.psi[:,k:k+1]
+            psi_km1 = self.psi[:,km1:km1+1]
+
+            # highpass filter
+            self.rho[:,:,k] = (1 - self.whpf*self.dT)*self.rho[:,:,km1] + psi_k - psi_km1
+
+            # objective function error
+            self.eps[:,:,k] = psi_k - self.rho[:,:,k]
+
+            # demodulate
+            self.sigma[:,:,k] = self.demod_gain*d*self.rho[:,:,k]
+
+            # lowpass filter demodulated values
+            self.xihat[:,:,k] = (1 - self.wlpf*self.dT)*self.xihat[:,:,km1] + self.wlpf*self.dT*self.sigma[:,:,km1]
+
+            # integrate to obtain setpoint
+            # + to maximize objective function
+            # - to minimize objective function
+            self.thetahat[:,:,k] = self.thetahat[:,:,km1] + self.direction*(self.kint*self.dT*self.xihat[:,:,km1])
+
+            # add probe to setpoint
+            self.theta[:,:,k] = self.thetahat[:,:,k] + self.aes*d
+
+        self.record_step(kt) # copy recorded signals
+
+    def checkpoint_state(self):
+        """
+        Minimal state needed to progress the controller: the signal values of the most recent timestep, and the filter states
+        """
+
+        state = HistoryBuffer.checkpoint_state(self)
+        if self.filters is not None and self.filters.hpf is not None:
+            state.update(self.filters.checkpoint_state())
+        return state
+
+    def restore_state(self, state):
+
+        HistoryBuffer.restore_state(self, state)
+        if self.filters is not None and "filters/hpf" in state:
+            self.filters.restore_state(self, state)
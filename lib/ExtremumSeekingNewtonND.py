@@ -0,0 +1,187 @@
+# Newton Extremum Seeking Class
+
+import numpy as np
+
+from lib.Dither_Module import SineDither
+from lib.History_Module import HistoryBuffer
+
+
+class ExtremumSeekingNewtonND(HistoryBuffer):
+    """
+    Newton-based ND-ES: the setpoint is integrated along an estimate of the Newton direction -inv(H)*grad instead of the gradient,
+    so that the convergence rate (kint) does not depend on the curvature of the objective function.
+
+    In addition to the gradient estimate xihat of ExtremumSeekingSimpleND, the high-pass filtered objective function is demodulated
+    into a Hessian estimate hhat, with the signals d_i*d_j (off the diagonal) and d_i**2 - power (on the diagonal), and low-pass filtered.
+    The inverse of the Hessian is estimated by a Riccati filter, gamma' = wric*(gamma - gamma*hhat*gamma), which converges to inv(hhat)
+    without inverting a matrix, and the setpoint follows thetahat' = -kint*gamma*xihat (for both modes: gamma is negative definite
+    around a maximum).
+
+    The dither must have a varying square (e.g. SineDither, not SquareDither), and the dither frequencies of the channels must be
+    distinct, with no frequency equal to the double, the sum or the difference of other frequencies (see
+    lib.Dither_Module.orthogonal_frequencies), so that products of dithers do not alias into the estimates.
+
+    gamma0 is the initial inverse Hessian estimate (default is the identity, with the sign of the mode), with which the controller
+    starts as a gradient ES of gain kint. fric is the Riccati filter frequency [Hz] (default is that of the low-pass filter of the
+    slowest channel).
+
+    The Hessian estimate is noisy (its demodulation gains scale with 1/aes**2), and strongly indefinite while the filters settle,
+    which would make the Riccati filter diverge. The Riccati filter therefore uses the Hessian estimate with its eigenvalues
+    limited to at least hess_min in magnitude, with the sign of the mode (positive to minimize, negative to maximize), which bounds
+    the inverse Hessian estimate (and the step along the Newton direction) by 1/hess_min.
+
+    If streaming is True, the ES arrays are ring buffers holding the previous-step state plus history_length recent timesteps.
+    With a recording policy (lib.History_Module.RecordingPolicy), only the selected signals are kept, in the record dictionary.
+    """
+
+    history_signals = ["psi", "rho", "eps", "sigma", "xihat", "sigmah", "hhat", "gamma", "thetahat", "theta"] # signal arrays (time along the last axis)
+
+    def __init__(self, time, dT, nc, fes, aes, kint, mode="minimize", thetahat0=None, gamma0=None, fric=None, hess_min=0.1, streaming=False, history_length=None, recording=None, dither=None, **kwargs):
+
+        self.name = ""
+        if "name" in kwargs.keys():
+            self.name = kwargs["name"]
+
+        self.nc = nc # number of ES channels
+
+        self.time = time # time array
+
+        self.dT = dT # timestep
+
+        self.init_history(time, dT, streaming, history_length, recording) # number of stored timesteps
+
+        # ES algorithm parameters
+        self.fes = fes*np.ones(self.nc) # ES sinusoidal modulation frequency [Hz]
+        self.wes = 2*np.pi*self.fes # ES sinusoidal modulation angular frequency
+
+        self.aes = aes*np.ones(self.nc) # ES sinusoidal modulation amplitude (peak - zero)
+
+        # ES dither generator (sinusoidal modulation by default)
+        if dither is None:
+            dither = SineDither(self.fes)
+        if dither.square_variance <= 0:
+            raise ValueError(f"Newton-ES requires a dither with a varying square, not {type(dither).__name__}")
+        self.dither = dither
+        self.dither.prepare(self, (self.nc,))
+
+        self.demod_gain = 1/(self.aes*self.dither.power) # demodulation gain (2/aes for sinusoidal modulation)
+
+        # Hessian demodulation gains (16/aes**2 on the diagonal and 4/(aes_i*aes_j) off the diagonal for sinusoidal modulation)
+        self.hess_gain = np.outer(self.demod_gain, self.demod_gain)
+        np.fill_diagonal(self.hess_gain, 2/(self.aes**2*self.dither.square_variance))
+        self.hess_offset = np.diag(np.diag(self.hess_gain)*self.dither.power) # removes the mean square of the dither on the diagonal
+
+        if mode not in ("minimize", "maximize"):
+            raise ValueError(f"unknown ES mode: {mode}")
+        self.mode = mode # ES mode (minimize or maximize)
+
+        self.whpf = self.wes/10 # ES high-pass filter angular frequency
+
+        self.wlpf = self.wes/10 # ES low-pass filter angular frequency
+
+        # Riccati filter angular frequency
+        if fric is None:
+            self.wric = np.min(self.wlpf)
+        else:
+            self.wric = 2*np.pi*fric
+
+        self.hess_min = hess_min # smallest magnitude of the eigenvalues of the Hessian estimate used by the Riccati filter
+
+        self.kint = kint*np.ones(self.nc) # ES integrator gain
+
+        # ES algorithm arrays
+        self.psi = np.zeros(self.buffer_length) # objective function values
+
+        self.rho = np.zeros((self.nc,self.buffer_length)) # high-pass filtered objective function
+
+        self.eps = np.zeros((self.nc,self.buffer_length)) # low-pass filtered objective function
+
+        self.sigma = np.zeros((self.nc,self.buffer_length)) # demodulated value
+
+        self.xihat = np.zeros((self.nc,self.buffer_length)) # gradient estimate (with respect to thetahat)
+
+        self.sigmah = np.zeros((self.nc,self.nc,self.buffer_length)) # demodulated value for the Hessian
+
+        self.hhat = np.zeros((self.nc,self.nc,self.buffer_length)) # Hessian estimate
+
+        self.gamma = np.zeros((self.nc,self.nc,self.buffer_length)) # inverse Hessian estimate (Riccati filter)
+
+        self.thetahat = np.zeros((self.nc,self.buffer_length)) # ES setpoint
+
+        self.theta = np.zeros((self.nc,self.buffer_length)) # ES control value
+
+        # Initialize setpoint, inverse Hessian estimate and control states
+        if thetahat0 is not None:
+            self.thetahat[:,0:1] = np.asarray(thetahat0).reshape((self.nc,1))
+
+        if gamma0 is None:
+            gamma0 = np.eye(self.nc) if self.mode == "minimize" else -np.eye(self.nc)
+        self.gamma[:,:,0] = np.broadcast_to(gamma0, (self.nc,self.nc))
+
+        self.theta[:,0] = self.thetahat[:,0] + self.aes*self.dither.value(0)
+
+    def get_objective_value(self, kt, psi):
+        """
+        Receive the objective function value (computed externally to an ES instance), and store in array.
+
+        At the first timestep, set the initial value of psi (low-pass filtered objective function) to the objective function value
+        """
+
+        self.psi[self.buffer_index(kt)] = psi
+        if kt == 0:
+            self.eps[:,0] = self.psi[0]
+
+    def ES_function(self, kt, psi=None):
+
+        k = self.buffer_index(kt) # column of the current timestep
+        km1 = self.buffer_index(kt-1) # column of the previous timestep
+        d = self.dither.value(kt) # dither of the current timestep
+        self.kt_last = kt
+
+        # receive objective function value
+        if psi is not None:
+            self.psi[k] = psi
+
+        if kt == 0:
+
+            # initialize lowpass filtered objective
+            self.eps[:,k] = self.psi[k]
+            self.theta[:,k] = self.thetahat[:,k] + self.aes*d
+
+        else:
+
+            # highpass filter
+            self.rho[:,k] = (1 - self.whpf*self.dT)*self.rho[:,km1] + self.psi[k] - self.psi[km1]
+
+            # objective function error
+            self.eps[:,k] = self.psi[k] - self.rho[:,k]
+
+            # demodulate gradient and Hessian (row i with the highpass filter of channel i)
+            self.sigma[:,k] = self.demod_gain*d*self.rho[:,k]
+            self.sigmah[:,:,k] = (self.hess_gain*np.outer(d, d) - self.hess_offset)*self.rho[:,k:k+1]
+
+            # lowpass filter demodulated values
+            alpf = 1 - self.wlpf*self.dT
+            blpf = self.wlpf*self.dT
+            self.xihat[:,k] = alpf*self.xihat[:,km1] + blpf*self.sigma[:,km1]
+            self.hhat[:,:,k] = alpf[:,None]*self.hhat[:,:,km1] + blpf[:,None]*self.sigmah[:,:,km1]
+
+            # Riccati filter of the inverse Hessian estimate, on the symmetric part of the Hessian estimate
+            # with its eigenvalues limited to the sign of the mode and to at least hess_min in magnitude
+            gamma = self.gamma[:,:,km1]
+            hhat = 0.5*(self.hhat[:,:,km1] + self.hhat[:,:,km1].T)
+            lam, V = np.linalg.eigh(hhat)
+            if self.mode == "minimize":
+                lam = np.maximum(lam, self.hess_min)
+            else:
+                lam = np.minimum(lam, -self.hess_min)
+            hhat = (V*lam)@V.T
+            self.gamma[:,:,k] = gamma + self.wric*self.dT*(gamma - gamma@hhat@gamma)
+
+            # integrate along the Newton direction to obtain setpoint
+            self.thetahat[:,k] = self.thetahat[:,km1] - self.kint*self.dT*(gamma@self.xihat[:,km1])
+
+            # add probe to setpoint
+            self.theta[:,k] = self.thetahat[:,k] + self.aes*d
+
+        self.record_step(kt) # copy recorded signals
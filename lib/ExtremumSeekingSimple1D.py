@@ -2,13 +2,27 @@
 
 import numpy as np
 
+from lib.Dither_Module import SineDither
+from lib.ES_Kernel_Module import ESKernel
+from lib.History_Module import HistoryBuffer
 
-class ExtremumSeekingSimple1D():
+
+class ExtremumSeekingSimple1D(HistoryBuffer):
     """
     Class comments
+    
+    If streaming is True, the ES arrays are ring buffers holding the previous-step state plus history_length recent timesteps,
+    and the controller can be stepped indefinitely in constant memory (time may then be None or the start time).
+    With a recording policy (lib.History_Module.RecordingPolicy), only the selected signals are kept, in the record dictionary.
+    The update of each timestep runs as one fused kernel of the given backend ("auto", "numba" or "numpy", see lib.ES_Kernel_Module),
+    or as separate NumPy expressions if backend is None.
+    With filters (lib.Filter_Module.ESFilters), the high-pass and low-pass stages are higher-order Butterworth filters discretized
+    with the bilinear transform, instead of first-order forward-Euler filters.
     """
     
-    def __init__(self, time, dT, fes, aes, kint, mode="minimize", thetahat0=None, **kwargs):
+    history_signals = ["psi", "rho", "eps", "sigma", "xihat", "thetahat", "theta"] # signal arrays (time along the last axis)
+    
+    def __init__(self, time, dT, fes, aes, kint, mode="minimize", thetahat0=None, streaming=False, history_length=None, recording=None, dither=None, backend="auto", filters=None, **kwargs):
         
         self.name = ""
         if "name" in kwargs.keys():
@@ -20,14 +34,31 @@ class ExtremumSeekingSimple1D():
         
         self.dT = dT # timestep
         
+        self.init_history(time, dT, streaming, history_length, recording) # number of stored timesteps
+        
         # ES algorithm probing and signal processing parameters
         self.fes = fes # ES sinusoidal modulation frequency [Hz]
         self.wes = 2*np.pi*self.fes # ES sinusoidal modulation angular frequency
         
         self.aes = aes # ES sinusoidal modulation amplitude (peak - zero)
         
+        # ES dither generator (sinusoidal modulation by default)
+        if dither is None:
+            dither = SineDither(self.fes)
+        self.dither = dither
+        self.dither.prepare(self)
+        
+        self.demod_gain = 1/(self.aes*self.dither.power) # demodulation gain (2/aes for sinusoidal modulation)
+        
         self.mode = mode # ES mode (minimize or maximize)
         
+        # fused update kernel (None: reference NumPy expressions)
+        self.kernel = None
+        if backend is not None:
+            self.kernel = ESKernel(backend)
+        
+        self.filters = filters # higher-order filter stages (None: first-order forward-Euler filters)
+
         self.whpf = self.wes/10 # ES high-pass filter angular frequency
         
         self.wlpf = self.wes/10 # ES low-pass filter angular frequency
@@ -42,27 +73,27 @@ class ExtremumSeekingSimple1D():
 #         self.ystar = np.zeros((self.ny,len(time))) # desired measurement value (reference signal)
         
         # ES algorithm arrays
-        self.psi = np.zeros(len(time)) # objective function values
+        self.psi = np.zeros(self.buffer_length) # objective function values
         
-        self.rho = np.zeros((self.nc,len(time))) # high-pass filtered objective function
+        self.rho = np.zeros((self.nc,self.buffer_length)) # high-pass filtered objective function
         
-        self.rho2 = np.zeros((self.nc,len(time))) # high-pass filtered objective function
+        self.rho2 = np.zeros((self.nc,self.buffer_length)) # high-pass filtered objective function
         
-        self.eps = np.zeros((self.nc,len(time))) # low-pass filtered objective function
+        self.eps = np.zeros((self.nc,self.buffer_length)) # low-pass filtered objective function
         
-        self.sigma = np.zeros((self.nc,len(time))) # demodulated value
+        self.sigma = np.zeros((self.nc,self.buffer_length)) # demodulated value
         
-        self.xihat = np.zeros((self.nc,len(time))) # gradient estimate (with respect to thetahat)
+        self.xihat = np.zeros((self.nc,self.buffer_length)) # gradient estimate (with respect to thetahat)
         
-        self.thetahat = np.zeros((self.nc,len(time))) # ES setpoint
+        self.thetahat = np.zeros((self.nc,self.buffer_length)) # ES setpoint
         
-        self.theta = np.zeros((self.nc,len(time))) # ES control value
+        self.theta = np.zeros((self.nc,self.buffer_length)) # ES control value
         
         # Initialize setpoint and control states
         if thetahat0 is not None:
             self.thetahat[0] = thetahat0 # initialize setpoint
         
-        self.theta[0] = self.thetahat[0] + self.aes*np.sin(self.wes*self.time[0]) # initialize control
+        self.theta[0] = self.thetahat[0] + self.aes*self.dither.value(0) # initialize control
 
     # def set_objective_function(self, obj_func):
     #     self.objective_function = obj_func
@@ -75,7 +106,7 @@ class ExtremumSeekingSimple1D():
         At the first timestep, set the initial value of psi (low-pass filtered objective function) to the objective function value
         """
         
-        self.psi[kt] = psi
+        self.psi[self.buffer_index(kt)] = psi
         if kt == 0:
             self.eps[0] = self.psi[0]
     
@@ -97,9 +128,14 @@ class ExtremumSeekingSimple1D():
         
         """
         
+        k = self.buffer_index(kt) # column of the current timestep
+        km1 = self.buffer_index(kt-1) # column of the previous timestep
+        d = self.dither.value(kt) # dither of the current timestep
+        self.kt_last = kt
+        
         # receive objective function value
         if psi != None:
-            self.psi[kt] = psi
+            self.psi[k] = psi
             
         # ES controller algorithm
         
@@ -107,34 +143,65 @@ class ExtremumSeekingSimple1D():
         if kt == 0:
             
             # initialize lowpass filtered objective
-            self.eps[0,kt] = self.psi[kt]
+            self.eps[0,k] = self.psi[k]
+            
+            # design and initialize the filter stages
+            if self.filters is not None:
+                self.filters.bind(self, k)
+        
+        if kt >= 1 and self.filters is not None:
             
-        if kt >= 1:
+            # higher-order filter stages
+            self.filters.step(self, k, km1, d)
+        
+        elif kt >= 1 and self.kernel is not None:
+            
+            # fused update of all stages
+            self.kernel.step(self, k, km1, d)
+            
+        elif kt >= 1:
 
             # no highpass filter
-            self.rho[0,kt] = self.psi[kt]
+            self.rho[0,k] = self.psi[k]
             # highpass filter
-            self.rho[0,kt] = (1 - self.whpf*self.dT)*self.rho[0,kt-1] + self.psi[kt] - self.psi[kt-1]
+            self.rho[0,k] = (1 - self.whpf*self.dT)*self.rho[0,km1] + self.psi[k] - self.psi[km1]
 
             # objective function error
-            self.eps[0,kt] = self.psi[kt] - self.rho[0,kt]
+            self.eps[0,k] = self.psi[k] - self.rho[0,k]
 
             # demodulate
-            self.sigma[0,kt] = 2/self.aes*np.sin(self.wes*self.time[kt])*self.rho[0,kt]
+            self.sigma[0,k] = self.demod_gain*d*self.rho[0,k]
 
             # no lowpass filter
-            self.xihat[0,kt] = self.sigma[0,kt]
+            self.xihat[0,k] = self.sigma[0,k]
             # lowpass filter demodulated values
-            self.xihat[0,kt] = (1 - self.wlpf*self.dT)*self.xihat[0,kt-1] + self.wlpf*self.dT*self.sigma[0,kt-1]
+            self.xihat[0,k] = (1 - self.wlpf*self.dT)*self.xihat[0,km1] + self.wlpf*self.dT*self.sigma[0,km1]
 
             # integrate to obtain setpoint
             # + to maximize objective function
             # - to minimize objective function
             if self.mode == "minimize":
-                self.thetahat[0,kt] = self.thetahat[0,kt-1] - self.kint*self.dT*self.xihat[0,kt-1]
+                self.thetahat[0,k] = self.thetahat[0,km1] - self.kint*self.dT*self.xihat[0,km1]
             if self.mode == "maximize":
-                self.thetahat[0,kt] = self.thetahat[0,kt-1] + self.kint*self.dT*self.xihat[0,kt-1]
+                self.thetahat[0,k] = self.thetahat[0,km1] + self.kint*self.dT*self.xihat[0,km1]
 
             # add probe to setpoint
-            self.theta[0,kt] = self.thetahat[0,kt] + self.aes*np.sin(self.wes*self.time[kt])
-            
\ No newline at end of file
+            self.theta[0,k] = self.thetahat[0,k] + self.aes*d
+
+        self.record_step(kt) # copy recorded signals
+
+    def checkpoint_state(self):
+        """
+        Minimal state needed to progress the controller: the signal values of the most recent timestep, and the filter states
+        """
+        
+        state = HistoryBuffer.checkpoint_state(self)
+        if self.filters is not None and self.filters.hpf is not None:
+            state.update(self.filters.checkpoint_state())
+        return state
+    
+    def restore_state(self, state):
+        
+        HistoryBuffer.restore_state(self, state)
+        if self.filters is not None and "filters/hpf" in state:
+            self.filters.restore_state(self, state)
@@ -0,0 +1,207 @@
+# Filter Bank Classes
+
+"""
+
+Higher-order IIR filters for the high-pass and low-pass stages of the ES classes, used through their filters argument.
+
+By default, the ES classes filter with first-order forward-Euler recurrences, which need whpf*dT and wlpf*dT well below 1 to stay
+stable and accurate, and roll off at 20 dB/decade only. With filters=ESFilters(...), both stages are Butterworth filters of the given
+orders, discretized with the bilinear transform (prewarped at the cutoff), which is stable for any timestep with the cutoff below
+the Nyquist frequency, and rolls off at 20*order dB/decade.
+
+The filters are cascades of second-order sections in transposed direct form II, with the coefficients and states of every channel
+(and ensemble member) held in arrays, so that one timestep of all channels is a few ufunc calls per section.
+
+"""
+
+import numpy as np
+
+
+def butterworth_sos(order, w, btype, dT):
+    """
+    Second-order sections of a Butterworth filter discretized with the bilinear transform
+
+    Inputs:
+    order: int
+        filter order
+    w: float
+        cutoff angular frequency [rad/s], below the Nyquist frequency pi/dT
+    btype: str
+        "lowpass" or "highpass"
+    dT: float
+        timestep
+
+    Outputs:
+    array of shape (number of sections, 6), each row [b0, b1, b2, 1, a1, a2]
+    """
+
+    from scipy.signal import butter
+
+    if not 0 < w < np.pi/dT:
+        raise ValueError(f"the cutoff {w} rad/s must be positive and below the Nyquist frequency {np.pi/dT} rad/s")
+    return butter(order, w/(2*np.pi), btype, fs=1/dT, output="sos")
+
+
+class SOSFilterBank():
+    """
+    Cascade of second-order sections filtering an array of channels, with coefficients per channel
+
+    Inputs:
+    sos: array of shape (number of sections, 6) + channel shape
+        second-order sections of every channel (as given by butterworth_sos, stacked along the trailing axes)
+    """
+
+    def __init__(self, sos):
+
+        self.sos = np.asarray(sos, dtype=float) # coefficients
+        self.b0, self.b1, self.b2 = self.sos[:,0], self.sos[:,1], self.sos[:,2] # numerator of each section
+        self.a1, self.a2 = self.sos[:,4], self.sos[:,5] # denominator of each section (a0 = 1)
+
+        self.n_sections = self.sos.shape[0] # number of sections
+
+        self.z = np.zeros((self.n_sections, 2) + self.sos.shape[2:]) # states of each section
+
+    def reset(self, x0=0.0):
+        """
+        Set the states to the steady state of a constant input x0 (zero states for x0 = 0)
+        """
+
+        x = np.broadcast_to(np.asarray(x0, dtype=float), self.sos.shape[2:])
+        for s in range(self.n_sections):
+            # DC gain of the section
+            y = x*(self.b0[s] + self.b1[s] + self.b2[s])/(1 + self.a1[s] + self.a2[s])
+            self.z[s,1] = self.b2[s]*x - self.a2[s]*y
+            self.z[s,0] = y - self.b0[s]*x
+            x = y
+
+    def step(self, x):
+        """
+        Filter one timestep of every channel
+
+        Inputs:
+        x: array of the channel shape (or broadcastable to it)
+
+        Outputs:
+        filtered values, array of the channel shape
+        """
+
+        z = self.z
+        for s in range(self.n_sections):
+            y = self.b0[s]*x + z[s,0]
+            z[s,0] = self.b1[s]*x - self.a1[s]*y + z[s,1]
+            z[s,1] = self.b2[s]*x - self.a2[s]*y
+            x = y
+        return x
+
+
+class ESFilters():
+    """
+    Butterworth high-pass and low-pass stages of an ES controller (ExtremumSeekingSimple1D/2D/ND, ExtremumSeekingEnsembleND)
+
+    The cutoffs are the whpf and wlpf of the ES controller (wes/10 by default), read when the filters are bound to it, at its first
+    timestep. Each stage has one filter per channel (and ensemble member).
+
+    With these filters, the chain of one timestep is:
+    rho = HPF(psi), eps = psi - rho, sigma = demod_gain*d*rho, xihat = LPF(sigma), and thetahat integrates the previous xihat
+    as in the default chain. The high-pass filter starts at the steady state of the first objective function value (rho = 0).
+
+    Higher-order filters add phase lag within the ES loop: the integrator gain times the curvature of the objective function should
+    stay well below the low-pass cutoff wlpf, or the setpoint oscillates. A filters instance is bound to (and used by) a single ES controller.
+
+    Inputs:
+    hpf_order: int, optional
+        order of the high-pass filter (default is 2)
+    lpf_order: int, optional
+        order of the low-pass filter (default is 2)
+    """
+
+    def __init__(self, hpf_order=2, lpf_order=2):
+
+        self.hpf_order = hpf_order # order of the high-pass filter
+
+        self.lpf_order = lpf_order # order of the low-pass filter
+
+        self.hpf = None # high-pass filter bank
+        self.lpf = None # low-pass filter bank
+
+    def bank(self, order, w, btype, dT, shape):
+        """
+        Filter bank of one stage, with the cutoff w of each channel (designed once per distinct cutoff)
+        """
+
+        w = np.broadcast_to(np.asarray(w, dtype=float), shape)
+        designs = {value: butterworth_sos(order, value, btype, dT) for value in np.unique(w)}
+        sos = np.stack([designs[value] for value in w.ravel()], axis=-1)
+        return SOSFilterBank(sos.reshape(sos.shape[:2] + shape))
+
+    def bind(self, es, k):
+        """
+        Design the filters of an ES controller from its cutoffs and timestep, and initialize them at its timestep column k
+        """
+
+        shape = es.rho.shape[:-1] # channels (and members)
+        self.hpf = self.bank(self.hpf_order, es.whpf, "highpass", es.dT, shape)
+        self.lpf = self.bank(self.lpf_order, es.wlpf, "lowpass", es.dT, shape)
+
+        self.hpf.reset(self.objective_value(es, k))
+        self.lpf.reset(0.0)
+
+        # integrator direction: -1 to minimize, +1 to maximize
+        if hasattr(es, "direction"):
+            self.direction = es.direction
+        elif es.mode == "minimize":
+            self.direction = -1.0
+        elif es.mode == "maximize":
+            self.direction = 1.0
+        else:
+            raise ValueError(f"unknown ES mode: {es.mode}, expected minimize or maximize")
+
+    def objective_value(self, es, k):
+        """
+        Objective function value(s) of column k, broadcastable to the channels of the ES controller
+        """
+
+        psi = es.psi[...,k]
+        return np.reshape(psi, np.shape(psi) + (1,)*(es.rho.ndim - 1 - np.ndim(psi)))
+
+    def step(self, es, k, km1, d):
+        """
+        Update column k of the signal arrays of an ES controller from column km1, with dither d
+        """
+
+        psi = self.objective_value(es, k)
+
+        # highpass filter
+        rho = self.hpf.step(psi)
+        es.rho[...,k] = rho
+
+        # objective function error
+        es.eps[...,k] = psi - rho
+
+        # demodulate
+        es.sigma[...,k] = es.demod_gain*d*rho
+
+        # lowpass filter demodulated values
+        es.xihat[...,k] = self.lpf.step(es.sigma[...,k])
+
+        # integrate to obtain setpoint
+        es.thetahat[...,k] = es.thetahat[...,km1] + self.direction*(es.kint*es.dT*es.xihat[...,km1])
+
+        # add probe to setpoint
+        es.theta[...,k] = es.thetahat[...,k] + es.aes*d
+
+    def checkpoint_state(self):
+        """
+        States of the filters
+        """
+
+        return {"filters/hpf": self.hpf.z.copy(), "filters/lpf": self.lpf.z.copy()}
+
+    def restore_state(self, es, state):
+        """
+        Design the filters of an ES controller, and restore their states from checkpoint_state
+        """
+
+        self.bind(es, es.buffer_index(es.kt_last))
+        self.hpf.z[...] = state["filters/hpf"]
+        self.lpf.z[...] = state["filters/lpf"]
@@ -0,0 +1,317 @@
+# Dataflow Graph Class
+
+"""
+
+Dataflow graph of the components of a simulation, from which Simulation compiles the order in which the components are stepped.
+
+The nodes are systems, objective functions and ES controllers, and the edges carry signals between them:
+- ES controller -> system: control values, applied from the next timestep (a delayed edge: a system receives the control values
+  the ES controller computed at the previous timestep)
+- system -> system: outputs of a system used as inputs of another (cascaded process units), at the same timestep by default,
+  or at the next timestep if the edge is delayed
+- system -> objective function: outputs used as measurements, at the same timestep
+- objective function -> ES controller: objective function value(s), at the same timestep (exactly one objective function per ES controller)
+
+A direct edge requires its source to be stepped before its target within a timestep, and a delayed edge requires its target to be
+stepped before its source (so that the target still reads the value of the previous timestep). The schedule is a topological order
+of these constraints, computed once; ties are broken as the default order of Simulation (systems, objective functions, then ES
+controllers, each in the order they were added), so that a simulation without chained systems keeps its order.
+
+A cycle of direct edges is an algebraic loop (e.g. two systems feeding each other at the same timestep), which cannot be scheduled:
+at least one edge of the loop must be delayed.
+
+The weakly connected parts of the graph are independent branches (e.g. separate plants with their own controllers), which
+Simulation can disable (skip) while the other branches are stepped.
+
+"""
+
+import heapq
+
+
+class AlgebraicLoopError(ValueError):
+    """
+    Cycle of direct (undelayed) edges in a dataflow graph
+    """
+
+
+def component_kind(component):
+    """
+    Kind of a component: "es" (ES controller), "objective" (objective function) or "system"
+    """
+
+    if hasattr(component, "ES_function"):
+        return "es"
+    if hasattr(component, "compute_objective_function"):
+        return "objective"
+    if hasattr(component, "step"):
+        return "system"
+    raise TypeError(f"{type(component).__name__} is not a system, objective function or ES controller")
+
+
+# order of the kinds in the default schedule
+KIND_ORDER = {"system": 0, "objective": 1, "es": 2}
+
+
+class DataflowGraph():
+    """
+    Components of a simulation and the signals between them (see the module documentation)
+
+    Components are added with add (or implicitly by connect), and connected with connect(source, target, delayed).
+    The inputs of each system and the measurements of each objective function are stacked in the order of their edges;
+    wire sets them on the components (set_es_list / set_system_list), and is called by Simulation when it is given a graph.
+    """
+
+    def __init__(self):
+
+        self.nodes = [] # components, in the order they were added
+
+        self.edges = [] # (source, target, delayed)
+
+    def add(self, *components):
+        """
+        Add components to the graph (components already in the graph are ignored)
+
+        Outputs:
+        the last component added
+        """
+
+        for component in components:
+            component_kind(component)
+            if not any(node is component for node in self.nodes):
+                self.nodes.append(component)
+        return components[-1] if components else None
+
+    def connect(self, source, target, delayed=None):
+        """
+        Add an edge from source to target
+
+        Inputs:
+        source, target: components
+        delayed: bool, optional
+            if True, target receives the value of source of the previous timestep (default is None: True for ES controller -> system
+            edges, which are always delayed, False otherwise)
+        """
+
+        self.add(source, target)
+        kinds = (component_kind(source), component_kind(target))
+        if kinds not in (("es", "system"), ("system", "system"), ("system", "objective"), ("objective", "es")):
+            raise ValueError(f"cannot connect a {kinds[0]} to a {kinds[1]}")
+        if source is target:
+            raise AlgebraicLoopError("a system cannot take its own outputs as inputs")
+
+        if kinds == ("es", "system"):
+            if delayed is False:
+                raise ValueError("the control values of an ES controller are applied from the next timestep (delayed edge)")
+            delayed = True
+        elif kinds == ("system", "system"):
+            delayed = bool(delayed)
+        elif delayed:
+            raise ValueError(f"a {kinds[0]} -> {kinds[1]} edge cannot be delayed")
+        else:
+            delayed = False
+
+        if kinds == ("objective", "es") and any(t is target for s, t, d in self.edges if component_kind(s) == "objective"):
+            raise ValueError("an ES controller receives exactly one objective function")
+
+        self.edges.append((source, target, delayed))
+
+    def sources(self, target):
+        """
+        Sources of the edges into target, in the order of the edges
+        """
+
+        return [s for s, t, d in self.edges if t is target]
+
+    def of_kind(self, kind):
+        """
+        Components of a kind ("system", "objective" or "es"), in the order they were added
+        """
+
+        return [node for node in self.nodes if component_kind(node) == kind]
+
+    def wire(self):
+        """
+        Set the inputs of the systems and the measurements of the objective functions from the edges
+        """
+
+        for node in self.nodes:
+            kind = component_kind(node)
+            if kind == "system":
+                node.set_es_list(self.sources(node))
+            elif kind == "objective":
+                node.set_system_list(self.sources(node))
+
+    def objective_of(self, es):
+        """
+        Objective function of an ES controller
+        """
+
+        sources = self.sources(es)
+        if len(sources) != 1:
+            raise ValueError(f"ES controller {getattr(es, 'name', '') or type(es).__name__} has no objective function in the graph")
+        return sources[0]
+
+    @classmethod
+    def from_components(cls, system_list, obj_list, es_list, es_obj):
+        """
+        Graph of components wired through their own input lists (sys.es_list, obj.sys_list), with the objective function
+        es_obj[k] of ES controller k
+
+        Sources outside of the given lists are not part of the graph (their values are read from the components directly).
+        """
+
+        graph = cls()
+        graph.add(*system_list, *obj_list, *es_list)
+
+        def member(component):
+            return any(node is component for node in graph.nodes)
+
+        for sys in system_list:
+            for source in (sys.es_list or []):
+                if member(source):
+                    graph.connect(source, sys)
+        for obj in obj_list:
+            for sys in (obj.sys_list or []):
+                if member(sys):
+                    graph.connect(sys, obj)
+        for es, obj in zip(es_list, es_obj):
+            graph.connect(obj, es)
+
+        return graph
+
+    def label(self, component):
+        """
+        Label of a component for messages: its name, or its kind and index among the components of its kind
+        """
+
+        name = getattr(component, "name", "")
+        if name:
+            return name
+        kind = component_kind(component)
+        index = next(k1 for k1, node in enumerate(self.of_kind(kind)) if node is component)
+        return f"{kind}{index}"
+
+    def algebraic_loops(self):
+        """
+        Cycles of direct edges (strongly connected components of the direct edges with more than one component), as lists of components
+        """
+
+        index = {id(node): k1 for k1, node in enumerate(self.nodes)}
+        successors = [[] for _ in self.nodes]
+        for s, t, delayed in self.edges:
+            if not delayed:
+                successors[index[id(s)]].append(index[id(t)])
+
+        # Tarjan's algorithm (iterative)
+        n = len(self.nodes)
+        order = [None]*n
+        low = [0]*n
+        on_stack = [False]*n
+        stack = []
+        loops = []
+        counter = 0
+        for root in range(n):
+            if order[root] is not None:
+                continue
+            work = [(root, 0)]
+            while work:
+                v, i = work.pop()
+                if i == 0:
+                    order[v] = low[v] = counter
+                    counter += 1
+                    stack.append(v)
+                    on_stack[v] = True
+                if i < len(successors[v]):
+                    work.append((v, i + 1))
+                    w = successors[v][i]
+                    if order[w] is None:
+                        work.append((w, 0))
+                    elif on_stack[w]:
+                        low[v] = min(low[v], order[w])
+                    continue
+                if low[v] == order[v]:
+                    component = []
+                    while True:
+                        w = stack.pop()
+                        on_stack[w] = False
+                        component.append(w)
+                        if w == v:
+                            break
+                    if len(component) > 1:
+                        loops.append([self.nodes[w] for w in sorted(component)])
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[v])
+        return loops
+
+    def schedule(self):
+        """
+        Order in which the components are stepped within a timestep (see the module documentation)
+
+        Outputs:
+        list of components
+
+        Raises AlgebraicLoopError if the direct edges have a cycle, and ValueError if the delayed edges contradict the direct edges
+        """
+
+        loops = self.algebraic_loops()
+        if loops:
+            raise AlgebraicLoopError("algebraic loop(s) between " + "; ".join(" -> ".join(self.label(c) for c in loop) for loop in loops)
+                + ": delay at least one edge of each loop")
+
+        index = {id(node): k1 for k1, node in enumerate(self.nodes)}
+        successors = [set() for _ in self.nodes]
+        for s, t, delayed in self.edges:
+            a, b = index[id(s)], index[id(t)]
+            if delayed:
+                a, b = b, a
+            successors[a].add(b)
+        n_predecessors = [0]*len(self.nodes)
+        for a in range(len(self.nodes)):
+            for b in successors[a]:
+                n_predecessors[b] += 1
+
+        # Kahn's algorithm, with ties broken by kind, then order of addition
+        kind_index = {}
+        keys = []
+        for node in self.nodes:
+            kind = component_kind(node)
+            kind_index[kind] = kind_index.get(kind, -1) + 1
+            keys.append((KIND_ORDER[kind], kind_index[kind]))
+        ready = [(keys[k1], k1) for k1 in range(len(self.nodes)) if n_predecessors[k1] == 0]
+        heapq.heapify(ready)
+        order = []
+        while ready:
+            key, a = heapq.heappop(ready)
+            order.append(self.nodes[a])
+            for b in successors[a]:
+                n_predecessors[b] -= 1
+                if n_predecessors[b] == 0:
+                    heapq.heappush(ready, (keys[b], b))
+
+        if len(order) < len(self.nodes):
+            blocked = [self.label(node) for k1, node in enumerate(self.nodes) if n_predecessors[k1] > 0]
+            raise ValueError(f"the delayed edges between {', '.join(blocked)} contradict the direct edges: no order satisfies both")
+        return order
+
+    def branches(self):
+        """
+        Independent branches of the graph (weakly connected components), as lists of components in the order they were added
+        """
+
+        index = {id(node): k1 for k1, node in enumerate(self.nodes)}
+        parent = list(range(len(self.nodes)))
+
+        def find(a):
+            while parent[a] != a:
+                parent[a] = parent[parent[a]]
+                a = parent[a]
+            return a
+
+        for s, t, delayed in self.edges:
+            parent[find(index[id(s)])] = find(index[id(t)])
+
+        groups = {}
+        for k1, node in enumerate(self.nodes):
+            groups.setdefault(find(k1), []).append(node)
+        return sorted(groups.values(), key=lambda group: index[id(group[0])])
@@ -0,0 +1,404 @@
+# History Buffer Class
+
+"""
+
+Storage of signal arrays along time, shared by ES controllers, systems and objective functions.
+
+In the default (full) mode, signal arrays have one column per entry of the time array, and timestep kt is stored in column kt.
+
+In streaming mode, signal arrays are ring buffers with a fixed number of columns, and timestep kt is stored in column kt % buffer_length.
+The buffer always holds at least the current and previous timesteps, which is all the state needed to progress a component, so that
+a component can be stepped indefinitely in constant memory. The time array is not needed in streaming mode, and time is t0 + kt*dT.
+
+With a recording policy, the signal arrays are ring buffers holding only the state needed to progress a component, and the selected
+signals are copied every decimation timesteps into separate record arrays (optionally with a smaller dtype), e.g. es.record["thetahat"].
+With a directory in the recording policy, the record arrays are memory-mapped .npy files on disk, written in chunks of timesteps, so that
+long simulations with many channels are not limited by RAM.
+
+checkpoint_state / restore_state give the minimal state needed to progress a component from its most recent timestep (the values of its
+signal arrays at that timestep), used by Simulation to checkpoint and resume long runs.
+
+"""
+
+import os
+
+import numpy as np
+
+
+class RecordingPolicy():
+    """
+    Selection of the signals recorded by a component, with decimation and storage dtype
+
+    Inputs:
+    signals: list of str, optional
+        names of the signal arrays to record (e.g. ["thetahat", "psi"]) (default is None, record all signals)
+    decimation: int, optional
+        record every decimation-th timestep (default is 1, record every timestep)
+    dtype: numpy dtype, optional
+        storage dtype of the record arrays, e.g. np.float32 (default is None, float64)
+    directory: str, optional
+        directory of memory-mapped .npy files backing the record arrays (default is None, record arrays in memory)
+    chunk_length: int, optional
+        number of records buffered in memory before they are written to the files (default is 1024)
+    """
+
+    def __init__(self, signals=None, decimation=1, dtype=None, directory=None, chunk_length=1024):
+
+        self.signals = signals # names of recorded signals
+
+        if int(decimation) < 1:
+            raise ValueError("decimation must be a positive integer")
+        self.decimation = int(decimation) # record every decimation-th timestep
+
+        if dtype is None:
+            dtype = np.float64
+        self.dtype = np.dtype(dtype) # storage dtype of recorded signals
+
+        self.directory = directory # directory of the record files (None: in memory)
+
+        if int(chunk_length) < 1:
+            raise ValueError("chunk_length must be a positive integer")
+        self.chunk_length = int(chunk_length) # records buffered before writing to the files
+
+
+class HistoryBuffer():
+    """
+    Mix-in providing full or ring-buffer (streaming) storage of signal arrays along time
+    """
+
+    # names of the signal arrays (with time along the last axis) of the component
+    history_signals = []
+
+    def init_history(self, time, dT, streaming=False, history_length=None, recording=None):
+        """
+        Set the number of stored timesteps (columns) of the signal arrays
+
+        Inputs:
+        time: array or float or None
+            time array (full mode), or start time / time array / None (streaming mode)
+        dT: float
+            timestep
+        streaming: bool, optional
+            if True, keep only the previous-step state plus a ring buffer of recent history (default is False)
+        history_length: int, optional
+            number of recent timesteps kept in streaming mode (default is None, keep only the previous-step state)
+        recording: RecordingPolicy, optional
+            signals to record, decimation and dtype (default is None, the signal arrays hold the full history)
+        """
+
+        self.streaming = streaming # streaming (ring buffer) mode
+
+        if self.streaming:
+            if time is None:
+                self.t0 = 0.0
+            else:
+                self.t0 = float(np.asarray(time).flat[0]) # start time
+            # the current and previous timesteps are always kept
+            if history_length is None:
+                self.buffer_length = 2
+            else:
+                self.buffer_length = max(2, int(history_length))
+        else:
+            self.t0 = time[0] # start time
+            self.buffer_length = len(time) # number of stored timesteps
+
+        # total number of timesteps (None if unbounded)
+        if self.streaming:
+            self.n_steps = None
+        else:
+            self.n_steps = len(time)
+
+        self.kt_last = -1 # most recent timestep processed
+
+        self.recording = None # recording policy
+        self.record = {} # recorded signal arrays
+        self.record_prefix = getattr(self, "name", "") or type(self).__name__ # prefix of the record file names
+        if recording is not None:
+            signals = self._check_recording(recording)
+            self.recording = self._copy_recording(recording, signals)
+            self._reset_records()
+            self.buffer_length = 2 if history_length is None else max(2, int(history_length))
+
+    def _check_recording(self, recording, strict=True):
+        """
+        Validate a recording policy, and return the names of the signals recorded by this component
+        """
+
+        if self.streaming:
+            raise ValueError("a recording policy requires a time array, and cannot be used in streaming mode")
+        if recording.signals is None:
+            return list(self.history_signals)
+        unknown = [name for name in recording.signals if name not in self.history_signals]
+        if strict and len(unknown) > 0:
+            raise ValueError(f"unknown signals {unknown}, expected a subset of {self.history_signals}")
+        return [name for name in recording.signals if name in self.history_signals]
+
+    def _copy_recording(self, recording, signals):
+        """
+        Copy of a recording policy, restricted to the signals of this component
+        """
+
+        return RecordingPolicy(signals, recording.decimation, recording.dtype, recording.directory, recording.chunk_length)
+
+    def _reset_records(self):
+        """
+        Clear the record arrays, and the chunk of records not yet written to the record files
+        """
+
+        self.record = {}
+        self.record_chunk = {} # records not yet written to the record files
+        self.record_chunk_start = 0 # record index of the first record of the chunk
+        self.record_chunk_count = 0 # number of records in the chunk
+        self.record_reopen = False # open existing record files (resumed run) instead of creating them
+
+    def set_recording(self, recording, strict=True, prefix=None):
+        """
+        Apply a recording policy to a component that has not been stepped yet
+
+        The signal arrays are reduced to ring buffers holding the state needed to progress the component,
+        keeping the initial conditions stored in the first column.
+
+        Inputs:
+        recording: RecordingPolicy
+            signals to record, decimation and dtype
+        strict: bool, optional
+            if True, raise an error for signals the component does not have, otherwise ignore them (default is True)
+        prefix: str, optional
+            prefix of the record file names, <directory>/<prefix>.<signal>.npy (default is None, the name or class of the component)
+        """
+
+        if self.kt_last >= 0:
+            raise RuntimeError("a recording policy must be set before the first timestep")
+
+        signals = self._check_recording(recording, strict)
+        self.recording = self._copy_recording(recording, signals)
+        self._reset_records()
+        if prefix is not None:
+            self.record_prefix = prefix
+
+        buffer_length = min(2, self.buffer_length)
+        for name in self.history_signals:
+            if hasattr(self, name):
+                setattr(self, name, getattr(self, name)[...,:buffer_length].copy())
+        self.buffer_length = buffer_length
+
+        # the dither of an ES controller is precomputed for the recording policy
+        if getattr(self, "dither", None) is not None:
+            self.dither.prepare(self, self.dither.wes.shape)
+
+    def record_step(self, kt):
+        """
+        Copy the recorded signals of timestep kt into the record arrays, every decimation timesteps
+        """
+
+        if self.recording is None or kt % self.recording.decimation != 0:
+            return
+
+        k = self.buffer_index(kt)
+        kr = kt//self.recording.decimation
+
+        # records are buffered in chunks, written to the record files when full
+        if self.recording.directory is not None:
+            kc = kr - self.record_chunk_start
+            for name in self.recording.signals:
+                if name not in self.record_chunk:
+                    self.record_chunk[name] = np.zeros(getattr(self, name).shape[:-1] + (self.recording.chunk_length,), dtype=self.recording.dtype)
+                self.record_chunk[name][...,kc] = getattr(self, name)[...,k]
+            self.record_chunk_count = kc + 1
+            if self.record_chunk_count == self.recording.chunk_length:
+                self.flush_records()
+            return
+
+        for name in self.recording.signals:
+            if name not in self.record:
+                # record arrays are created on first use, once the signal array exists
+                n_records = -(-self.n_steps//self.recording.decimation)
+                shape = getattr(self, name).shape[:-1] + (n_records,)
+                self.record[name] = np.zeros(shape, dtype=self.recording.dtype)
+            self.record[name][...,kr] = getattr(self, name)[...,k]
+
+    def record_path(self, name):
+        """
+        Path of the record file of signal name
+        """
+
+        return os.path.join(self.recording.directory, f"{self.record_prefix}.{name}.npy")
+
+    def _open_record_file(self, name):
+        """
+        Create the memory-mapped record file of signal name, or open it to continue a resumed run
+        """
+
+        n_records = -(-self.n_steps//self.recording.decimation)
+        shape = getattr(self, name).shape[:-1] + (n_records,)
+        path = self.record_path(name)
+        if self.record_reopen and os.path.exists(path):
+            record = np.load(path, mmap_mode="r+")
+            if record.shape == shape and record.dtype == self.recording.dtype:
+                return record
+            del record
+        os.makedirs(self.recording.directory, exist_ok=True)
+        return np.lib.format.open_memmap(path, mode="w+", dtype=self.recording.dtype, shape=shape)
+
+    def flush_records(self):
+        """
+        Write the chunk of buffered records to the record files, and flush them to disk
+        """
+
+        if self.recording is None or self.recording.directory is None:
+            return
+
+        k0 = self.record_chunk_start
+        n = self.record_chunk_count
+        for name in self.recording.signals:
+            if name not in self.record:
+                if not hasattr(self, name):
+                    continue
+                self.record[name] = self._open_record_file(name)
+            if n > 0:
+                self.record[name][...,k0:k0 + n] = self.record_chunk[name][...,:n]
+            self.record[name].flush()
+        self.record_chunk_start = k0 + n
+        self.record_chunk_count = 0
+
+    def get_recorded(self, name):
+        """
+        Recorded values of signal name up to the most recent timestep, with the time along the last axis
+        """
+
+        self.flush_records()
+        n_records = self.kt_last//self.recording.decimation + 1
+        return self.record[name][...,:n_records]
+
+    def recorded_time(self):
+        """
+        Times of the recorded timesteps up to the most recent timestep
+        """
+
+        n_records = self.kt_last//self.recording.decimation + 1
+        return np.asarray(self.time)[::self.recording.decimation][:n_records]
+
+    def buffer_index(self, kt):
+        """
+        Column of the signal arrays in which timestep kt is stored
+        """
+
+        return kt % self.buffer_length
+
+    def time_at(self, kt):
+        """
+        Time of timestep kt
+        """
+
+        if self.streaming:
+            return self.t0 + kt*self.dT
+        return self.time[kt]
+
+    def history_steps(self, length=None):
+        """
+        Timesteps currently held in the signal arrays, oldest first (at most length timesteps)
+        """
+
+        if length is None:
+            length = self.buffer_length
+        length = min(length, self.buffer_length)
+        return np.arange(max(0, self.kt_last + 1 - length), self.kt_last + 1)
+
+    def history_time(self, length=None):
+        """
+        Times of the timesteps currently held in the signal arrays, oldest first
+        """
+
+        kts = self.history_steps(length)
+        if self.streaming:
+            return self.t0 + kts*self.dT
+        return self.time[kts]
+
+    def get_history(self, name, length=None):
+        """
+        Recent values of signal array name, in chronological order (oldest first)
+
+        Inputs:
+        name: str
+            name of the signal array (e.g. "thetahat")
+        length: int, optional
+            maximum number of timesteps returned (default is None, all stored timesteps)
+
+        Outputs:
+        array with the time along the last axis
+        """
+
+        cols = self.history_steps(length) % self.buffer_length
+        return getattr(self, name)[..., cols]
+
+    def trim_history(self, n_steps=None):
+        """
+        Shorten the component to its first n_steps timesteps (e.g. after a run stopped early)
+
+        Full-history signal arrays, the time array, reference signals along time and record arrays are cut to the timesteps
+        that were simulated. Ring buffers are kept as they are.
+
+        Inputs:
+        n_steps: int, optional
+            number of timesteps kept (default is None, up to the most recent timestep)
+        """
+
+        if n_steps is None:
+            n_steps = self.kt_last + 1
+        if self.n_steps is None or n_steps >= self.n_steps:
+            return
+
+        self.flush_records()
+
+        if self.buffer_length == self.n_steps:
+            for name in self.history_signals:
+                if hasattr(self, name):
+                    setattr(self, name, getattr(self, name)[...,:n_steps])
+            self.buffer_length = n_steps
+        ystar = getattr(self, "ystar", None)
+        if isinstance(ystar, np.ndarray) and ystar.shape[-1] == self.n_steps:
+            self.ystar = ystar[...,:n_steps]
+        if self.recording is not None:
+            n_records = -(-n_steps//self.recording.decimation)
+            for name in self.record:
+                self.record[name] = self.record[name][...,:n_records]
+        self.time = self.time[:n_steps]
+        self.n_steps = n_steps
+
+    def checkpoint_state(self):
+        """
+        Minimal state needed to progress the component from its most recent timestep: the values of its signal arrays at that timestep
+
+        Outputs:
+        dict of arrays, with the most recent timestep under "kt_last"
+        """
+
+        state = {"kt_last": np.array(self.kt_last)}
+        if self.kt_last >= 0:
+            k = self.buffer_index(self.kt_last)
+            for name in self.history_signals:
+                if hasattr(self, name):
+                    state[name] = np.array(getattr(self, name)[...,k])
+        return state
+
+    def restore_state(self, state):
+        """
+        Restore the state given by checkpoint_state, so that the next timestep is state["kt_last"] + 1
+
+        Values of earlier timesteps are not restored: with a recording policy writing to files, the records of earlier timesteps
+        are kept in the existing record files, which are reopened.
+        """
+
+        self.kt_last = int(state["kt_last"])
+        if self.kt_last >= 0:
+            k = self.buffer_index(self.kt_last)
+            for name in self.history_signals:
+                if name in state:
+                    getattr(self, name)[...,k] = state[name]
+
+        if self.recording is not None:
+            self._reset_records()
+            self.record_reopen = True
+            if self.recording.directory is not None:
+                # records up to kt_last are in the record files
+                self.record_chunk_start = self.kt_last//self.recording.decimation + 1
@@ -0,0 +1,300 @@
+# Monte Carlo Functions
+
+"""
+
+Monte Carlo runs of a simulation over realizations of its noise and disturbance models (lib.Noise_Module), with statistics of the
+trajectories aggregated online.
+
+Realization r of a run with seed s seeds the noise models of its simulation (seed_noise) with child r of numpy.random.SeedSequence(s),
+so that the realizations have independent random streams, and each realization is reproducible on its own, whatever the number of
+workers. The selected signals of each realization (e.g. the setpoints thetahat of the ES controllers and the objective function values
+psi) are folded into OnlineStatistics (mean, standard deviation, minimum, maximum and quantiles along time) as the realizations
+complete, in the order of the realizations, so that the memory does not grow with the number of realizations and the statistics
+do not depend on the number of workers.
+
+With batched True, each chunk of realizations is one batched Simulation, e.g. a NonlinearSystem of one copy per realization driven
+by an ExtremumSeekingEnsembleND of one member per realization, and its noise models draw the noise of all the realizations of the
+chunk as one array per block of timesteps, row i from the streams of realization i (seed_noise with a list of seeds), so that each
+realization is still reproducible on its own from its seed. Otherwise each realization is a separate Simulation, which may have
+any systems and controllers.
+
+The simulation factory is sent to the worker processes, and must be picklable (e.g. a module-level function).
+
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from lib.Noise_Module import seed_noise
+
+
+class OnlineStatistics():
+    """
+    Statistics of a sequence of arrays of the same shape, updated one array at a time without storing the sequence
+
+    The mean and variance are computed with Welford's algorithm. The quantiles are estimated with the P-square algorithm
+    (Jain and Chlamtac, 1985), with five markers per quantile and element, vectorized over the elements; they are exact for up to
+    five arrays, and converge to the quantiles of the sequence as it grows.
+
+    Inputs:
+    quantiles: list of float, optional
+        probabilities of the estimated quantiles (default is (0.05, 0.5, 0.95))
+    """
+
+    def __init__(self, quantiles=(0.05, 0.5, 0.95)):
+
+        self.quantiles = np.asarray(quantiles, dtype=float) # probabilities of the quantiles
+        if np.any((self.quantiles <= 0) | (self.quantiles >= 1)):
+            raise ValueError("quantile probabilities must be between 0 and 1")
+
+        self.count = 0 # number of arrays
+
+        self.mean = None # mean
+        self.m2 = None # sum of squared deviations from the mean
+        self.min = None # minimum
+        self.max = None # maximum
+
+        self.first = [] # first arrays (up to five), before the markers are initialized
+        self.q = None # marker heights (quantiles, 5 markers) + shape
+        self.n = None # marker positions (quantiles, 5 markers) + shape
+
+        p = self.quantiles[:,None]
+        self.dn = np.hstack((0*p, p/2, p, (1 + p)/2, 1 + 0*p)) # increments of the desired marker positions
+
+    def update(self, x):
+        """
+        Add an array to the statistics
+        """
+
+        x = np.array(x, dtype=float)
+        self.count += 1
+
+        if self.count == 1:
+            self.mean = x.copy()
+            self.m2 = np.zeros_like(x)
+            self.min = x.copy()
+            self.max = x.copy()
+        else:
+            delta = x - self.mean
+            self.mean += delta/self.count
+            self.m2 += delta*(x - self.mean)
+            np.minimum(self.min, x, out=self.min)
+            np.maximum(self.max, x, out=self.max)
+
+        if self.count <= 5:
+            self.first.append(x)
+            if self.count == 5:
+                nq = len(self.quantiles)
+                self.q = np.broadcast_to(np.sort(np.stack(self.first), axis=0), (nq, 5) + x.shape).copy()
+                self.n = np.broadcast_to(np.arange(1.0, 6.0).reshape((1,5) + (1,)*x.ndim), self.q.shape).copy()
+                self.first = []
+            return
+        self.update_markers(x)
+
+    def update_markers(self, x):
+        """
+        P-square update of the markers with an array
+        """
+
+        q, n = self.q, self.n
+        expand = (slice(None),) + (None,)*x.ndim
+
+        # extreme markers, and cell of x between the markers
+        np.minimum(q[:,0], x, out=q[:,0])
+        np.maximum(q[:,4], x, out=q[:,4])
+        cell = (x >= q[:,1]).astype(int) + (x >= q[:,2]) + (x >= q[:,3])
+
+        # markers above the cell of x move up by one position
+        for i in range(1, 5):
+            n[:,i] += cell < i
+
+        # desired positions after count arrays
+        desired = 1 + (self.count - 1)*self.dn
+
+        for i in range(1, 4):
+            d = desired[:,i][expand] - n[:,i]
+            move = ((d >= 1) & (n[:,i+1] - n[:,i] > 1)) | ((d <= -1) & (n[:,i-1] - n[:,i] < -1))
+            if not np.any(move):
+                continue
+            s = np.sign(d)*move
+            # parabolic prediction, or linear if it leaves the neighboring heights
+            qp = q[:,i] + s/(n[:,i+1] - n[:,i-1])*(
+                (n[:,i] - n[:,i-1] + s)*(q[:,i+1] - q[:,i])/(n[:,i+1] - n[:,i])
+                + (n[:,i+1] - n[:,i] - s)*(q[:,i] - q[:,i-1])/(n[:,i] - n[:,i-1]))
+            up = s > 0
+            q_next = np.where(up, q[:,i+1], q[:,i-1])
+            n_next = np.where(up, n[:,i+1], n[:,i-1])
+            ql = q[:,i] + s*(q_next - q[:,i])/np.where(move, n_next - n[:,i], 1)
+            parabolic = (q[:,i-1] < qp) & (qp < q[:,i+1])
+            q[:,i] = np.where(move, np.where(parabolic, qp, ql), q[:,i])
+            n[:,i] += s
+
+    @property
+    def std(self):
+        """
+        Sample standard deviation (0 for a single array)
+        """
+
+        if self.count < 2:
+            return np.zeros_like(self.mean)
+        return np.sqrt(self.m2/(self.count - 1))
+
+    def quantile(self, p=None):
+        """
+        Estimated quantiles, array of shape (number of quantiles,) + shape, or the shape of the arrays for one probability p
+        """
+
+        if self.count < 5:
+            values = np.quantile(np.stack(self.first), self.quantiles, axis=0)
+        else:
+            values = self.q[:,2]
+        if p is None:
+            return values
+        k = np.flatnonzero(np.isclose(self.quantiles, p))
+        if len(k) == 0:
+            raise ValueError(f"quantile {p} is not estimated, available: {list(self.quantiles)}")
+        return values[k[0]]
+
+    def summary(self):
+        """
+        Statistics as a dictionary of arrays (count, mean, std, min, max, quantiles and their probabilities)
+        """
+
+        return {
+            "count": np.array(self.count),
+            "mean": self.mean,
+            "std": self.std,
+            "min": self.min,
+            "max": self.max,
+            "quantiles": self.quantile(),
+            "probabilities": self.quantiles,
+        }
+
+
+def component_signal(component, name):
+    """
+    Signal array name of a component with the time along the last axis: its record with a recording policy, else its full array
+    """
+
+    if getattr(component, "recording", None) is not None:
+        return component.get_recorded(name)
+    if component.streaming:
+        raise ValueError(f"signal {name} of a streaming component without recording has no full trajectory")
+    return getattr(component, name)
+
+
+def trajectory_signals(sim, decimation=1):
+    """
+    Trajectories of the setpoints of the ES controllers (thetahat) and of the objective function values (psi) of a simulation
+
+    Outputs:
+    dict of arrays with the time along the last axis, keyed "<name>/thetahat" (ES controllers, named es<k> if unnamed)
+    and "obj<k>/psi" (objective functions), every decimation-th timestep
+    """
+
+    signals = {}
+    for k1, es in enumerate(sim.es_list):
+        label = getattr(es, "name", "") or f"es{k1}"
+        signals[f"{label}/thetahat"] = np.array(component_signal(es, "thetahat")[...,::decimation])
+    for k1, obj in enumerate(sim.obj_list):
+        signals[f"obj{k1}/psi"] = np.array(component_signal(obj, "psi")[...,::decimation])
+    return signals
+
+
+def split_realizations(signals, n_realizations):
+    """
+    Signals of each realization of a batched simulation, from the signals of the simulation split into n_realizations rows along
+    their leading axis
+
+    Outputs:
+    list of dicts of arrays, one per realization
+    """
+
+    for name, values in signals.items():
+        if np.ndim(values) == 0 or np.shape(values)[0] % n_realizations != 0:
+            raise ValueError(f"signal {name} of shape {np.shape(values)} cannot be split into {n_realizations} realizations")
+    rows = {name: np.reshape(values, (n_realizations, -1) + np.shape(values)[1:]) for name, values in signals.items()}
+    return [{name: values[k1] for name, values in rows.items()} for k1 in range(n_realizations)]
+
+
+def _run_realizations(sim_factory, signal_func, seeds, convergence=None, batched=False):
+    """
+    Run a chunk of realizations in a worker process, one simulation per realization or one batched simulation
+
+    Inputs:
+    seeds: list of numpy SeedSequence, one per realization
+
+    Outputs:
+    list of the signals of each realization
+    """
+
+    if batched:
+        sim = sim_factory(len(seeds))
+        seed_noise(sim, list(seeds))
+        sim.run_simulation(convergence=convergence)
+        return split_realizations(signal_func(sim), len(seeds))
+
+    results = []
+    for seed in seeds:
+        sim = sim_factory()
+        seed_noise(sim, seed)
+        sim.run_simulation(convergence=convergence)
+        results.append(signal_func(sim))
+    return results
+
+
+def run_monte_carlo(sim_factory, n_realizations, seed=0, signal_func=trajectory_signals, quantiles=(0.05, 0.5, 0.95), n_workers=None, chunk_size=8, convergence=None, batched=False):
+    """
+    Run realizations of a simulation with independent noise streams, and aggregate statistics of their signals online
+
+    Inputs:
+    sim_factory: callable
+        sim_factory() returns a Simulation (not yet run), with noise models on its systems and objective functions;
+        with batched True, sim_factory(n) returns a batched Simulation of n realizations
+    n_realizations: int
+        number of realizations
+    seed: int, optional
+        seed of the run; realization r uses child r of numpy.random.SeedSequence(seed) (default is 0)
+    signal_func: callable, optional
+        signal_func(sim) returns a dict of arrays of the same shapes in every realization (default is trajectory_signals:
+        thetahat of the ES controllers and psi of the objective functions along time)
+    quantiles: list of float, optional
+        probabilities of the estimated quantiles (default is (0.05, 0.5, 0.95))
+    n_workers: int, optional
+        number of worker processes (default is None, one per CPU); 0 runs the realizations in the calling process
+    chunk_size: int, optional
+        number of realizations sent to a worker at a time, and of each batched simulation (default is 8)
+    convergence: ConvergenceCriteria, optional
+        stop each realization once its ES controllers have converged (see Simulation.run_simulation); signal_func must then
+        return arrays of the same shapes for all realizations (default is None)
+    batched: bool, optional
+        if True, run each chunk of realizations as one batched simulation (see the module documentation); the signals of
+        signal_func are split into one row per realization along their leading axis (default is False)
+
+    Outputs:
+    dict of OnlineStatistics, keyed as the signals of signal_func
+    """
+
+    seeds = np.random.SeedSequence(seed).spawn(n_realizations)
+    chunks = [seeds[k1:k1 + chunk_size] for k1 in range(0, n_realizations, chunk_size)]
+
+    statistics = {}
+
+    def aggregate(results):
+        for signals in results:
+            for name, values in signals.items():
+                if name not in statistics:
+                    statistics[name] = OnlineStatistics(quantiles)
+                statistics[name].update(values)
+
+    if n_workers == 0:
+        for chunk in chunks:
+            aggregate(_run_realizations(sim_factory, signal_func, chunk, convergence, batched))
+    elif len(chunks) > 0:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            # results are returned in the order of the chunks
+            for results in pool.map(_run_realizations, [sim_factory]*len(chunks), [signal_func]*len(chunks), chunks, [convergence]*len(chunks), [batched]*len(chunks)):
+                aggregate(results)
+
+    return statistics
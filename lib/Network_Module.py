@@ -0,0 +1,150 @@
+# Coupling Graph Class
+
+"""
+
+Sparse coupling graphs for simulations of large networks of agents.
+
+Each agent is one member of an ES ensemble (lib.ExtremumSeekingEnsembleND), whose objective function depends on its own output and
+on the outputs of its neighbors in the graph. The couplings are stored as sparse matrices (node lists and edge lists), so that the
+memory and the cost per timestep grow with the number of edges instead of the square of the number of agents:
+- adjacency: weighted adjacency matrix (agents x agents)
+- incidence: signed edge-node incidence matrix (edges x agents), row e is +1 at the tail and -1 at the head of edge e
+- objective_matrices: the matrices G and W of lib.Objective_Function_Module.NetworkObjectiveFunction, for the local objective
+  of each agent psi_i = tracking_weight*(y_i - ystar_i)**2 + coupling_weight*sum over edges (i,j) of w_ij*(y_i - y_j - zstar_ij)**2
+
+A network simulation then has one system, one objective function and one ES ensemble, instead of one of each per agent,
+and every timestep is a few sparse products and vectorized updates over all agents.
+
+"""
+
+import numpy as np
+from scipy import sparse
+
+
+class CouplingGraph():
+    """
+    Undirected graph of couplings between n_agents agents
+
+    Inputs:
+    n_agents: int
+        number of agents (nodes)
+    edges: array of shape (n_edges, 2), optional
+        pairs of coupled agents (default is None, no edges)
+    weights: float or array of shape (n_edges,), optional
+        weight of each edge (default is 1.0)
+    """
+
+    def __init__(self, n_agents, edges=None, weights=1.0):
+
+        self.n_agents = int(n_agents) # number of agents
+
+        if edges is None:
+            edges = np.zeros((0,2), dtype=np.int64)
+        self.edges = np.asarray(edges, dtype=np.int64).reshape(-1,2) # node pairs of the edges
+
+        if self.edges.size > 0 and (self.edges.min() < 0 or self.edges.max() >= self.n_agents):
+            raise ValueError(f"edges must connect agents 0 to {self.n_agents - 1}")
+        if np.any(self.edges[:,0] == self.edges[:,1]):
+            raise ValueError("edges must connect two different agents")
+
+        self.n_edges = self.edges.shape[0] # number of edges
+
+        self.weights = np.broadcast_to(np.asarray(weights, dtype=float), (self.n_edges,)).copy() # edge weights
+
+    @classmethod
+    def ring(cls, n_agents, hops=1, weights=1.0):
+        """
+        Ring lattice: each agent is coupled to the agents up to hops positions away on each side
+
+        With hops >= n_agents/2, the pairs reached from both sides are coupled once, and an agent is not coupled to itself.
+        weights is a float, or an array with one value per generated pair (n_agents*hops), of which the kept pairs are used.
+        """
+
+        nodes = np.arange(n_agents)
+        edges = np.concatenate([np.stack([nodes, (nodes + h) % n_agents], axis=1) for h in range(1, hops + 1)])
+
+        # first occurrence of each pair of different agents, in the order generated
+        keep = np.flatnonzero(edges[:,0] != edges[:,1])
+        keep = keep[np.sort(np.unique(np.sort(edges[keep], axis=1), axis=0, return_index=True)[1])]
+        if np.ndim(weights) > 0:
+            weights = np.asarray(weights, dtype=float)[keep]
+        return cls(n_agents, edges[keep], weights)
+
+    @classmethod
+    def random(cls, n_agents, degree, seed=None, weights=1.0):
+        """
+        Random graph with about degree neighbors per agent (duplicate edges and self-loops are dropped)
+        """
+
+        rng = np.random.default_rng(seed)
+        n_edges = n_agents*degree//2
+        edges = rng.integers(0, n_agents, size=(n_edges,2))
+        edges = edges[edges[:,0] != edges[:,1]]
+        edges = np.unique(np.sort(edges, axis=1), axis=0)
+        return cls(n_agents, edges, weights)
+
+    @classmethod
+    def from_neighbors(cls, neighbors, weights=1.0):
+        """
+        Graph from a list of neighbor lists, neighbors[i] listing the agents coupled to agent i (each edge listed once or twice)
+        """
+
+        edges = [(i, j) for i, nbrs in enumerate(neighbors) for j in nbrs]
+        edges = np.unique(np.sort(np.asarray(edges, dtype=np.int64).reshape(-1,2), axis=1), axis=0)
+        return cls(len(neighbors), edges, weights)
+
+    def incidence(self):
+        """
+        Signed incidence matrix (edges x agents), +1 at the first and -1 at the second agent of each edge
+        """
+
+        rows = np.repeat(np.arange(self.n_edges), 2)
+        data = np.tile([1.0, -1.0], self.n_edges)
+        return sparse.csr_matrix((data, (rows, self.edges.ravel())), shape=(self.n_edges,self.n_agents))
+
+    def adjacency(self):
+        """
+        Symmetric weighted adjacency matrix (agents x agents)
+        """
+
+        i = np.concatenate([self.edges[:,0], self.edges[:,1]])
+        j = np.concatenate([self.edges[:,1], self.edges[:,0]])
+        w = np.concatenate([self.weights, self.weights])
+        return sparse.csr_matrix((w, (i, j)), shape=(self.n_agents,self.n_agents))
+
+    def degree(self):
+        """
+        Number of neighbors of each agent
+        """
+
+        return np.bincount(self.edges.ravel(), minlength=self.n_agents)
+
+    def laplacian(self):
+        """
+        Weighted graph Laplacian (agents x agents)
+        """
+
+        A = self.adjacency()
+        return sparse.diags(np.asarray(A.sum(axis=1)).ravel()) - A
+
+    def objective_matrices(self, tracking_weight=1.0, coupling_weight=1.0):
+        """
+        Matrices G and W of the local objective functions of the agents (see NetworkObjectiveFunction), with one output per agent
+
+        The local terms are z = G@y = [y; y_i - y_j for each edge (i,j)], and the objective function value of agent i is
+        (W@z**2)_i = tracking_weight*z_i**2 + coupling_weight*sum over the edges of agent i of w_ij*z_ij**2.
+        The reference zstar of NetworkObjectiveFunction is then [ystar; desired differences along the edges].
+
+        Outputs:
+        G: sparse matrix of shape (n_agents + n_edges, n_agents)
+        W: sparse matrix of shape (n_agents, n_agents + n_edges)
+        """
+
+        D = self.incidence()
+        G = sparse.vstack([sparse.identity(self.n_agents, format="csr"), D], format="csr")
+
+        # each edge term is charged to both of its agents
+        E = abs(D).T@sparse.diags(coupling_weight*self.weights)
+        W = sparse.hstack([tracking_weight*sparse.identity(self.n_agents, format="csr"), E], format="csr")
+
+        return G, W
@@ -0,0 +1,272 @@
+# Noise and Disturbance Classes
+
+"""
+
+Measurement noise and disturbance models, attached to systems (added to the outputs y) and objective functions (added to psi)
+through their noise argument.
+
+A model draws its random values from its own numpy Generator in blocks of timesteps (one array of shape (block_length,) + signal shape
+per block), so that the cost per timestep is an array lookup instead of a call to the generator. The values of a model are
+reproducible from its seed; seed_noise seeds all the models of a simulation from one numpy SeedSequence, with an independent
+child stream per model, which is how lib.MonteCarlo_Module gives every realization its own independent, reproducible streams.
+
+For a batched simulation of R realizations (e.g. a NonlinearSystem of R copies driven by an ExtremumSeekingEnsembleND of R members),
+seed_noise takes a list of R seeds: the signals are split along their leading axis into R rows, one per realization (the stacked
+outputs of each copy), and every block of a model is one array for all realizations, whose row i is drawn from the stream of seed i.
+Row i then has the values of the same model seeded with seed i on the signal of a single realization.
+
+Models are stepped forward in time, one timestep after the other. After a simulation is restored from a checkpoint, the models
+continue their streams from where they are, and do not repeat the values of the interrupted run.
+
+Several models may be given as a list, and their values are added (e.g. [GaussianNoise(0.01), StepDisturbance(50.0, 0.2)]).
+
+"""
+
+import numpy as np
+
+
+def noise_model(noise):
+    """
+    Noise model of a noise argument: None, a model, or a list of models (added)
+    """
+
+    if noise is None or hasattr(noise, "sample"):
+        return noise
+    return NoiseSum(noise)
+
+
+def spawn_seeds(seed, n):
+    """
+    n independent child seeds of seed (int or numpy SeedSequence), or for a list of seeds (one per row of batched signals),
+    n lists of child seeds, with one child of every seed in each list
+    """
+
+    if isinstance(seed, (list, tuple)):
+        children = [spawn_seeds(row_seed, n) for row_seed in seed]
+        return [[row_children[k1] for row_children in children] for k1 in range(n)]
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    return seed.spawn(n)
+
+
+def seed_noise(sim, seed):
+    """
+    Seed the noise models of the systems and objective functions of a simulation, with independent child streams of seed
+
+    The models are seeded in the order of system_list then obj_list, so that the same seed gives the same values for the same simulation.
+
+    Inputs:
+    sim: Simulation
+    seed: int or numpy SeedSequence, or list of them
+        seed of the simulation, or of each realization of a batched simulation (see the module documentation)
+    """
+
+    models = [c.noise for c in sim.system_list + sim.obj_list if getattr(c, "noise", None) is not None]
+    for model, child in zip(models, spawn_seeds(seed, len(models))):
+        model.seed(child)
+
+
+class GaussianNoise():
+    """
+    White Gaussian noise of standard deviation std (and mean mean) on every element of the signal, drawn in blocks of timesteps
+
+    Inputs:
+    std: float or array broadcastable to the signal shape
+        standard deviation
+    mean: float or array broadcastable to the signal shape, optional
+        mean, e.g. a constant bias (default is 0.0)
+    seed: int or numpy SeedSequence, or list of them, optional
+        seed of the random stream, or of the stream of each row of the signal (default is None, fresh entropy)
+    block_length: int, optional
+        number of timesteps drawn at once (default is None, up to 1024 with at most 2**20 values per block)
+    """
+
+    def __init__(self, std, mean=0.0, seed=None, block_length=None):
+
+        self.std = np.asarray(std, dtype=float) # standard deviation
+
+        self.mean = np.asarray(mean, dtype=float) # mean
+
+        self.block_length = block_length # number of timesteps per block
+
+        self.shape = None # signal shape
+
+        self.seed(seed)
+
+    def seed(self, seed=None):
+        """
+        Restart the random stream from seed, or the streams of the rows of the signal from a list of seeds (one per row)
+        """
+
+        if isinstance(seed, (list, tuple)):
+            self.rng = None
+            self.row_rngs = [np.random.default_rng(row_seed) for row_seed in seed] # random streams of the rows of the signal
+        else:
+            self.rng = np.random.default_rng(seed) # random stream
+            self.row_rngs = None
+        self.block = None # values of the current block of timesteps
+        self.kt_block = None # first timestep of the current block
+
+    def prepare(self, component, shape):
+        """
+        Set up the model for the signal of a component (with its timestep dT and time_at), of the given shape
+        """
+
+        self.shape = tuple(shape)
+        self.dT = component.dT
+        self.time_at = component.time_at
+        if self.block_length is None:
+            self.block_length = int(max(1, min(1024, 2**20//max(1, int(np.prod(self.shape))))))
+
+    def draw(self, kt, n):
+        """
+        Values of n timesteps from timestep kt, array of shape (n,) + signal shape
+        """
+
+        return self.mean + self.std*self.standard_normal(n)
+
+    def standard_normal(self, n):
+        """
+        Standard normal values of n timesteps, array of shape (n,) + signal shape, from the random stream, or row by row from the
+        streams of the rows
+        """
+
+        if self.row_rngs is None:
+            return self.rng.standard_normal((n,) + self.shape)
+
+        n_rows = len(self.row_rngs)
+        if len(self.shape) == 0 or self.shape[0] % n_rows != 0:
+            raise ValueError(f"a signal of shape {self.shape} cannot be split into {n_rows} rows")
+        row_shape = (self.shape[0]//n_rows,) + self.shape[1:]
+        w = np.empty((n, n_rows) + row_shape)
+        for k1, rng in enumerate(self.row_rngs):
+            w[:,k1] = rng.standard_normal((n,) + row_shape)
+        return w.reshape((n,) + self.shape)
+
+    def sample(self, kt):
+        """
+        Value of timestep kt, array of the signal shape (timesteps are sampled in increasing order)
+        """
+
+        if self.block is None or not self.kt_block <= kt < self.kt_block + self.block_length:
+            self.kt_block = kt
+            self.block = self.draw(kt, self.block_length)
+        return self.block[kt - self.kt_block]
+
+
+class ColoredNoise(GaussianNoise):
+    """
+    First-order Gauss-Markov (Ornstein-Uhlenbeck) noise of stationary standard deviation std and correlation time tau [s],
+    a slowly drifting disturbance for tau much longer than the timestep (white noise as tau goes to 0)
+
+    The process is x[k] = a*x[k-1] + sqrt(1 - a**2)*std*w[k] with a = exp(-dT/tau) and white Gaussian w, started from its stationary
+    distribution, and each block is generated with one linear filter along the timesteps.
+
+    Inputs:
+    std: float or array broadcastable to the signal shape
+        stationary standard deviation
+    tau: float
+        correlation time [s]
+    mean, seed, block_length: as GaussianNoise
+    """
+
+    def __init__(self, std, tau, mean=0.0, seed=None, block_length=None):
+
+        self.tau = tau # correlation time
+
+        GaussianNoise.__init__(self, std, mean, seed, block_length)
+
+    def seed(self, seed=None):
+
+        GaussianNoise.seed(self, seed)
+        self.state = None # unit-variance process at the last drawn timestep
+
+    def draw(self, kt, n):
+
+        from scipy.signal import lfilter
+
+        a = np.exp(-self.dT/self.tau)
+        c = np.sqrt(1 - a**2)
+        w = self.standard_normal(n)
+        x = np.empty_like(w)
+        # stationary start
+        if self.state is None:
+            x[0] = w[0]
+            w = w[1:]
+            self.state = x[0]
+        if len(w) > 0:
+            x[n - len(w):] = lfilter([c], [1.0, -a], w, axis=0, zi=(a*self.state)[None])[0]
+        self.state = x[-1]
+        return self.mean + self.std*x
+
+
+class StepDisturbance():
+    """
+    Deterministic disturbance stepping from 0 to magnitude at time t_step [s] (a ramp of duration t_ramp if given)
+
+    Inputs:
+    t_step: float
+        time of the step
+    magnitude: float or array broadcastable to the signal shape
+        value after the step
+    t_ramp: float, optional
+        duration of a linear ramp to magnitude (default is 0.0, a step)
+    """
+
+    def __init__(self, t_step, magnitude, t_ramp=0.0):
+
+        self.t_step = t_step # time of the step
+
+        self.magnitude = np.asarray(magnitude, dtype=float) # value after the step
+
+        self.t_ramp = t_ramp # ramp duration
+
+        self.shape = None # signal shape
+
+    def seed(self, seed=None):
+        pass
+
+    def prepare(self, component, shape):
+
+        self.shape = tuple(shape)
+        self.time_at = component.time_at
+
+    def sample(self, kt):
+
+        t = self.time_at(kt)
+        if self.t_ramp > 0:
+            fraction = min(max((t - self.t_step)/self.t_ramp, 0.0), 1.0)
+        else:
+            fraction = 1.0 if t >= self.t_step else 0.0
+        return np.broadcast_to(fraction*self.magnitude, self.shape)
+
+
+class NoiseSum():
+    """
+    Sum of the values of several noise and disturbance models
+    """
+
+    def __init__(self, models):
+
+        self.models = [noise_model(model) for model in models] # added models
+
+    def seed(self, seed=None):
+        """
+        Seed the models with independent child streams of seed (or of each seed of a list)
+        """
+
+        for model, child in zip(self.models, spawn_seeds(seed, len(self.models))):
+            model.seed(child)
+
+    def prepare(self, component, shape):
+
+        self.shape = tuple(shape)
+        for model in self.models:
+            model.prepare(component, shape)
+
+    def sample(self, kt):
+
+        value = np.zeros(self.shape)
+        for model in self.models:
+            value = value + model.sample(kt)
+        return value
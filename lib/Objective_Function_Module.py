@@ -1,21 +1,233 @@
 import numpy as np
 
-class ObjectiveFunction():
+from lib.History_Module import HistoryBuffer
+from lib.Noise_Module import noise_model
+
+class BuiltinObjective():
+    """
+    Base class of the built-in objective functions, evaluated natively by ObjectiveFunction and vectorized over batches and time windows
+    
+    A built-in objective function is called as obj_func(y, ystar), as user objective functions, with y and ystar of shape (ny,)
+    (one timestep) or (ny, ...) (outputs along the first axis, e.g. (ny, len(time)) for a time window or (ny, batch, len(time))),
+    ystar broadcastable to y, and returns psi of shape y.shape[1:]. gradient(y, ystar) returns the analytic gradient dpsi/dy, of
+    the shape of y, e.g. to measure the accuracy of the gradient estimate xihat of an ES controller.
+    
+    ObjectiveFunction does not call a built-in objective function through obj_func(y, ystar) at each timestep: bind(ny) returns
+    the evaluation of one timestep with its parameters broadcast to the ny outputs and its work arrays allocated once, which writes
+    the error and its products into the work arrays instead of allocating temporaries.
+    """
+    
+    def __call__(self, y, ystar=None):
+        
+        return self.evaluate(y, ystar)
+    
+    def bind(self, ny):
+        """
+        Evaluation of one timestep, f(y, ystar) with y of shape (ny,) and ystar of shape (ny,) or a scalar, prepared for ny outputs
+        """
+        
+        return self.evaluate
+    
+    def error(self, y, ystar=None):
+        """
+        Tracking error y - ystar
+        """
+        
+        if ystar is None:
+            return np.asarray(y, dtype=float)
+        return np.subtract(y, ystar)
+    
+    def weight_array(self, weights, e):
+        """
+        Weights of the outputs, broadcast along the trailing axes of e
+        """
+        
+        if np.ndim(weights) == 1 and e.ndim > 1:
+            return weights.reshape((-1,) + (1,)*(e.ndim - 1))
+        return weights
+
+
+class SumSquaredError(BuiltinObjective):
+    """
+    Weighted sum of squared errors psi = sum_i w_i*(y_i - ystar_i)**2
+    
+    Inputs:
+    weights: float or array of shape (ny,), optional
+        weight of each output (default is None, 1 for all outputs)
+    """
+    
+    def __init__(self, weights=None):
+        
+        self.weights = None if weights is None else np.asarray(weights, dtype=float) # weight of each output
+        
+    def evaluate(self, y, ystar=None):
+        
+        e = y - ystar if ystar is not None else np.asarray(y, dtype=float)
+        if self.weights is None:
+            return np.add.reduce(e*e, axis=0)
+        w = self.weights if e.ndim == 1 else self.weight_array(self.weights, e)
+        return np.add.reduce(w*(e*e), axis=0)
+    
+    def bind(self, ny):
+        
+        e = np.empty(ny) # error, then weighted squared error
+        w = None if self.weights is None else np.array(np.broadcast_to(self.weights, (ny,)))
+        
+        def evaluate_step(y, ystar):
+            np.subtract(y, ystar, out=e)
+            np.multiply(e, e, out=e)
+            if w is not None:
+                np.multiply(w, e, out=e)
+            return np.add.reduce(e)
+        
+        return evaluate_step
+    
+    def gradient(self, y, ystar=None):
+        
+        e = self.error(y, ystar)
+        if self.weights is None:
+            return 2*e
+        return 2*self.weight_array(self.weights, e)*e
+
+
+class WeightedNorm(BuiltinObjective):
+    """
+    Weighted p-norm of the errors psi = (sum_i w_i*|y_i - ystar_i|**p)**(1/p)
+    
+    The gradient is not defined at zero error, where it is set to zero.
+    
+    Inputs:
+    weights: float or array of shape (ny,), optional
+        weight of each output (default is None, 1 for all outputs)
+    p: float, optional
+        order of the norm, at least 1 (default is 2)
+    """
     
-    def __init__(self, time, dT, obj_func=None, ystar=None):
+    def __init__(self, weights=None, p=2):
+        
+        if p < 1:
+            raise ValueError(f"the order of the norm must be at least 1, not {p}")
+        self.p = float(p) # order of the norm
+        
+        self.weights = None if weights is None else np.asarray(weights, dtype=float) # weight of each output
+        
+    def evaluate(self, y, ystar=None):
+        
+        e = np.abs(self.error(y, ystar))
+        w = 1.0 if self.weights is None else self.weight_array(self.weights, e)
+        if self.p == 2:
+            return np.sqrt(np.add.reduce(w*(e*e), axis=0))
+        if self.p == 1:
+            return np.add.reduce(w*e, axis=0)
+        return np.add.reduce(w*e**self.p, axis=0)**(1/self.p)
+    
+    def gradient(self, y, ystar=None):
+        
+        e = self.error(y, ystar)
+        w = 1.0 if self.weights is None else self.weight_array(self.weights, e)
+        norm = self.evaluate(y, ystar)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            g = w*np.sign(e)*np.abs(e)**(self.p - 1)*norm**(1 - self.p)
+        return np.where(norm > 0, g, 0.0)
+
+
+class QuadraticForm(BuiltinObjective):
+    """
+    Quadratic form of the errors psi = e^T Q e + c^T e + r, with e = y - ystar
+    
+    Inputs:
+    Q: array of shape (ny, ny)
+        quadratic weight (not necessarily symmetric)
+    c: array of shape (ny,), optional
+        linear weight (default is None, zero)
+    r: float, optional
+        constant (default is 0.0)
+    """
+    
+    def __init__(self, Q, c=None, r=0.0):
+        
+        self.Q = np.atleast_2d(np.asarray(Q, dtype=float)) # quadratic weight
+        
+        self.Qs = self.Q + self.Q.T # symmetric part (times 2), for the gradient
+        
+        self.c = None if c is None else np.asarray(c, dtype=float) # linear weight
+        
+        self.r = float(r) # constant
+        
+    def evaluate(self, y, ystar=None):
+        
+        e = self.error(y, ystar)
+        # contract the outputs axis of Q@e with e
+        psi = np.add.reduce(e*np.tensordot(self.Q, e, axes=1), axis=0)
+        if self.c is not None:
+            psi = psi + np.tensordot(self.c, e, axes=1)
+        return psi + self.r
+    
+    def bind(self, ny):
+        
+        e = np.empty(ny) # error
+        Qe = np.empty(ny) # Q@e, then e*(Q@e)
+        
+        def evaluate_step(y, ystar):
+            np.subtract(y, ystar, out=e)
+            np.dot(self.Q, e, out=Qe)
+            np.multiply(e, Qe, out=Qe)
+            psi = np.add.reduce(Qe)
+            if self.c is not None:
+                psi = psi + np.dot(self.c, e)
+            return psi + self.r
+        
+        return evaluate_step
+    
+    def gradient(self, y, ystar=None):
+        
+        e = self.error(y, ystar)
+        g = np.tensordot(self.Qs, e, axes=1)
+        if self.c is not None:
+            g = g + self.weight_array(self.c, e)
+        return g
+
+
+class ObjectiveFunction(HistoryBuffer):
+    """
+    If streaming is True, the psi and y arrays are ring buffers holding history_length recent timesteps,
+    and ystar (if given) is a constant reference signal.
+    With a recording policy (lib.History_Module.RecordingPolicy), only the selected signals are kept, in the record dictionary.
+    With noise (a model of lib.Noise_Module, or a list of models), noise and disturbances are added to the objective function value psi.
+    
+    obj_func is called as obj_func(y, ystar) at every timestep, with the measurements y (ny,) and the reference of the timestep:
+    a row of ystar of shape (ny,) for ystar of shape (ny, len(time)), or a scalar for ystar of shape (len(time),).
+    The built-in objective functions (SumSquaredError, WeightedNorm, QuadraticForm) are recognized and evaluated natively: their
+    evaluation of one timestep is bound once in set_system_list (BuiltinObjective.bind), with parameters and work arrays prepared for
+    the measurements, instead of calling obj_func(y, ystar); they also give the analytic gradient of psi with respect to y
+    (objective_gradient).
+    """
+    
+    history_signals = ["psi", "y"] # signal arrays (time along the last axis)
+    
+    def __init__(self, time, dT, obj_func=None, ystar=None, streaming=False, history_length=None, recording=None, noise=None):
         
         self.time = time # time array
         
         self.dT = dT # timestep
         
+        self.init_history(time, dT, streaming, history_length, recording) # number of stored timesteps
+        
         self.objective_function = obj_func # objective function
         
         self.ystar = ystar # reference signal
         
-        self.psi = np.zeros(len(self.time)) # objective function value
+        self.psi = np.zeros(self.buffer_length) # objective function value
+        
+        # noise and disturbances on the objective function value
+        self.noise = noise_model(noise)
+        if self.noise is not None:
+            self.noise.prepare(self, ())
         
         self.sys_list = None # list of systems
         
+        self.evaluate_step = None # native evaluation of one timestep of a built-in objective function (None: obj_func is called)
+        
     # set list of systems from which outputs values are used to calculate objective function value
     # system outputs are stacked vertically
     def set_system_list(self, sys_list):
@@ -26,31 +238,178 @@ class ObjectiveFunction():
         self.ny = 0
         for k1, sys in enumerate(self.sys_list):
             self.ny = self.ny + sys.ny
-        self.y = np.zeros((self.ny,len(self.time)))
+        self.y = np.zeros((self.ny,self.buffer_length))
+        
+        # built-in objective functions are evaluated natively
+        if isinstance(self.objective_function, BuiltinObjective):
+            self.evaluate_step = self.objective_function.bind(self.ny)
+        else:
+            self.evaluate_step = None
         
         # redefine reference signal if None given
-        if self.ystar is None:
+        if self.ystar is None and self.streaming:
+            self.ystar = np.zeros((self.ny,1))
+        elif self.ystar is None:
             self.ystar = np.zeros((self.ny,len(self.time)))
+        # in streaming mode, the reference signal is constant
+        elif self.streaming:
+            self.ystar = np.asarray(self.ystar).reshape(-1,1)
         
     # receive measurements from system(s) in sys_list
-    def get_measurements(self, kt):
+    # if y is given (e.g. gathered by a simulation with compiled routing), use it as the stacked measurements
+    def get_measurements(self, kt, y=None):
+
+        k = self.buffer_index(kt)
+        if y is not None:
+            self.y[:,k] = np.reshape(y,-1)
+            return
 
         # stack system output measurements vertically
         ytemp = np.zeros((0,1))
         for k1, sys in enumerate(self.sys_list):
-            ytemp = np.vstack((ytemp, sys.y[:,kt:kt+1]))            
+            ksys = sys.buffer_index(kt)
+            ytemp = np.vstack((ytemp, sys.y[:,ksys:ksys+1]))            
         # ytemp = ytemp[1:,:]
-        self.y[:,kt:kt+1] = ytemp
+        self.y[:,k:k+1] = ytemp
 
     # calculate objective function value
     def compute_objective_function(self, kt):
 
-        # if no reference signal, calculate objective function value assuming reference of 0 for all outputs
-        if self.ystar is None:
-            self.psi[kt] = self.objective_function(self.y[:,kt])
-        # if reference signal exists, calculate objective function value
+        k = self.buffer_index(kt) # column of the current timestep
+        self.kt_last = kt
+
+        # reference signal column (constant reference in streaming mode)
+        kref = kt
+        if self.streaming:
+            kref = 0
+
+        # reference of the timestep: a row of the transposed (ny, len(time)) reference, or a scalar of a (len(time),) reference
+        ystar = np.asarray(self.ystar).T[kref]
+
+        # calculate objective function value (the reference is zero for all outputs if none was given)
+        if self.evaluate_step is not None:
+            self.psi[k] = self.evaluate_step(self.y[:,k], ystar)
+        else:
+            self.psi[k] = self.objective_function(self.y[:,k], ystar)
+
+        if self.noise is not None:
+            self.psi[k] += self.noise.sample(kt) # noise and disturbances
+
+        self.record_step(kt) # copy recorded signals
+
+    def objective_gradient(self, kt, y=None):
+        """
+        Analytic gradient of the objective function with respect to the measurements at timestep kt (built-in objective functions),
+        at the stored measurements of timestep kt, or at y if given
+        """
+
+        if not hasattr(self.objective_function, "gradient"):
+            raise TypeError("the analytic gradient requires a built-in objective function (SumSquaredError, WeightedNorm or QuadraticForm)")
+        if y is None:
+            y = self.y[:,self.buffer_index(kt)]
+        kref = 0 if self.streaming else kt
+        return self.objective_function.gradient(y, np.asarray(self.ystar).T[kref])
+
+
+class NetworkObjectiveFunction(HistoryBuffer):
+    """
+    Vector of local objective functions of a network of agents, evaluated together from sparse coupling matrices
+    
+    The measurements y (stacked outputs of the systems in sys_list) are mapped to local terms z = G@y - zstar, and the
+    objective function value of each agent is psi = W@f(z), with f(z) = z**2 by default (obj_func gives another elementwise f).
+    G (terms x outputs) and W (agents x terms) are sparse matrices, e.g. built by lib.Network_Module.CouplingGraph, so that the
+    local objectives of thousands of agents are computed with two sparse products per timestep instead of one callback per agent.
+    
+    psi has shape (number of agents, time), and is received as a vector by an ES ensemble (ExtremumSeekingEnsembleND).
+    zstar may be None (zero), constant (terms,), or along time (terms, len(time)).
+    With noise (a model of lib.Noise_Module, or a list of models), noise and disturbances are added to the objective function values psi.
+    """
+    
+    history_signals = ["psi", "y"] # signal arrays (time along the last axis)
+    
+    def __init__(self, time, dT, G, W, zstar=None, obj_func=None, streaming=False, history_length=None, recording=None, noise=None):
+        
+        from scipy import sparse
+        
+        self.time = time # time array
+        
+        self.dT = dT # timestep
+        
+        self.init_history(time, dT, streaming, history_length, recording) # number of stored timesteps
+        
+        self.G = sparse.csr_matrix(G) # outputs -> local terms
+        
+        self.W = sparse.csr_matrix(W) # local terms -> agents
+        
+        if self.W.shape[1] != self.G.shape[0]:
+            raise ValueError(f"W has {self.W.shape[1]} columns, expected the {self.G.shape[0]} rows of G")
+        
+        self.n_psi = self.W.shape[0] # number of objective function values (agents)
+        
+        self.objective_function = obj_func # elementwise cost of the local terms (None: squares)
+        
+        # reference of the local terms
+        self.zstar = None
+        if zstar is not None:
+            self.zstar = np.asarray(zstar, dtype=float)
+            if self.zstar.ndim == 2 and self.zstar.shape[1] == 1:
+                self.zstar = self.zstar[:,0]
+        
+        self.psi = np.zeros((self.n_psi,self.buffer_length)) # objective function values
+        
+        self.z = np.zeros(self.G.shape[0]) # local terms of the current timestep
+        
+        # noise and disturbances on the objective function values
+        self.noise = noise_model(noise)
+        if self.noise is not None:
+            self.noise.prepare(self, (self.n_psi,))
+        
+        self.sys_list = None # list of systems
+        
+    # set list of systems from which outputs values are used to calculate objective function values
+    # system outputs are stacked vertically
+    def set_system_list(self, sys_list):
+        
+        self.sys_list = sys_list # system list
+        
+        self.ny = 0
+        for k1, sys in enumerate(self.sys_list):
+            self.ny = self.ny + sys.ny
+        if self.G.shape[1] != self.ny:
+            raise ValueError(f"G has {self.G.shape[1]} columns, expected the {self.ny} outputs of the systems")
+        self.y = np.zeros((self.ny,self.buffer_length))
+        
+    # receive measurements from system(s) in sys_list
+    def get_measurements(self, kt, y=None):
+        
+        k = self.buffer_index(kt)
+        if y is not None:
+            self.y[:,k] = np.reshape(y,-1)
+            return
+        
+        self.y[:,k] = np.concatenate([sys.y[:,sys.buffer_index(kt)] for sys in self.sys_list])
+        
+    # calculate objective function values of all agents
+    def compute_objective_function(self, kt):
+        
+        k = self.buffer_index(kt) # column of the current timestep
+        self.kt_last = kt
+        
+        # local terms
+        z = self.G@self.y[:,k]
+        if self.zstar is not None:
+            if self.zstar.ndim == 1:
+                z -= self.zstar
+            else:
+                z -= self.zstar[:,kt]
+        self.z = z
+        
+        if self.objective_function is None:
+            self.psi[:,k] = self.W@(z*z)
         else:
-            if self.ystar.ndim == 1:
-                self.psi[kt] = self.objective_function(self.y[:,kt], self.ystar[kt])
-            if self.ystar.ndim == 2:
-                self.psi[kt] = self.objective_function(self.y[:,kt], self.ystar[:,kt])
\ No newline at end of file
+            self.psi[:,k] = self.W@self.objective_function(z)
+        
+        if self.noise is not None:
+            self.psi[:,k] += self.noise.sample(kt) # noise and disturbances
+        
+        self.record_step(kt) # copy recorded signals
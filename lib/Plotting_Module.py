@@ -2,12 +2,215 @@
 
 """
 
-Comments here
+Plots of the signals of a simulation: objective function(s), system output(s), and the setpoint, control and internal signals
+of the ES controllers.
+
+By default, every figure is shown interactively (plt.show) with the full-resolution arrays.
+
+For long runs (10**6 timesteps and more), render_es_results renders the figures headless to image files with the non-interactive
+Agg backend, optionally in parallel worker processes (one figure per task), and every line is downsampled to at most max_points
+points before it is passed to matplotlib:
+- "minmax": the first, minimum, maximum and last points of each bucket of timesteps, which keeps the envelope of oscillating
+  signals (e.g. the dither) and every spike
+- "lttb": largest-triangle-three-buckets, one point per bucket chosen to keep the visual shape of the curve
+configure_rendering sets the same options for direct calls of the plot functions.
 
 """
 
+import os
+
 import numpy as np
-import matplotlib.pyplot as plt
+
+
+class _LazyPyplot():
+    """
+    matplotlib.pyplot, imported on first use, so that importing this module does not import matplotlib
+    """
+    
+    def __getattr__(self, name):
+        
+        import matplotlib.pyplot
+        return getattr(matplotlib.pyplot, name)
+
+
+plt = _LazyPyplot()
+
+
+DOWNSAMPLE_METHODS = ["minmax", "lttb"]
+
+# figures of plot_es_results, rendered by plot_<name>
+FIGURES = ["objective_function", "output", "setpoint_and_control", "rho", "eps", "sigma", "xihat"]
+
+# rendering options of the plot functions, set by configure_rendering
+_render_options = {
+    "directory": None, # directory of the image files (None: figures are shown)
+    "max_points": None, # maximum number of points per line (None: full resolution)
+    "method": "minmax", # downsampling method
+    "format": "png", # image file format
+    "dpi": 100, # image resolution
+}
+
+_shown_backend = None # pyplot backend before configure_rendering switched to Agg (None: not switched)
+
+_render_job = None # arguments of the plot functions, shared with the worker processes of render_es_results
+
+
+def minmax_downsample(x, y, max_points):
+    """
+    Downsample a line to at most max_points points, keeping the first, minimum, maximum and last point of each bucket of samples
+    
+    Inputs:
+    x, y: arrays of shape (n,)
+    max_points: int
+        maximum number of points (at least 4)
+    
+    Outputs:
+    x, y at the kept samples, in their original order
+    """
+    
+    x = np.asarray(x)
+    y = np.asarray(y)
+    n = len(y)
+    if n <= max_points:
+        return x, y
+    
+    # buckets of b samples, the last one padded with its final sample
+    n_buckets = max(1, max_points//4)
+    b = -(-n//n_buckets)
+    padded = np.concatenate((y, np.repeat(y[-1:], n_buckets*b - n))).reshape(n_buckets,b)
+    offsets = b*np.arange(n_buckets)
+    first = offsets
+    last = np.minimum(offsets + b - 1, n - 1)
+    imin = np.minimum(offsets + np.argmin(padded, axis=1), n - 1)
+    imax = np.minimum(offsets + np.argmax(padded, axis=1), n - 1)
+    
+    idx = np.unique(np.concatenate((first, imin, imax, last)))
+    return x[idx], y[idx]
+
+
+def lttb_downsample(x, y, max_points):
+    """
+    Downsample a line to max_points points with the largest-triangle-three-buckets algorithm
+    
+    The first and last samples are kept, and the other samples are split into max_points - 2 buckets. In each bucket, the kept
+    sample forms the largest triangle with the sample kept in the previous bucket and the mean of the next bucket.
+    
+    Inputs:
+    x, y: arrays of shape (n,)
+    max_points: int
+        number of points (at least 3)
+    
+    Outputs:
+    x, y at the kept samples, in their original order
+    """
+    
+    x = np.asarray(x)
+    y = np.asarray(y)
+    n = len(y)
+    if n <= max_points or max_points < 3:
+        return x, y
+    
+    xf = x.astype(float)
+    yf = y.astype(float)
+    edges = np.linspace(1, n - 1, max_points - 1).astype(int) # bucket boundaries of samples 1 to n-2
+    
+    # mean of each bucket, and of the last sample as the bucket following the last bucket
+    counts = np.diff(edges)
+    x_mean = np.append(np.add.reduceat(xf[:n - 1], edges[:-1])/counts, xf[-1])
+    y_mean = np.append(np.add.reduceat(yf[:n - 1], edges[:-1])/counts, yf[-1])
+    
+    idx = np.zeros(max_points, dtype=np.int64)
+    idx[-1] = n - 1
+    a = 0
+    for kb in range(max_points - 2):
+        lo = edges[kb]
+        hi = edges[kb + 1]
+        # twice the area of the triangles (a, sample, mean of next bucket)
+        area = np.abs((xf[a] - x_mean[kb + 1])*(yf[lo:hi] - yf[a]) - (xf[a] - xf[lo:hi])*(y_mean[kb + 1] - yf[a]))
+        a = lo + int(np.argmax(area))
+        idx[kb + 1] = a
+    
+    return x[idx], y[idx]
+
+
+def downsample(x, y, max_points, method="minmax"):
+    """
+    Downsample a line with the given method (see DOWNSAMPLE_METHODS)
+    """
+    
+    if method == "minmax":
+        return minmax_downsample(x, y, max_points)
+    elif method == "lttb":
+        return lttb_downsample(x, y, max_points)
+    raise ValueError(f"unknown downsampling method: {method}, expected one of {DOWNSAMPLE_METHODS}")
+
+
+def configure_rendering(directory=None, max_points=None, method="minmax", fmt="png", dpi=100):
+    """
+    Set how the plot functions render their figures
+    
+    Inputs:
+    directory: str, optional
+        directory of the image files, <directory>/<figure>.<fmt>, rendered with the Agg backend (default is None, figures are shown,
+        with the backend that was in use before the figures were rendered to files)
+    max_points: int, optional
+        maximum number of points per line, downsampled with method (default is None, full resolution)
+    method: str, optional
+        "minmax" or "lttb" (default is "minmax")
+    fmt: str, optional
+        image file format (default is "png")
+    dpi: int, optional
+        image resolution (default is 100)
+    """
+    
+    if method not in DOWNSAMPLE_METHODS:
+        raise ValueError(f"unknown downsampling method: {method}, expected one of {DOWNSAMPLE_METHODS}")
+    
+    global _shown_backend
+    
+    if directory is not None:
+        if _shown_backend is None:
+            _shown_backend = plt.get_backend()
+        plt.switch_backend("Agg")
+        os.makedirs(directory, exist_ok=True)
+    elif _shown_backend is not None:
+        plt.switch_backend(_shown_backend)
+        _shown_backend = None
+    
+    _render_options.update({"directory": directory, "max_points": max_points, "method": method, "format": fmt, "dpi": dpi})
+
+
+def _plot(x, y, *args, **kwargs):
+    """
+    plt.plot of one line (or the columns of y), downsampled to the max_points of the rendering options
+    """
+    
+    max_points = _render_options["max_points"]
+    y = np.asarray(y)
+    if max_points is None:
+        plt.plot(x, y, *args, **kwargs)
+        return
+    
+    if y.ndim == 1:
+        plt.plot(*downsample(x, y, max_points, _render_options["method"]), *args, **kwargs)
+        return
+    for ky in range(y.shape[1]):
+        plt.plot(*downsample(x, y[:,ky], max_points, _render_options["method"]), *args, **kwargs)
+        kwargs.pop("label", None) # one legend entry for all columns
+
+
+def _show(name):
+    """
+    Show the current figure, or save it as <directory>/<name>.<format> and close it
+    """
+    
+    directory = _render_options["directory"]
+    if directory is None:
+        plt.show()
+        return
+    
+    plt.savefig(os.path.join(directory, f"{name}.{_render_options['format']}"), dpi=_render_options["dpi"])
+    plt.close()
 
 
 def plot_es_results(time, dT, sim_list, sys_list, obj_list, es_list, ystar=None, thetastar=None):
@@ -26,17 +229,102 @@ def plot_es_results(time, dT, sim_list, sys_list, obj_list, es_list, ystar=None,
     
     plot_xihat(time, es_list)
 
+
+def render_es_results(time, dT, sim_list, sys_list, obj_list, es_list, directory, max_points=2000, method="minmax", fmt="png", dpi=100, workers=None):
+    """
+    Render the figures of plot_es_results headless to image files, with every line downsampled to at most max_points points
+    
+    Inputs:
+    time, dT, sim_list, sys_list, obj_list, es_list: as plot_es_results
+    directory: str
+        directory of the image files, <directory>/<figure>.<fmt> for each figure of FIGURES
+    max_points: int, optional
+        maximum number of points per line (default is 2000, None for full resolution)
+    method: str, optional
+        downsampling method, "minmax" or "lttb" (default is "minmax")
+    fmt: str, optional
+        image file format (default is "png")
+    dpi: int, optional
+        image resolution (default is 100)
+    workers: int, optional
+        number of worker processes rendering the figures in parallel (default is None, rendered in this process)
+        With the fork start method (Linux), the workers share the arrays of the simulation without copying them.
+    
+    Outputs:
+    list of the paths of the image files
+    """
+    
+    global _render_job
+    
+    from concurrent.futures import ProcessPoolExecutor
+    import multiprocessing
+    
+    options = {"directory": directory, "max_points": max_points, "method": method, "fmt": fmt, "dpi": dpi}
+    job = (time, sim_list, sys_list, obj_list, es_list, options)
+    
+    if workers is None or workers <= 1:
+        previous = dict(_render_options)
+        try:
+            _render_init(job)
+            for name in FIGURES:
+                _render_figure(name)
+        finally:
+            # previous options, and backend if the figures were shown
+            configure_rendering(previous["directory"], previous["max_points"], previous["method"], previous["format"], previous["dpi"])
+            _render_job = None
+    else:
+        if "fork" in multiprocessing.get_all_start_methods():
+            # the job is inherited by the forked workers instead of being pickled
+            _render_job = job
+            context = multiprocessing.get_context("fork")
+            initargs = (None,)
+        else:
+            context = multiprocessing.get_context()
+            initargs = (job,)
+        try:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_render_init, initargs=initargs) as executor:
+                list(executor.map(_render_figure, FIGURES))
+        finally:
+            _render_job = None
+    
+    return [os.path.join(directory, f"{name}.{fmt}") for name in FIGURES]
+
+
+def _render_init(job):
+    """
+    Set the rendering options and the arguments of the plot functions (in a worker process, or in this process)
+    """
+    
+    global _render_job
+    if job is not None:
+        _render_job = job
+    configure_rendering(**_render_job[5])
+
+
+def _render_figure(name):
+    """
+    Render one figure of FIGURES with the arguments of the current render job
+    """
+    
+    time, sim_list, sys_list, obj_list, es_list, options = _render_job
+    if name == "objective_function":
+        plot_objective_function(time, obj_list)
+    elif name == "output":
+        plot_output(time, sim_list, sys_list)
+    else:
+        globals()[f"plot_{name}"](time, es_list)
+
     
 def plot_objective_function(time, obj_list):
     
     plt.figure(figsize=(16,4), facecolor="w", edgecolor="k")
     for k1, obj in enumerate(obj_list):
-        plt.plot(time,obj.psi, label=f"Objective function {k1}")
+        _plot(time,obj.psi, label=f"Objective function {k1}")
     plt.title("Objective Function(s): " + r"$\Psi$")
     plt.xlabel("Time [s]")
     plt.legend()
     
-    plt.show()
+    _show("objective_function")
     
 
 def plot_output(time, sim_list, sys_list, ystar=None):
@@ -61,14 +349,14 @@ def plot_output(time, sim_list, sys_list, ystar=None):
     for k1, sys in enumerate(sys_list):
         if sys.ystar is not None:
             for ky in range(0,sys.ystar.shape[0]):
-                plt.plot(time,sys.ystar[ky,:].T,"--",label=f"System {k1} desired output {ky} (known)")
+                _plot(time,sys.ystar[ky,:].T,"--",label=f"System {k1} desired output {ky} (known)")
         for ky in range(0,sys.y.shape[0]):
-            plt.plot(time,sys.y[ky,:].T,"-",label=f"System {k1} output (measured): $y_{ky}$")
+            _plot(time,sys.y[ky,:].T,"-",label=f"System {k1} output (measured): $y_{ky}$")
     plt.title("System Output(s) and Reference Signal(s)")
     plt.xlabel("Time [s]")
     plt.legend()
     
-    plt.show()
+    _show("output")
     
     
 def plot_setpoint_and_control(time, es_list):
@@ -77,36 +365,36 @@ def plot_setpoint_and_control(time, es_list):
     for es in es_list:
         if es.nc == 1:
             if es.name == "":
-                plt.plot(time,es.thetahat.T,label="Setpoint " + r"$\hat{\theta}$")
-                plt.plot(time,es.theta.T,label="Control " + r"$\theta$")
+                _plot(time,es.thetahat.T,label="Setpoint " + r"$\hat{\theta}$")
+                _plot(time,es.theta.T,label="Control " + r"$\theta$")
             else:
-                plt.plot(time,es.thetahat.T,label=f"{es.name} Setpoint " + r"$\hat{\theta}$")
-                plt.plot(time,es.theta.T,label=f"{es.name} Control " + r"$\theta$")
+                _plot(time,es.thetahat.T,label=f"{es.name} Setpoint " + r"$\hat{\theta}$")
+                _plot(time,es.theta.T,label=f"{es.name} Control " + r"$\theta$")
         if es.nc == 2:
             if es.name == "":
-                plt.plot(time,es.thetahat[0,:].T,label="Setpoint Channel 1 " + r"$\hat{\theta}_{c}$")
-                plt.plot(time,es.theta[0,:].T,label="Control Channel 1 " + r"$\theta_{c}$")
-                plt.plot(time,es.thetahat[1,:].T,label="Setpoint Channel 2 " + r"$\hat{\theta}_{s}$")
-                plt.plot(time,es.theta[1,:].T,label="Control Channel 2 " + r"$\theta_{s}$")
+                _plot(time,es.thetahat[0,:].T,label="Setpoint Channel 1 " + r"$\hat{\theta}_{c}$")
+                _plot(time,es.theta[0,:].T,label="Control Channel 1 " + r"$\theta_{c}$")
+                _plot(time,es.thetahat[1,:].T,label="Setpoint Channel 2 " + r"$\hat{\theta}_{s}$")
+                _plot(time,es.theta[1,:].T,label="Control Channel 2 " + r"$\theta_{s}$")
             else:
-                plt.plot(time,es.thetahat[0,:].T,label=f"{es.name} Setpoint Channel 1 " + r"$\hat{\theta}_{c}$")
-                plt.plot(time,es.theta[0,:].T,label=f"{es.name} Control Channel 1 " + r"$\theta_{c}$")
-                plt.plot(time,es.thetahat[1,:].T,label=f"{es.name} Setpoint Channel 2 " + r"$\hat{\theta}_{s}$")
-                plt.plot(time,es.theta[1,:].T,label=f"{es.name} Control Channel 2 " + r"$\theta_{s}$")
+                _plot(time,es.thetahat[0,:].T,label=f"{es.name} Setpoint Channel 1 " + r"$\hat{\theta}_{c}$")
+                _plot(time,es.theta[0,:].T,label=f"{es.name} Control Channel 1 " + r"$\theta_{c}$")
+                _plot(time,es.thetahat[1,:].T,label=f"{es.name} Setpoint Channel 2 " + r"$\hat{\theta}_{s}$")
+                _plot(time,es.theta[1,:].T,label=f"{es.name} Control Channel 2 " + r"$\theta_{s}$")
         if es.nc >= 3:
             if es.name == "":
                 for kc in range(0,es.nc):
-                    plt.plot(time,es.thetahat[kc,:].T,label=f"Setpoint Channel {kc} " + r"$\hat{\theta}$" + f"_{kc}")
-                    plt.plot(time,es.theta[kc,:].T,label=f"Control Channel {kc} " + r"$\hat{\theta}$" + f"_{kc}")
+                    _plot(time,es.thetahat[kc,:].T,label=f"Setpoint Channel {kc} " + r"$\hat{\theta}$" + f"_{kc}")
+                    _plot(time,es.theta[kc,:].T,label=f"Control Channel {kc} " + r"$\hat{\theta}$" + f"_{kc}")
             else:
                 for kc in range(0,es.nc):
-                    plt.plot(time,es.thetahat[kc,:].T,"--",label=f"{es.name} Setpoint Channel {kc} " + r"$\hat{\theta}$" + f"_{kc}")
-                    plt.plot(time,es.theta[kc,:].T,label=f"{es.name} Control Channel {kc} " + r"$\hat{\theta}$" + f"_{kc}")
+                    _plot(time,es.thetahat[kc,:].T,"--",label=f"{es.name} Setpoint Channel {kc} " + r"$\hat{\theta}$" + f"_{kc}")
+                    _plot(time,es.theta[kc,:].T,label=f"{es.name} Control Channel {kc} " + r"$\hat{\theta}$" + f"_{kc}")
     plt.title("ES Setpoint(s) and Control(s)")
     plt.xlabel("Time [s]")
     plt.legend()
     
-    plt.show()
+    _show("setpoint_and_control")
     
     
 def plot_rho(time, es_list):
@@ -115,28 +403,28 @@ def plot_rho(time, es_list):
     for es in es_list:
         if es.nc == 1:
             if es.name == "":
-                plt.plot(time,es.rho.T,label=r"$\rho$")
+                _plot(time,es.rho.T,label=r"$\rho$")
             else:
-                plt.plot(time,es.rho.T,label=f"{es.name} " + r"$\rho$")
+                _plot(time,es.rho.T,label=f"{es.name} " + r"$\rho$")
         if es.nc == 2:
             if es.name == "":
-                plt.plot(time,es.rho[0,:].T,label="Channel 1 $\rho_{c}$")
-                plt.plot(time,es.rho[1,:].T,label="Channel 2 $\rho_{s}$")
+                _plot(time,es.rho[0,:].T,label="Channel 1 $\rho_{c}$")
+                _plot(time,es.rho[1,:].T,label="Channel 2 $\rho_{s}$")
             else:
-                plt.plot(time,es.rho[0,:].T,label=f"{es.name} Channel 1 " + r"$\rho_{c}$")
-                plt.plot(time,es.rho[1,:].T,label=f"{es.name} Channel 2 " + r"$\rho_{s}$")
+                _plot(time,es.rho[0,:].T,label=f"{es.name} Channel 1 " + r"$\rho_{c}$")
+                _plot(time,es.rho[1,:].T,label=f"{es.name} Channel 2 " + r"$\rho_{s}$")
         if es.nc >= 3:
             if es.name == "":
                 for kc in range(0,es.nc):
-                    plt.plot(time,es.rho[kc,:].T,label=f"Channel {kc} " + r"$\rho$" + f"_{kc}")
+                    _plot(time,es.rho[kc,:].T,label=f"Channel {kc} " + r"$\rho$" + f"_{kc}")
             else:
                 for kc in range(0,es.nc):
-                    plt.plot(time,es.rho[kc,:].T,label=f"{es.name} Channel {kc} " + r"$\rho$" + f"_{kc}")
+                    _plot(time,es.rho[kc,:].T,label=f"{es.name} Channel {kc} " + r"$\rho$" + f"_{kc}")
     plt.title("Highpass Filtered Objective Function(s): " + r"$\rho$")
     plt.xlabel("Time [s]")
     plt.legend()
     
-    plt.show()
+    _show("rho")
     
 
 def plot_eps(time, es_list):
@@ -145,28 +433,28 @@ def plot_eps(time, es_list):
     for es in es_list:
         if es.nc == 1:
             if es.name == "":
-                plt.plot(time,es.eps.T,label="$\epsilon$")
+                _plot(time,es.eps.T,label="$\epsilon$")
             else:
-                plt.plot(time,es.eps.T,label=f"{es.name} " + r"$\epsilon$")
+                _plot(time,es.eps.T,label=f"{es.name} " + r"$\epsilon$")
         if es.nc == 2:
             if es.name == "":
-                plt.plot(time,es.eps[0,:].T,label="Channel 1 " + r"$\epsilon_{c}$")
-                plt.plot(time,es.eps[1,:].T,label="Channel 2 " + r"$\epsilon_{s}$")
+                _plot(time,es.eps[0,:].T,label="Channel 1 " + r"$\epsilon_{c}$")
+                _plot(time,es.eps[1,:].T,label="Channel 2 " + r"$\epsilon_{s}$")
             else:
-                plt.plot(time,es.eps[0,:].T,label=f"{es.name} Channel 1 " + r"$\epsilon_{c}$")
-                plt.plot(time,es.eps[1,:].T,label=f"{es.name} Channel 2 " + r"$\epsilon_{s}$")
+                _plot(time,es.eps[0,:].T,label=f"{es.name} Channel 1 " + r"$\epsilon_{c}$")
+                _plot(time,es.eps[1,:].T,label=f"{es.name} Channel 2 " + r"$\epsilon_{s}$")
         if es.nc >= 3:
             if es.name == "":
                 for kc in range(0,es.nc):
-                    plt.plot(time,es.eps[kc,:].T,label=f"Channel {kc} " + r"$\epsilon$" + f"_{kc}")
+                    _plot(time,es.eps[kc,:].T,label=f"Channel {kc} " + r"$\epsilon$" + f"_{kc}")
             else:
                 for kc in range(0,es.nc):
-                    plt.plot(time,es.eps[kc,:].T,label=f"{es.name} Channel {kc} " + r"$\epsilon$" + f"_{kc}")
+                    _plot(time,es.eps[kc,:].T,label=f"{es.name} Channel {kc} " + r"$\epsilon$" + f"_{kc}")
     plt.title("Lowpass Filtered Objective Function(s): " + r"$\epsilon$")
     plt.xlabel("Time [s]")
     plt.legend()
     
-    plt.show()
+    _show("eps")
     
     
 def plot_sigma(time, es_list):
@@ -175,28 +463,28 @@ def plot_sigma(time, es_list):
     for es in es_list:
         if es.nc == 1:
             if es.name == "":
-                plt.plot(time,es.sigma.T,label="$\sigma$")
+                _plot(time,es.sigma.T,label="$\sigma$")
             else:
-                plt.plot(time,es.sigma.T,label=f"{es.name} $\sigma$")
+                _plot(time,es.sigma.T,label=f"{es.name} $\sigma$")
         if es.nc == 2:
             if es.name == "":
-                plt.plot(time,es.sigma[0,:].T,label="Channel 1 " + r"$\sigma_{c}$")
-                plt.plot(time,es.sigma[1,:].T,label="Channel 2 " + r"$\sigma_{s}$")
+                _plot(time,es.sigma[0,:].T,label="Channel 1 " + r"$\sigma_{c}$")
+                _plot(time,es.sigma[1,:].T,label="Channel 2 " + r"$\sigma_{s}$")
             else:
-                plt.plot(time,es.sigma[0,:].T,label=f"{es.name} Channel 1 " + r"$\sigma_{c}$")
-                plt.plot(time,es.sigma[1,:].T,label=f"{es.name} Channel 2 " + r"$\sigma_{s}$")
+                _plot(time,es.sigma[0,:].T,label=f"{es.name} Channel 1 " + r"$\sigma_{c}$")
+                _plot(time,es.sigma[1,:].T,label=f"{es.name} Channel 2 " + r"$\sigma_{s}$")
         if es.nc >= 3:
             if es.name == "":
                 for kc in range(0,es.nc):
-                    plt.plot(time,es.sigma[kc,:].T,label=f"Channel {kc} " + r"$\sigma$" + f"_{kc}")
+                    _plot(time,es.sigma[kc,:].T,label=f"Channel {kc} " + r"$\sigma$" + f"_{kc}")
             else:
                 for kc in range(0,es.nc):
-                    plt.plot(time,es.sigma[kc,:].T,label=f"{es.name} Channel {kc} " + r"$\sigma$" + f"_{kc}")
+                    _plot(time,es.sigma[kc,:].T,label=f"{es.name} Channel {kc} " + r"$\sigma$" + f"_{kc}")
     plt.title("Demodulated Signal(s): " + r"$\sigma$")
     plt.xlabel("Time [s]")
     plt.legend()
     
-    plt.show()
+    _show("sigma")
     
 def plot_xihat(time, es_list):
 
@@ -204,25 +492,25 @@ def plot_xihat(time, es_list):
     for es in es_list:
         if es.nc == 1:
             if es.name == "":
-                plt.plot(time,es.xihat.T,label=r"$\hat{\xi}$")
+                _plot(time,es.xihat.T,label=r"$\hat{\xi}$")
             else:
-                plt.plot(time,es.xihat.T,label=f"{es.name} " + r"$\hat{\xi}$")
+                _plot(time,es.xihat.T,label=f"{es.name} " + r"$\hat{\xi}$")
         if es.nc == 2:
             if es.name == "":
-                plt.plot(time,es.xihat[0,:].T,label="Channel 1 " + r"$\hat{\xi}_{c}$")
-                plt.plot(time,es.xihat[1,:].T,label="Channel 2 " + r"$\hat{\xi}_{s}$")
+                _plot(time,es.xihat[0,:].T,label="Channel 1 " + r"$\hat{\xi}_{c}$")
+                _plot(time,es.xihat[1,:].T,label="Channel 2 " + r"$\hat{\xi}_{s}$")
             else:
-                plt.plot(time,es.xihat[0,:].T,label=f"{es.name} Channel 1 " + r"$\hat{\xi}_{c}$")
-                plt.plot(time,es.xihat[1,:].T,label=f"{es.name} Channel 2 " + r"$\hat{\xi}_{s}$")
+                _plot(time,es.xihat[0,:].T,label=f"{es.name} Channel 1 " + r"$\hat{\xi}_{c}$")
+                _plot(time,es.xihat[1,:].T,label=f"{es.name} Channel 2 " + r"$\hat{\xi}_{s}$")
         if es.nc >= 3:
             if es.name == "":
                 for kc in range(0,es.nc):
-                    plt.plot(time,es.xihat[kc,:].T,label=f"Channel {kc} " + r"$\hat{\xi}$" + f"_{kc}")
+                    _plot(time,es.xihat[kc,:].T,label=f"Channel {kc} " + r"$\hat{\xi}$" + f"_{kc}")
             else:
                 for kc in range(0,es.nc):
-                    plt.plot(time,es.xihat[kc,:].T,label=f"{es.name} Channel {kc} " + r"$\hat{\xi}$" + f"_{kc}")
+                    _plot(time,es.xihat[kc,:].T,label=f"{es.name} Channel {kc} " + r"$\hat{\xi}$" + f"_{kc}")
     plt.title("Gradient Estimate(s): " + r"$\hat{\xi}$")
     plt.xlabel("Time [s]")
     plt.legend()
     
-    plt.show()
+    _show("xihat")
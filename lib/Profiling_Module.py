@@ -0,0 +1,242 @@
+# Simulation Profiler Class
+
+"""
+
+Per-stage timing instrumentation of a Simulation.
+
+When a profiler is attached to a Simulation (Simulation.enable_profiling), every stage of each timestep is timed per component:
+system step, objective function measurement and computation, and ES_function. The user-supplied callbacks (the pass_func of
+PassThroughSystem and the obj_func of ObjectiveFunction) are wrapped and timed separately, to give the share of the time spent in them.
+For each component and stage, the profiler accumulates the number of calls, the cumulative time, and a histogram of the per-call times
+on logarithmic bins.
+
+Without a profiler (the default), Simulation.step skips the timers, and the only overhead is one check per stage of each component.
+
+"""
+
+import json
+import math
+import time as timer
+
+import numpy as np
+
+
+# stages of a timestep, in execution order
+STAGES = ["sys.step", "obj.get_measurements", "obj.compute_objective_function", "es.ES_function"]
+
+# user callbacks, timed within the sys.step and obj.compute_objective_function stages
+CALLBACKS = {"sys.step": "pass_func", "obj.compute_objective_function": "obj_func"}
+
+
+class StageTimer():
+    """
+    Call count, cumulative time and histogram of per-call times of one stage of one component
+
+    The histogram has bins_per_decade logarithmic bins per decade from 10**min_exp to 10**max_exp seconds,
+    with the first and last bins also counting shorter and longer calls.
+    """
+
+    min_exp = -7 # shortest binned call time, 100 ns
+    max_exp = 1 # longest binned call time, 10 s
+    bins_per_decade = 4
+
+    def __init__(self):
+
+        self.calls = 0 # number of calls
+
+        self.total = 0.0 # cumulative time [s]
+
+        self.max = 0.0 # longest call [s]
+
+        self.counts = np.zeros((self.max_exp - self.min_exp)*self.bins_per_decade, dtype=np.int64) # histogram of call times
+
+    def add(self, dt):
+        """
+        Add one call of duration dt [s]
+        """
+
+        self.calls = self.calls + 1
+        self.total = self.total + dt
+        if dt > self.max:
+            self.max = dt
+
+        if dt > 0:
+            kb = int((math.log10(dt) - self.min_exp)*self.bins_per_decade)
+        else:
+            kb = 0
+        self.counts[min(max(kb, 0), len(self.counts) - 1)] += 1
+
+    def bin_edges(self):
+        """
+        Edges of the histogram bins [s]
+        """
+
+        return 10.0**(self.min_exp + np.arange(len(self.counts) + 1)/self.bins_per_decade)
+
+    def report(self):
+        """
+        Statistics of the stage as a dictionary (only the nonempty histogram bins are listed)
+        """
+
+        edges = self.bin_edges()
+        nonzero = np.flatnonzero(self.counts)
+
+        return {
+            "calls": self.calls,
+            "total": self.total,
+            "mean": self.total/self.calls if self.calls > 0 else 0.0,
+            "max": self.max,
+            "histogram": {
+                "lower": edges[nonzero].tolist(),
+                "upper": edges[nonzero + 1].tolist(),
+                "counts": self.counts[nonzero].tolist(),
+            },
+        }
+
+
+class SimulationProfiler():
+    """
+    Timing of the stages of a Simulation, per component and per stage
+
+    Created and attached by Simulation.enable_profiling.
+    """
+
+    def __init__(self):
+
+        self.timers = {} # (component label, stage) -> StageTimer
+
+        self.step_timer = StageTimer() # duration of whole timesteps
+
+        self.wrapped = [] # (component, attribute name, original callback) of the wrapped user callbacks
+
+    def component_label(self, component, index):
+        """
+        Label of a component in the report: its name if it has one, otherwise its class and index in the simulation
+        """
+
+        name = getattr(component, "name", "")
+        if name:
+            return name
+        return f"{type(component).__name__}[{index}]"
+
+    def timer(self, label, stage):
+        """
+        Timer of a stage of a component, created on first use
+        """
+
+        key = (label, stage)
+        if key not in self.timers:
+            self.timers[key] = StageTimer()
+        return self.timers[key]
+
+    def attach(self, sim):
+        """
+        Create the timers of every component of a simulation, and wrap the user callbacks of its systems and objective functions
+        """
+
+        self.sys_timers = []
+        for k1, sys in enumerate(sim.system_list):
+            label = self.component_label(sys, k1)
+            self.sys_timers.append(self.timer(label, "sys.step"))
+            if getattr(sys, "pass_through_function", None) is not None:
+                self.wrap_callback(sys, "pass_through_function", self.timer(label, "pass_func"))
+
+        self.obj_timers = []
+        for k1, obj in enumerate(sim.obj_list):
+            label = self.component_label(obj, k1)
+            self.obj_timers.append((self.timer(label, "obj.get_measurements"), self.timer(label, "obj.compute_objective_function")))
+            # the native evaluation of a built-in objective function, or the user callback
+            if getattr(obj, "evaluate_step", None) is not None:
+                self.wrap_callback(obj, "evaluate_step", self.timer(label, "obj_func"))
+            elif getattr(obj, "objective_function", None) is not None:
+                self.wrap_callback(obj, "objective_function", self.timer(label, "obj_func"))
+
+        self.es_timers = []
+        for k1, es in enumerate(sim.es_list):
+            self.es_timers.append(self.timer(self.component_label(es, k1), "es.ES_function"))
+
+    def wrap_callback(self, component, attribute, stage_timer):
+        """
+        Replace a user callback of a component with a timed wrapper
+        """
+
+        func = getattr(component, attribute)
+
+        def timed(*args, **kwargs):
+            t0 = timer.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stage_timer.add(timer.perf_counter() - t0)
+
+        setattr(component, attribute, timed)
+        self.wrapped.append((component, attribute, func))
+
+    def detach(self):
+        """
+        Restore the user callbacks wrapped by attach
+        """
+
+        for component, attribute, func in reversed(self.wrapped):
+            setattr(component, attribute, func)
+        self.wrapped = []
+
+    def report(self):
+        """
+        Structured profiling report
+
+        Outputs:
+        dict with keys
+            "steps", "step": number of timesteps, and statistics of whole timesteps
+            "total": cumulative time of all timesteps [s]
+            "components": component label -> stage -> statistics (see StageTimer.report), including the
+                pass_func and obj_func user callbacks
+            "stages": stage -> statistics summed over components (calls, total, share of the total time)
+            "callback_share": share of the total time spent in user callbacks
+        """
+
+        total = self.step_timer.total
+
+        components = {}
+        stages = {}
+        for (label, stage), stage_timer in self.timers.items():
+            components.setdefault(label, {})[stage] = stage_timer.report()
+            summary = stages.setdefault(stage, {"calls": 0, "total": 0.0})
+            summary["calls"] = summary["calls"] + stage_timer.calls
+            summary["total"] = summary["total"] + stage_timer.total
+        for summary in stages.values():
+            summary["share"] = summary["total"]/total if total > 0 else 0.0
+
+        callback_total = sum(stages[stage]["total"] for stage in CALLBACKS.values() if stage in stages)
+
+        return {
+            "steps": self.step_timer.calls,
+            "total": total,
+            "step": self.step_timer.report(),
+            "components": components,
+            "stages": stages,
+            "callback_share": callback_total/total if total > 0 else 0.0,
+        }
+
+    def export(self, path):
+        """
+        Write the profiling report to a JSON file
+        """
+
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+
+    def summary(self):
+        """
+        Profiling report as a text table, one line per stage (summed over components)
+        """
+
+        report = self.report()
+        lines = [f"{report['steps']} timesteps, {report['total']:.6f} s, {100*report['callback_share']:.1f}% in user callbacks"]
+        lines.append(f"{'stage':34s} {'calls':>10s} {'total [s]':>12s} {'mean [us]':>12s} {'share':>8s}")
+        for stage in STAGES + list(CALLBACKS.values()):
+            if stage in report["stages"]:
+                s = report["stages"][stage]
+                mean = 1e6*s["total"]/s["calls"] if s["calls"] > 0 else 0.0
+                lines.append(f"{stage:34s} {s['calls']:10d} {s['total']:12.6f} {mean:12.2f} {100*s['share']:7.1f}%")
+        return "\n".join(lines)
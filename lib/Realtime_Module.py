@@ -0,0 +1,299 @@
+# Real-Time ES Driver
+
+"""
+
+asyncio runtime driving ES controllers in real time, from measurement sources that deliver objective function values asynchronously
+(e.g. hardware) to sinks that apply the ES control values.
+
+A source is any object with a coroutine read() returning an objective function value.
+A sink is any object with a coroutine write(theta) applying the control values of one ES controller.
+
+At each timestep, the driver awaits the objective function values until a per-step deadline. If a sample is late, the last value
+received from that source is held, and the read stays pending so its value is used once it arrives. If a read fails (raises an
+exception), the last value is held as well, and the source is read again at the next timestep. Each ES controller then
+progresses by one timestep, and its control values are written to its sink. Timesteps are scheduled on a fixed period, and the
+driver records the jitter of the step start times, late and failed samples and overruns (steps that take longer than the period).
+
+SimulatedPlant wraps a PassThroughSystem or LinearSystem and an ObjectiveFunction as a source and sink, to run the driver without hardware.
+With zero latency, it reproduces Simulation.run_simulation.
+
+ES controllers driven indefinitely should be created in streaming mode.
+
+"""
+
+import asyncio
+
+import numpy as np
+
+
+class RealtimeStats():
+    """
+    Timing statistics of a real-time run, accumulated online
+    """
+
+    def __init__(self, n_sources):
+
+        self.steps = 0 # number of timesteps
+
+        self.late_samples = np.zeros(n_sources, dtype=int) # number of late samples of each source
+
+        self.failed_samples = np.zeros(n_sources, dtype=int) # number of failed reads of each source
+
+        self.overruns = 0 # number of timesteps that took longer than the period
+
+        # online (Welford) mean and variance of the jitter of step start times, and of the step durations
+        self.jitter_mean = 0.0
+        self.jitter_m2 = 0.0
+        self.jitter_max = 0.0
+        self.step_time_mean = 0.0
+        self.step_time_max = 0.0
+
+    def add_step(self, jitter, step_time, period):
+        """
+        Add the jitter (actual - scheduled start time) and duration of one timestep
+        """
+
+        self.steps = self.steps + 1
+
+        delta = jitter - self.jitter_mean
+        self.jitter_mean = self.jitter_mean + delta/self.steps
+        self.jitter_m2 = self.jitter_m2 + delta*(jitter - self.jitter_mean)
+        self.jitter_max = max(self.jitter_max, jitter)
+
+        self.step_time_mean = self.step_time_mean + (step_time - self.step_time_mean)/self.steps
+        self.step_time_max = max(self.step_time_max, step_time)
+
+        if step_time > period:
+            self.overruns = self.overruns + 1
+
+    def report(self):
+        """
+        Statistics as a dictionary
+        """
+
+        jitter_std = 0.0
+        if self.steps > 1:
+            jitter_std = np.sqrt(self.jitter_m2/(self.steps - 1))
+
+        return {
+            "steps": self.steps,
+            "late_samples": self.late_samples.tolist(),
+            "failed_samples": self.failed_samples.tolist(),
+            "overruns": self.overruns,
+            "jitter_mean": self.jitter_mean,
+            "jitter_std": float(jitter_std),
+            "jitter_max": self.jitter_max,
+            "step_time_mean": self.step_time_mean,
+            "step_time_max": self.step_time_max,
+        }
+
+
+class RealtimeDriver():
+    """
+    Real-time asyncio driver for ES controllers
+
+    Inputs:
+    es_list: list
+        ES controllers
+    sources: list
+        measurement sources, with a coroutine read() returning an objective function value
+    sinks: list
+        one sink per ES controller, with a coroutine write(theta) applying its control values
+    period: float
+        timestep period [s], normally the dT of the ES controllers
+    deadline: float, optional
+        time after the start of a timestep by which samples must arrive [s] (default is None, the period)
+    source_map: list, optional
+        source of each ES controller, as obj_to_es_map in Simulation (default is None, ES controller k receives source k)
+    """
+
+    def __init__(self, es_list, sources, sinks, period, deadline=None, source_map=None):
+
+        self.es_list = es_list # ES controllers
+
+        self.sources = sources # measurement sources
+
+        self.sinks = sinks # control value sinks, one per ES controller
+
+        if len(self.sinks) != len(self.es_list):
+            raise ValueError("one sink per ES controller is required")
+
+        self.period = period # timestep period
+
+        if deadline is None:
+            deadline = period
+        self.deadline = deadline # per-step deadline for samples
+
+        # source of each ES controller
+        if source_map is None:
+            source_map = list(range(len(self.es_list)))
+        self.source_map = source_map
+
+        self.psi_last = np.zeros(len(self.sources)) # last value received from each source
+
+        self.pending = [None]*len(self.sources) # pending read of each source
+
+        self.kt = 0 # next timestep
+
+        self.stats = RealtimeStats(len(self.sources))
+
+    async def _read_sources(self, step_deadline):
+        """
+        Await the samples of all sources until the deadline, holding the last value of late sources and of failed reads
+        """
+
+        loop = asyncio.get_running_loop()
+
+        for ks, source in enumerate(self.sources):
+            if self.pending[ks] is None:
+                self.pending[ks] = asyncio.ensure_future(source.read())
+
+        waiting = [task for task in self.pending if not task.done()]
+        if len(waiting) > 0:
+            await asyncio.wait(waiting, timeout=max(0.0, step_deadline - loop.time()))
+
+        for ks, task in enumerate(self.pending):
+            if task.done():
+                if task.cancelled() or task.exception() is not None:
+                    # failed read: hold the last value, and read the source again at the next timestep
+                    self.stats.failed_samples[ks] = self.stats.failed_samples[ks] + 1
+                else:
+                    self.psi_last[ks] = task.result()
+                self.pending[ks] = None
+            else:
+                # late sample: hold the last value, and keep the read pending
+                self.stats.late_samples[ks] = self.stats.late_samples[ks] + 1
+
+    async def step(self, step_deadline):
+        """
+        Progress every ES controller by one timestep
+        """
+
+        kt = self.kt
+
+        await self._read_sources(step_deadline)
+
+        # each ES controller calculates its setpoint and control
+        for k1, es in enumerate(self.es_list):
+            es.ES_function(kt, self.psi_last[self.source_map[k1]])
+
+        # apply control values
+        await asyncio.gather(*[sink.write(es.theta[...,es.buffer_index(kt)]) for es, sink in zip(self.es_list, self.sinks)])
+
+        self.kt = kt + 1
+
+    async def run(self, n_steps=None):
+        """
+        Run the ES controllers in real time
+
+        Inputs:
+        n_steps: int, optional
+            number of timesteps (default is None, run until cancelled)
+
+        Outputs:
+        timing statistics report (see RealtimeStats.report)
+        """
+
+        loop = asyncio.get_running_loop()
+
+        # apply the initial control values
+        if self.kt == 0:
+            await asyncio.gather(*[sink.write(es.theta[...,es.buffer_index(0)]) for es, sink in zip(self.es_list, self.sinks)])
+
+        t_start = loop.time()
+        k1 = 0
+        try:
+            while n_steps is None or k1 < n_steps:
+
+                # wait for the scheduled start of the timestep
+                t_sched = t_start + k1*self.period
+                if t_sched > loop.time():
+                    await asyncio.sleep(t_sched - loop.time())
+                t_step = loop.time()
+
+                await self.step(t_step + self.deadline)
+
+                self.stats.add_step(t_step - t_sched, loop.time() - t_step, self.period)
+                k1 = k1 + 1
+        finally:
+            for task in self.pending:
+                if task is not None:
+                    task.cancel()
+            self.pending = [None]*len(self.sources)
+
+        return self.stats.report()
+
+
+class SimulatedPlant():
+    """
+    Local stand-in for hardware: a PassThroughSystem or LinearSystem and an ObjectiveFunction used as an async source and sink
+
+    Each read() steps the system with the most recently written input, and returns the objective function value.
+
+    Inputs:
+    system: PassThroughSystem or LinearSystem
+        system of the plant
+    objective: ObjectiveFunction
+        objective function of the plant, with system as its only system (set_system_list([system]))
+    latency: float or callable, optional
+        delay of each sample [s], or function returning the delay of each sample (default is 0.0)
+    """
+
+    def __init__(self, system, objective, latency=0.0):
+
+        self.system = system # plant system
+
+        self.objective = objective # plant objective function
+
+        self.latency = latency # sample delay
+
+        self.u = np.zeros(self.system.nu) # most recently written system input
+
+        self.kt = 0 # next timestep of the plant
+
+    async def read(self):
+        """
+        Step the plant and return its objective function value
+        """
+
+        latency = self.latency() if callable(self.latency) else self.latency
+        if latency > 0:
+            await asyncio.sleep(latency)
+
+        kt = self.kt
+        self.system.step(kt, self.u)
+        self.objective.get_measurements(kt, self.system.y[:,self.system.buffer_index(kt)])
+        self.objective.compute_objective_function(kt)
+        self.kt = kt + 1
+
+        return self.objective.psi[self.objective.buffer_index(kt)]
+
+    async def write(self, theta):
+        """
+        Set the system input
+        """
+
+        self.u[:] = np.ravel(theta)
+
+    def input_sink(self, index):
+        """
+        Sink writing into part of the system input (e.g. index = slice(1, 3)), for plants driven by several ES controllers
+        """
+
+        return PlantInputSink(self, index)
+
+
+class PlantInputSink():
+    """
+    Sink writing the control values of one ES controller into part of the input of a SimulatedPlant
+    """
+
+    def __init__(self, plant, index):
+
+        self.plant = plant
+
+        self.index = index
+
+    async def write(self, theta):
+
+        self.plant.u[self.index] = np.ravel(theta)
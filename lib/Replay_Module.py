@@ -0,0 +1,138 @@
+# Offline Replay Functions
+
+"""
+
+Offline replay of the ES signal chain over a recorded objective function trace.
+
+Given the objective function values psi of a whole run (e.g. logged from a plant), replay_es computes the signals an ES controller
+with a given configuration (dither, filters, demodulation, integrator) would have produced, in one vectorized pass over the trace:
+the filters are evaluated with linear-filter routines (scipy.signal.lfilter / sosfilt) instead of stepping ES_function once per
+timestep, which processes millions of samples per second.
+
+All of rho, eps, sigma and xihat depend only on psi and the dither, and so does the setpoint thetahat (the integral of xihat) when
+psi is given: the replay reproduces ES_function to round-off (the filter recurrences are evaluated in a different order) for the
+configuration of ExtremumSeekingSimple1D/2D/ND, with their default first-order filters or with lib.Filter_Module.ESFilters.
+The replay is open-loop: changing the configuration changes the replayed setpoint, but not the recorded psi, which the plant
+produced with the recorded control. Comparing the replayed control with a recorded control (theta) checks that a configuration
+matches the controller of the recording.
+
+"""
+
+import numpy as np
+
+from lib.Dither_Module import SineDither
+
+
+def _per_channel(value, nc):
+    """
+    Parameter broadcast to one value per channel
+    """
+
+    return np.broadcast_to(np.asarray(value, dtype=float), (nc,))
+
+
+def replay_es(psi, dT, fes, aes, kint=0.0, mode="minimize", thetahat0=0.0, time=None, dither=None, whpf=None, wlpf=None, filters=None, theta=None):
+    """
+    Signals of an ES controller over a recorded objective function trace, computed in one vectorized pass
+
+    Inputs:
+    psi: array of shape (n_steps,), or (..., n_steps) for several traces
+        recorded objective function values
+    dT: float
+        timestep
+    fes, aes, kint: float or array of shape (nc,)
+        dither frequency [Hz], dither amplitude and integrator gain of each channel (nc channels, as ExtremumSeekingSimpleND)
+    mode: str, optional
+        "minimize" or "maximize" (default is "minimize")
+    thetahat0: float or array of shape (nc,), optional
+        initial setpoint (default is 0.0)
+    time: array of shape (n_steps,), optional
+        time array of the recording (default is None, dT*arange(n_steps))
+    dither: dither generator, optional
+        as for the ES classes (default is None, SineDither(fes))
+    whpf, wlpf: float or array of shape (nc,), optional
+        high-pass and low-pass cutoffs [rad/s] (default is None, 2*pi*fes/10 as the ES classes)
+    filters: ESFilters, optional
+        higher-order filter stages (lib.Filter_Module.ESFilters) (default is None, first-order forward-Euler filters)
+    theta: array of shape (nc, n_steps) (or (..., nc, n_steps)), optional
+        recorded control, compared with the replayed control (default is None)
+
+    Outputs:
+    dict of arrays of shape (..., nc, n_steps): "rho", "eps", "sigma", "xihat", "thetahat", "theta", and "d" (dither, (nc, n_steps)),
+    with "theta_error" (replayed minus recorded control) if theta is given
+    """
+
+    from scipy.signal import lfilter, sosfilt
+
+    psi = np.asarray(psi, dtype=float)
+    n_steps = psi.shape[-1]
+    nc = np.size(fes)
+    fes = _per_channel(fes, nc)
+    aes = _per_channel(aes, nc)
+    kint = _per_channel(kint, nc)
+    wes = 2*np.pi*fes
+    whpf = _per_channel(wes/10 if whpf is None else whpf, nc)
+    wlpf = _per_channel(wes/10 if wlpf is None else wlpf, nc)
+    if mode not in ("minimize", "maximize"):
+        raise ValueError(f"unknown ES mode: {mode}, expected minimize or maximize")
+    direction = -1.0 if mode == "minimize" else 1.0
+
+    if time is None:
+        time = dT*np.arange(n_steps)
+    if dither is None:
+        dither = SineDither(fes)
+    d = dither.waveform(time, (nc,)) # dither of each channel over time
+    demod_gain = 1/(aes*dither.power)
+
+    shape = psi.shape[:-1] + (nc, n_steps)
+    rho = np.zeros(shape)
+    xihat = np.zeros(shape)
+    psi0 = psi[...,0:1]
+
+    if filters is None:
+        # rho[k] = (1 - whpf*dT)*rho[k-1] + psi[k] - psi[k-1], from rho[0] = 0
+        for kc in range(nc):
+            ahpf = 1 - whpf[kc]*dT
+            rho[...,kc,:] = lfilter([1.0, -1.0], [1.0, -ahpf], psi, axis=-1, zi=-psi0)[0]
+    else:
+        from scipy.signal import sosfilt_zi
+        from lib.Filter_Module import butterworth_sos
+        for kc in range(nc):
+            sos = butterworth_sos(filters.hpf_order, whpf[kc], "highpass", dT)
+            # steady state of the first value (rho[0] = 0), as ESFilters
+            zi = sosfilt_zi(sos).reshape((sos.shape[0],) + (1,)*(psi.ndim - 1) + (2,))*psi0
+            rho[...,kc,:] = sosfilt(sos, psi, axis=-1, zi=zi)[0]
+
+    # objective function error
+    eps = psi[...,None,:] - rho
+
+    # demodulate
+    sigma = demod_gain[:,None]*d*rho
+
+    if filters is None:
+        # xihat[k] = (1 - wlpf*dT)*xihat[k-1] + wlpf*dT*sigma[k-1], from xihat[0] = 0
+        for kc in range(nc):
+            xihat[...,kc,:] = lfilter([0.0, wlpf[kc]*dT], [1.0, -(1 - wlpf[kc]*dT)], sigma[...,kc,:], axis=-1)
+    else:
+        for kc in range(nc):
+            sos = butterworth_sos(filters.lpf_order, wlpf[kc], "lowpass", dT)
+            xihat[...,kc,:] = sosfilt(sos, sigma[...,kc,:], axis=-1)
+
+    # integrate the previous gradient estimates to obtain setpoint
+    thetahat = np.zeros(shape)
+    thetahat[...,1:] = np.cumsum(direction*(kint[:,None]*dT*xihat[...,:-1]), axis=-1)
+    thetahat += _per_channel(thetahat0, nc)[:,None]
+
+    results = {
+        "d": d,
+        "rho": rho,
+        "eps": eps,
+        "sigma": sigma,
+        "xihat": xihat,
+        "thetahat": thetahat,
+        "theta": thetahat + aes[:,None]*d,
+    }
+    if theta is not None:
+        results["theta_error"] = results["theta"] - np.asarray(theta, dtype=float)
+
+    return results
@@ -0,0 +1,453 @@
+# Scenario Runner
+
+"""
+
+Build and run a Simulation from a declarative scenario file (JSON or TOML), and write its results to a compressed .npz file.
+
+    python -m lib.Scenario_Module scenario.toml -o results.npz
+
+A scenario describes the time grid, the systems, objective functions and ES controllers, and their wiring by name:
+
+    [time]
+    dT = 0.01
+    t_end = 100.0                   # or n_steps
+
+    [[systems]]
+    name = "PST01"
+    type = "passthrough"            # "passthrough" (matrix or function), "linear" (A, B, C, D, x0, discretization)
+                                    # or "nonlinear" (function, nx, nu, ny, output, copies, x0, substeps)
+                                    # optional: noise = {type = "gaussian" (std, mean), "colored" (std, tau) or "step" (t_step, magnitude)}
+    nu = 3
+    ny = 4
+    matrix = [[1, 0, 0], [0, 1, 0], [0, 0, 1], [1, 1, 1]]
+    es = ["NDES_01"]                # ES controllers (or systems, for cascaded systems) providing the inputs, stacked in order
+                                    # optional: delayed = ["PST00"], systems of es read at the previous timestep
+
+    [[objectives]]
+    name = "OBJ01"
+    function = "sum_squared_error"  # built-in "sum_squared_error" (weights), "weighted_norm" (weights, p), "quadratic_form" (Q, c, r),
+                                    # or "package.module:function"
+    ystar = [-1, 0.5, 1.5, 1]       # constant reference (optional)
+    systems = ["PST01"]             # systems providing the measurements, stacked in order
+                                    # optional: noise (as systems, added to psi)
+
+    [[es]]
+    name = "NDES_01"
+    type = "ND"                     # "1D", "2D", "ND" (nc), "newton" (nc, gamma0, fric, hess_min) or "ensemble" (M, nc)
+                                    # optional: mode, thetahat0, dT, backend, dither = {type, ...}, filters = {hpf_order, lpf_order}
+    nc = 3
+    fes = [1.0, 1.5, 2.0]
+    aes = 0.2
+    kint = 0.2
+    objective = "OBJ01"
+
+    [run]                           # optional: streaming, history_length, recording, convergence, checkpoint_path, checkpoint_interval,
+                                    # seed (of the noise models), warm_start = "cache/" or {path, tolerance, max_entries, max_bytes}
+    [output]                        # optional: path, dtype, signals
+
+With warm_start, the ES controllers start from the converged states of the same or a nearby scenario in a warm-start cache
+(lib.WarmStart_Module), and the states at the end of the run are stored in the cache once the run has converged (or at the end of
+the run without convergence criteria).
+
+Any component may set its own dT (a multiple of the simulation timestep, see Simulation.component_period).
+Functions given as "package.module:function" are imported when the scenario is built.
+
+Only numpy and the simulation modules are imported with this module: TOML parsing, scipy (network objectives) and matplotlib are
+imported on first use, so that batch workers start quickly.
+
+"""
+
+import argparse
+import importlib
+import json
+import os
+import sys
+import time as timer
+
+import numpy as np
+
+from lib.Simulation_Module import Simulation
+from lib.History_Module import RecordingPolicy
+
+
+# built-in objective functions (lib.Objective_Function_Module), by name, with their parameters in the objective table
+OBJECTIVE_FUNCTIONS = {"sum_squared_error": ("SumSquaredError", ["weights"]), "weighted_norm": ("WeightedNorm", ["weights", "p"]),
+    "quadratic_form": ("QuadraticForm", ["Q", "c", "r"])}
+
+
+def load_scenario(path):
+    """
+    Read a scenario file, JSON (.json) or TOML (.toml)
+
+    Outputs:
+    dict
+    """
+
+    if path.endswith(".toml"):
+        try:
+            import tomllib
+        except ImportError: # Python < 3.11
+            import tomli as tomllib
+        with open(path, "rb") as f:
+            return tomllib.load(f)
+
+    with open(path) as f:
+        return json.load(f)
+
+
+def import_function(reference):
+    """
+    Function given as "package.module:function"
+    """
+
+    module_name, sep, attribute = reference.partition(":")
+    if not sep:
+        raise ValueError(f"function reference {reference} must be of the form package.module:function")
+    return getattr(importlib.import_module(module_name), attribute)
+
+
+def scenario_time(spec):
+    """
+    Time array and timestep of the simulation of a scenario
+    """
+
+    dT = float(spec["dT"])
+    if "n_steps" in spec:
+        time = dT*np.arange(int(spec["n_steps"]))
+    elif "t_end" in spec:
+        time = np.arange(float(spec.get("t_start", 0.0)), float(spec["t_end"]) + dT/2, dT)
+    else:
+        raise ValueError("the time grid requires n_steps or t_end")
+    return time, dT
+
+
+def build_simulation(scenario):
+    """
+    Build the Simulation described by a scenario (see the module documentation)
+
+    Inputs:
+    scenario: dict
+        scenario, e.g. from load_scenario
+
+    Outputs:
+    sim: Simulation
+    components: dict, name -> component
+    """
+
+    time, dT = scenario_time(scenario["time"])
+    run = scenario.get("run", {})
+    history = {"streaming": run.get("streaming", False), "history_length": run.get("history_length", None)}
+
+    def component_time(spec):
+        # time array of a component with its own (multiple) timestep
+        if "dT" not in spec:
+            return time, dT
+        period = int(round(float(spec["dT"])/dT))
+        return time[::period], float(spec["dT"])
+
+    def reference(value, t, n):
+        # constant reference, along the time array unless streaming
+        if value is None:
+            return None
+        value = np.asarray(value, dtype=float).reshape(n,-1)
+        if history["streaming"] or value.shape[1] == len(t):
+            return value
+        return np.repeat(value[:,:1], len(t), axis=1)
+
+    components = {}
+
+    # ES controllers
+    es_list = []
+    for spec in scenario.get("es", []):
+        es = _build_es(spec, *component_time(spec), history)
+        components[spec["name"]] = es
+        es_list.append(es)
+
+    # systems
+    system_list = []
+    for spec in scenario.get("systems", []):
+        t, dt = component_time(spec)
+        kind = spec.get("type", "passthrough")
+        noise = _build_noise(spec.get("noise"))
+        if kind == "passthrough":
+            from lib.System_Module import PassThroughSystem
+            if "matrix" in spec:
+                matrix = np.asarray(spec["matrix"], dtype=float)
+                pass_func = lambda u, matrix=matrix: matrix@u
+            else:
+                pass_func = import_function(spec["function"])
+            sys_ = PassThroughSystem(t, dt, spec["nu"], spec["ny"], pass_func, reference(spec.get("ystar"), t, spec["ny"]), noise=noise, **history)
+        elif kind == "linear":
+            from lib.System_Module import LinearSystem
+            A, B, C, D = (np.atleast_2d(np.asarray(spec[m], dtype=float)) for m in "ABCD")
+            x0 = np.asarray(spec["x0"], dtype=float) if "x0" in spec else None
+            sys_ = LinearSystem(t, dt, A, B, C, D, x0, reference(spec.get("ystar"), t, C.shape[0]), discretization=spec.get("discretization", "euler"), noise=noise, **history)
+        elif kind == "nonlinear":
+            from lib.System_Module import NonlinearSystem
+            f = import_function(spec["function"])
+            g = import_function(spec["output"]) if "output" in spec else None
+            x0 = np.asarray(spec["x0"], dtype=float) if "x0" in spec else None
+            M = spec.get("copies", 1)
+            ny = spec.get("ny", spec["nx"])
+            sys_ = NonlinearSystem(t, dt, f, spec["nx"], spec["nu"], ny, g, M, x0, reference(spec.get("ystar"), t, M*ny), spec.get("substeps", 1), noise=noise, **history)
+        else:
+            raise ValueError(f"unknown system type: {kind}, expected passthrough, linear or nonlinear")
+        components[spec["name"]] = sys_
+        system_list.append(sys_)
+
+    # system inputs, once all systems are built (systems may take the outputs of other systems)
+    for spec, sys_ in zip(scenario.get("systems", []), system_list):
+        sys_.set_es_list([components[name] for name in spec.get("es", [])])
+
+    # objective functions
+    obj_list = []
+    for spec in scenario.get("objectives", []):
+        t, dt = component_time(spec)
+        kind = spec.get("type", "function")
+        noise = _build_noise(spec.get("noise"))
+        if kind == "function":
+            from lib.Objective_Function_Module import ObjectiveFunction
+            name = spec.get("function", "sum_squared_error")
+            if name in OBJECTIVE_FUNCTIONS:
+                import lib.Objective_Function_Module as objective_module
+                class_name, parameters = OBJECTIVE_FUNCTIONS[name]
+                obj_func = getattr(objective_module, class_name)(**{p: spec[p] for p in parameters if p in spec})
+            else:
+                obj_func = import_function(name)
+            ny = sum(components[name].ny for name in spec.get("systems", []))
+            obj = ObjectiveFunction(t, dt, obj_func, reference(spec.get("ystar"), t, ny), noise=noise, **history)
+        elif kind == "network":
+            from lib.Objective_Function_Module import NetworkObjectiveFunction
+            from lib.Network_Module import CouplingGraph
+            graph = CouplingGraph(spec["n_agents"], spec.get("edges"), spec.get("weights", 1.0))
+            G, W = graph.objective_matrices(spec.get("tracking_weight", 1.0), spec.get("coupling_weight", 1.0))
+            zstar = None
+            if "ystar" in spec:
+                zstar = np.concatenate((np.broadcast_to(np.asarray(spec["ystar"], dtype=float), (graph.n_agents,)), np.zeros(graph.n_edges)))
+            obj = NetworkObjectiveFunction(t, dt, G, W, zstar, noise=noise, **history)
+        else:
+            raise ValueError(f"unknown objective type: {kind}, expected function or network")
+        obj.set_system_list([components[name] for name in spec.get("systems", [])])
+        components[spec["name"]] = obj
+        obj_list.append(obj)
+
+    # objective function of each ES controller (by default, the objective functions in es order)
+    obj_to_es_map = None
+    if any("objective" in spec for spec in scenario.get("es", [])):
+        obj_names = [spec["name"] for spec in scenario.get("objectives", [])]
+        obj_to_es_map = [obj_names.index(spec["objective"]) for spec in scenario["es"]]
+
+    # dataflow graph with the delayed system -> system edges, if any (by default, Simulation follows the wiring of the components)
+    graph = None
+    if any("delayed" in spec for spec in scenario.get("systems", [])):
+        from lib.Graph_Module import DataflowGraph
+        graph = DataflowGraph()
+        graph.add(*system_list, *obj_list, *es_list)
+        for spec, sys_ in zip(scenario.get("systems", []), system_list):
+            for name in spec.get("es", []):
+                graph.connect(components[name], sys_, True if name in spec.get("delayed", []) else None)
+        for obj in obj_list:
+            for sys_ in obj.sys_list:
+                graph.connect(sys_, obj)
+        for k1, es in enumerate(es_list):
+            graph.connect(obj_list[k1 if obj_to_es_map is None else obj_to_es_map[k1]], es)
+
+    sim = Simulation(time, dT, system_list, es_list, obj_list, obj_to_es_map, graph)
+
+    # reproducible noise streams
+    if "seed" in run:
+        from lib.Noise_Module import seed_noise
+        seed_noise(sim, run["seed"])
+
+    return sim, components
+
+
+def _build_noise(spec):
+    """
+    Noise model of a system or objective function of a scenario: a table {type, ...} or a list of tables (added), or None
+    """
+
+    if spec is None:
+        return None
+    if isinstance(spec, list):
+        from lib.Noise_Module import NoiseSum
+        return NoiseSum([_build_noise(item) for item in spec])
+
+    from lib.Noise_Module import GaussianNoise, ColoredNoise, StepDisturbance
+    options = dict(spec)
+    kind = options.pop("type", "gaussian")
+    models = {"gaussian": GaussianNoise, "colored": ColoredNoise, "step": StepDisturbance}
+    if kind not in models:
+        raise ValueError(f"unknown noise type: {kind}, expected gaussian, colored or step")
+    return models[kind](**options)
+
+
+def _build_es(spec, time, dT, history):
+    """
+    ES controller of a scenario
+    """
+
+    kind = str(spec.get("type", "1D"))
+    options = {
+        "mode": spec.get("mode", "minimize"),
+        "thetahat0": None if spec.get("thetahat0") is None else np.asarray(spec["thetahat0"], dtype=float),
+        "name": spec["name"],
+    }
+    options.update(history)
+    if "dither" in spec:
+        from lib.Dither_Module import SineDither, SquareDither
+        dither = dict(spec["dither"])
+        dither_class = {"sine": SineDither, "square": SquareDither}[dither.pop("type", "sine")]
+        options["dither"] = dither_class(np.asarray(spec["fes"], dtype=float), **dither)
+    if kind not in ("ensemble", "newton") and "backend" in spec:
+        options["backend"] = spec["backend"]
+    if kind != "newton" and "filters" in spec:
+        from lib.Filter_Module import ESFilters
+        options["filters"] = ESFilters(**spec["filters"])
+
+    fes = np.asarray(spec["fes"], dtype=float)
+    aes = np.asarray(spec["aes"], dtype=float)
+    kint = np.asarray(spec["kint"], dtype=float)
+
+    if kind == "1D":
+        from lib.ExtremumSeekingSimple1D import ExtremumSeekingSimple1D
+        return ExtremumSeekingSimple1D(time, dT, float(fes), float(aes), float(kint), **options)
+    elif kind == "2D":
+        from lib.ExtremumSeekingSimple2D import ExtremumSeekingSimple2D
+        return ExtremumSeekingSimple2D(time, dT, float(fes), float(aes), float(kint), **options)
+    elif kind == "ND":
+        from lib.ExtremumSeekingSimpleND import ExtremumSeekingSimpleND
+        nc = int(spec["nc"])
+        return ExtremumSeekingSimpleND(time, dT, nc, fes*np.ones(nc), aes*np.ones(nc), kint*np.ones(nc), **options)
+    elif kind == "newton":
+        from lib.ExtremumSeekingNewtonND import ExtremumSeekingNewtonND
+        nc = int(spec["nc"])
+        gamma0 = None if spec.get("gamma0") is None else np.asarray(spec["gamma0"], dtype=float)
+        return ExtremumSeekingNewtonND(time, dT, nc, fes*np.ones(nc), aes*np.ones(nc), kint*np.ones(nc), gamma0=gamma0, fric=spec.get("fric"),
+            hess_min=spec.get("hess_min", 0.1), **options)
+    elif kind == "ensemble":
+        from lib.ExtremumSeekingEnsembleND import ExtremumSeekingEnsembleND
+        return ExtremumSeekingEnsembleND(time, dT, int(spec["M"]), int(spec.get("nc", 1)), fes, aes, kint, **options)
+    raise ValueError(f"unknown ES type: {kind}, expected 1D, 2D, ND, newton or ensemble")
+
+
+def run_scenario(scenario, output=None):
+    """
+    Build and run the Simulation of a scenario, and write its results
+
+    Inputs:
+    scenario: dict or str
+        scenario, or path of a scenario file
+    output: str, optional
+        path of the .npz results file (default is None, the output path of the scenario, if any)
+
+    Outputs:
+    sim: Simulation, after the run
+    components: dict, name -> component
+    """
+
+    if isinstance(scenario, str):
+        scenario = load_scenario(scenario)
+
+    sim, components = build_simulation(scenario)
+
+    run = scenario.get("run", {})
+    recording = None
+    if "recording" in run:
+        recording = dict(run["recording"])
+        recording = RecordingPolicy(recording.pop("signals", None), **recording)
+    convergence = None
+    if "convergence" in run:
+        from lib.Convergence_Module import ConvergenceCriteria
+        convergence = ConvergenceCriteria(**run["convergence"])
+
+    warm_start_cache = None
+    if "warm_start" in run:
+        from lib.WarmStart_Module import WarmStartCache
+        options = run["warm_start"]
+        options = dict(options) if isinstance(options, dict) else {"path": options}
+        warm_start_cache = WarmStartCache(options.pop("path"), **options)
+        warm_start_cache.warm_start(sim, scenario)
+
+    sim.run_simulation(recording, run.get("checkpoint_path"), run.get("checkpoint_interval"), convergence=convergence)
+
+    if warm_start_cache is not None and (convergence is None or sim.converged_step is not None):
+        warm_start_cache.store(scenario, sim)
+
+    output_spec = scenario.get("output", {})
+    if output is None:
+        output = output_spec.get("path")
+    if output is not None:
+        save_results(output, scenario, sim, components, output_spec.get("signals"), output_spec.get("dtype"))
+
+    return sim, components
+
+
+def save_results(path, scenario, sim, components, signals=None, dtype=None):
+    """
+    Write the signals of every component of a run to a compressed .npz file
+
+    Each signal is stored as "<component name>/<signal>", with its times as "<component name>/time": the recorded values with a
+    recording policy, otherwise the values held in the signal arrays (the most recent timesteps when streaming).
+    The file also holds the scenario (as JSON) and the timestep of convergence (-1 if the run did not converge or was not checked).
+
+    Inputs:
+    signals: list of str, optional
+        names of the signals to write (default is None, every signal)
+    dtype: numpy dtype, optional
+        storage dtype of the signals (default is None, as simulated)
+    """
+
+    arrays = {
+        "scenario": np.array(json.dumps(scenario)),
+        "converged_step": np.array(-1 if sim.converged_step is None else sim.converged_step),
+    }
+    for name, component in components.items():
+        recorded = component.recording is not None
+        n_arrays = len(arrays)
+        for signal in component.history_signals:
+            if signals is not None and signal not in signals:
+                continue
+            if recorded:
+                if signal not in component.recording.signals:
+                    continue
+                values = component.get_recorded(signal)
+            elif hasattr(component, signal):
+                values = component.get_history(signal)
+            else:
+                continue
+            arrays[f"{name}/{signal}"] = values if dtype is None else values.astype(dtype)
+        if len(arrays) > n_arrays:
+            arrays[f"{name}/time"] = component.recorded_time() if recorded else component.history_time()
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    np.savez_compressed(path, **arrays)
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description="Run an extremum seeking scenario file (JSON or TOML) and write its results.")
+    parser.add_argument("scenario", help="scenario file (.json or .toml)")
+    parser.add_argument("-o", "--output", default=None, help="results file (.npz); default is the output path of the scenario")
+    parser.add_argument("-q", "--quiet", action="store_true", help="do not print a summary")
+    args = parser.parse_args(argv)
+
+    t0 = timer.perf_counter()
+    sim, components = run_scenario(args.scenario, args.output)
+    elapsed = timer.perf_counter() - t0
+
+    if not args.quiet:
+        n_steps = sim.kt_last + 1
+        print(f"{args.scenario}: {n_steps} timesteps in {elapsed:.3f} s", file=sys.stderr)
+        if sim.converged_step is not None:
+            print(f"converged at timestep {sim.converged_step}", file=sys.stderr)
+        for es in sim.es_list:
+            print(f"{es.name} thetahat: {np.ravel(es.thetahat[...,es.buffer_index(es.kt_last)])}", file=sys.stderr)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
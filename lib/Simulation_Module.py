@@ -1,12 +1,44 @@
 # Simulation Class
 
+import os
+import time as timer
+
 import numpy as np
 
+from lib.Profiling_Module import SimulationProfiler
+from lib.Graph_Module import DataflowGraph
+
 class Simulation():
+    """
+    Simulation of systems, objective functions and ES controllers over a time array
+    
+    The components are stepped in the order of a schedule compiled once from their dataflow graph (lib.Graph_Module.DataflowGraph):
+    by default, the graph follows the wiring of the components (sys.set_es_list, obj.set_system_list, obj_to_es_map), and the order
+    is all systems, then all objective functions, then all ES controllers. Systems may take the outputs of other systems as inputs
+    (cascaded systems, given in their set_es_list), which are then stepped after them. With graph, the components, their wiring
+    and the delayed system -> system edges are given explicitly by the graph, which is wired to the components.
+    Algebraic loops (cycles of systems feeding each other at the same timestep) are detected when the schedule is compiled.
+    """
     
-    def __init__(self, time, dT, system_list=None, es_list=None, obj_list=None, obj_to_es_map=None):
+    def __init__(self, time, dT, system_list=None, es_list=None, obj_list=None, obj_to_es_map=None, graph=None):
+        
+        # components and wiring of an explicit dataflow graph
+        if graph is not None:
+            graph.wire()
+            if system_list is None:
+                system_list = graph.of_kind("system")
+            if obj_list is None:
+                obj_list = graph.of_kind("objective")
+            if es_list is None:
+                es_list = graph.of_kind("es")
+            if obj_to_es_map is None:
+                obj_to_es_map = [next(k1 for k1, obj in enumerate(obj_list) if obj is graph.objective_of(es)) for es in es_list]
+        
+        self.graph = graph # dataflow graph of the components (None: from the wiring of the components)
+        
+        self.time = time # time array (None or the start time for simulations streamed indefinitely)
         
-        self.time = time # time array
+        self.t0 = 0.0 if time is None else float(np.asarray(time).flat[0]) # start time
         
         self.dT = dT # timestep
         
@@ -26,28 +58,441 @@ class Simulation():
         # if obj_to_es_map is None, then the mapping is ES controller k receives objective function k
         self.obj_to_es_map = obj_to_es_map
         
-    def run_simulation(self):
+        self.routing_compiled = False # ES -> system -> objective function wiring compiled into index maps
+        
+        self.disabled = set() # ids of the components of disabled branches (not stepped)
+        
+        self.profiler = None # per-stage timing instrumentation (None when profiling is off)
+        
+        self.kt_last = -1 # most recent timestep simulated
+        
+        self.converged_step = None # timestep at which the last run converged (None if it did not stop early)
+        
+    def run_simulation(self, recording=None, checkpoint_path=None, checkpoint_interval=None, resume=True, convergence=None):
+        """
+        Simulate the systems, objective functions and ES controllers over the time array
+        
+        Inputs:
+        recording: RecordingPolicy or dict, optional
+            recording policy (lib.History_Module.RecordingPolicy) applied to every component (signals a component does not have are ignored),
+            or dict mapping components to their recording policy (default is None, keep the recording of each component)
+            with a directory, the record files of the components are named after their label (see component_labels)
+        checkpoint_path: str, optional
+            file of the checkpoints of the run (default is None, no checkpoints)
+        checkpoint_interval: int, optional
+            number of timesteps between checkpoints (default is None, checkpoint only at the end of the run)
+        resume: bool, optional
+            if True and checkpoint_path exists, resume the run from its checkpoint instead of from the first timestep (default is True)
+        convergence: ConvergenceCriteria, optional
+            criteria on the ES state (lib.Convergence_Module.ConvergenceCriteria); when they are met, the run stops, converged_step is
+            set to the timestep of convergence, and the time array and the arrays of the components are cut after it
+            (default is None, run over the whole time array)
+            
+        Long runs should record to files (RecordingPolicy with a directory), so that the records of the timesteps before the checkpoint
+        are kept on disk and continued when the run is resumed.
+        """
+        
+        # apply recording policies before the first timestep
+        labels = self.component_labels()
+        if isinstance(recording, dict):
+            for label, component in labels:
+                if component in recording:
+                    component.set_recording(recording[component], prefix=label)
+        elif recording is not None:
+            for label, component in labels:
+                component.set_recording(recording, strict=False, prefix=label)
+        
+        # resume from the checkpoint
+        kt_start = 0
+        if checkpoint_path is not None and resume and os.path.exists(checkpoint_path):
+            kt_start = self.load_checkpoint(checkpoint_path) + 1
+        
+        monitor = None
+        if convergence is not None:
+            monitor = convergence.monitor(self.es_list)
+        self.converged_step = None # timestep at which the run converged
         
         # simulate system and ES Algorithm
-        for kt in range(0,len(self.time)):
+        for kt in range(kt_start,len(self.time)):
             
-            # each system takes a time step
-            for k1, sys in enumerate(self.system_list):
-                sys.step(kt)
+            self.step(kt)
             
-            # each objective function receives measurements and calculates its value
-            for k1, obj in enumerate(self.obj_list):
+            if checkpoint_path is not None and checkpoint_interval is not None and (kt + 1) % checkpoint_interval == 0:
+                self.save_checkpoint(checkpoint_path)
+                
+            # stop early once converged
+            if monitor is not None and monitor.update(kt):
+                self.converged_step = kt
+                break
         
-                obj.get_measurements(kt) # objective function(s) receive measurement(s)
+        # write the records buffered in memory to the record files
+        for label, component in labels:
+            component.flush_records()
+        
+        # cut the arrays after the timestep of convergence
+        if self.converged_step is not None:
+            self.time = self.time[:self.converged_step+1]
+            for label, component in labels:
+                component.trim_history()
+        
+        if checkpoint_path is not None and kt_start < len(self.time):
+            self.save_checkpoint(checkpoint_path)
+            
+    def component_labels(self):
+        """
+        Label and component of every system, objective function and ES controller, e.g. ("system0", sys), ("objective0", obj), ("es0", es)
+        """
+        
+        return [(f"system{k1}", sys) for k1, sys in enumerate(self.system_list)] + \
+            [(f"objective{k1}", obj) for k1, obj in enumerate(self.obj_list)] + \
+            [(f"es{k1}", es) for k1, es in enumerate(self.es_list)]
+            
+    def save_checkpoint(self, path):
+        """
+        Write the minimal state of every component at the most recent timestep (see checkpoint_state) to a .npz file
+        
+        The records of the components are flushed to their files first, and the checkpoint file is replaced atomically,
+        so that an interrupted run always leaves a consistent checkpoint.
+        """
+        
+        arrays = {"simulation/kt_last": np.array(self.kt_last)}
+        for label, component in self.component_labels():
+            component.flush_records()
+            for name, value in component.checkpoint_state().items():
+                arrays[f"{label}/{name}"] = value
+        
+        path_tmp = path + ".tmp"
+        with open(path_tmp, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(path_tmp, path)
+        
+    def load_checkpoint(self, path):
+        """
+        Restore the state of every component from a checkpoint written by save_checkpoint
+        
+        Outputs:
+        the most recent timestep of the checkpoint, from which the run continues
+        """
+        
+        states = {label: {} for label, component in self.component_labels()}
+        states["simulation"] = {}
+        with np.load(path) as data:
+            for key in data.files:
+                label, name = key.split("/", 1)
+                if label not in states:
+                    raise ValueError(f"checkpoint {path} does not match this simulation: unknown component {label}")
+                states[label][name] = data[key]
+        
+        for label, component in self.component_labels():
+            if "kt_last" not in states[label]:
+                raise ValueError(f"checkpoint {path} does not match this simulation: missing component {label}")
+            component.restore_state(states[label])
+        self.kt_last = int(states["simulation"]["kt_last"])
+        
+        # the buffers of the compiled routing are rebuilt from the restored values
+        self.routing_compiled = False
+        
+        return self.kt_last
+            
+    def stream(self, n_steps=None):
+        """
+        Generator driver that progresses the simulation one timestep at a time and yields the results of each timestep
+        
+        Intended for components in streaming mode, which can be stepped indefinitely in constant memory.
+        
+        Inputs:
+        n_steps: int, optional
+            number of timesteps to simulate (default is None, run indefinitely)
+            
+        Outputs (yielded at each timestep):
+        dict with keys
+            "kt": the timestep
+            "time": the time of the timestep
+            "psi": list of objective function values, one per objective function
+            "thetahat": list of ES setpoint arrays, one per ES controller
+            "theta": list of ES control arrays, one per ES controller
+        """
+        
+        kt = 0
+        while n_steps is None or kt < n_steps:
+            
+            self.step(kt)
+            
+            # most recent values of each component (held between updates of components with a longer period)
+            yield {
+                "kt": kt,
+                "time": self.time_at(kt),
+                "psi": [obj.psi[...,obj.buffer_index(obj.kt_last)].copy() for obj in self.obj_list],
+                "thetahat": [es.thetahat[...,es.buffer_index(es.kt_last)].copy() for es in self.es_list],
+                "theta": [es.theta[...,es.buffer_index(es.kt_last)].copy() for es in self.es_list],
+            }
+            
+            kt = kt + 1
+            
+    def time_at(self, kt):
+        """
+        Time of timestep kt: from the time array when it holds kt, otherwise from the start time and timestep
+        """
+        
+        if np.ndim(self.time) > 0 and kt < len(self.time):
+            return self.time[kt]
+        return self.t0 + kt*self.dT
+    
+    def compile_routing(self):
+        """
+        Compile the ES -> system and system -> objective function wiring into index maps over shared contiguous buffers
+        
+        The control values of all ES controllers are held in one buffer (theta_buffer), and the outputs of all systems in another (y_buffer),
+        both views of one signal buffer (control values first).
+        At each timestep, systems and objective functions gather their inputs from these buffers into preallocated arrays,
+        instead of stacking the arrays of each connected component.
+        Systems (objective functions) connected to ES controllers or systems (systems) outside of this simulation keep stacking their inputs.
+        """
+        
+        # slice of each ES controller in the control buffer, in es_list order
+        self.es_slices = []
+        offsets = {}
+        n = 0
+        for es in self.es_list:
+            nc = es.theta[...,0].size
+            offsets[id(es)] = (n, n + nc)
+            self.es_slices.append(slice(n, n + nc))
+            n = n + nc
+        n_theta = n
+        
+        # slice of each system in the output buffer, in system_list order
+        self.sys_slices = []
+        n = 0
+        for sys in self.system_list:
+            offsets[id(sys)] = (n_theta + n, n_theta + n + sys.ny)
+            self.sys_slices.append(slice(n, n + sys.ny))
+            n = n + sys.ny
+        
+        self.signal_buffer = np.zeros(n_theta + n) # most recent control values of all ES controllers, then outputs of all systems
+        self.theta_buffer = self.signal_buffer[:n_theta] # most recent control values of all ES controllers
+        self.y_buffer = self.signal_buffer[n_theta:] # most recent outputs of all systems
+        for es, es_slice in zip(self.es_list, self.es_slices):
+            self.theta_buffer[es_slice] = es.theta[...,es.buffer_index(max(es.kt_last,0))].ravel()
+        for sys, sys_slice in zip(self.system_list, self.sys_slices):
+            if sys.kt_last >= 0:
+                self.y_buffer[sys_slice] = sys.y[:,sys.buffer_index(sys.kt_last)]
+        
+        # index of the inputs of each system (control values and system outputs) in the signal buffer, and preallocated system input arrays
+        self.sys_u_index = []
+        self.sys_u = []
+        for sys in self.system_list:
+            if all(id(source) in offsets for source in sys.es_list):
+                idx = np.concatenate([np.arange(*offsets[id(source)]) for source in sys.es_list] + [np.zeros(0, dtype=int)])
+                self.sys_u_index.append(idx)
+                self.sys_u.append(np.zeros(len(idx)))
+            else:
+                self.sys_u_index.append(None)
+                self.sys_u.append(None)
+        sys_offsets = {id(sys): (start - n_theta, stop - n_theta) for sys in self.system_list for start, stop in [offsets[id(sys)]]}
+
+        # index of the measurements of each objective function in the output buffer, and preallocated measurement arrays
+        self.obj_y_index = []
+        self.obj_y = []
+        for obj in self.obj_list:
+            if all(id(sys) in sys_offsets for sys in obj.sys_list):
+                idx = np.concatenate([np.arange(*sys_offsets[id(sys)]) for sys in obj.sys_list] + [np.zeros(0, dtype=int)])
+                self.obj_y_index.append(idx)
+                self.obj_y.append(np.zeros(len(idx)))
+            else:
+                self.obj_y_index.append(None)
+                self.obj_y.append(None)
+        
+        # objective function of each ES controller
+        # if no objective to es mapping, then map 1 to 1 in indexed order
+        if self.obj_to_es_map is None:
+            self.es_obj = [self.obj_list[k1] for k1 in range(len(self.es_list))]
+        # if objective to es mapping, then each ES contoller will receive the appropriate objective function value
+        else:
+            self.es_obj = [self.obj_list[obj_idx] for obj_idx in self.obj_to_es_map]
+        
+        # update period of each component, in timesteps of the simulation
+        self.sys_periods = [self.component_period(sys) for sys in self.system_list]
+        self.obj_periods = [self.component_period(obj) for obj in self.obj_list]
+        self.es_periods = [self.component_period(es) for es in self.es_list]
+        self.multirate = max(self.sys_periods + self.obj_periods + self.es_periods) > 1
+        if self.multirate and any(idx is None for idx in self.sys_u_index + self.obj_y_index):
+            raise ValueError("components with different periods must all be connected within the simulation")
+        
+        self.compile_schedule()
+        
+        self.routing_compiled = True
+    
+    def dataflow_graph(self):
+        """
+        Dataflow graph of the simulation: the explicit graph if one was given, otherwise the graph of the wiring of the components
+        """
+        
+        if self.graph is not None:
+            return self.graph
+        if self.obj_to_es_map is None:
+            es_obj = [self.obj_list[k1] for k1 in range(len(self.es_list))]
+        else:
+            es_obj = [self.obj_list[obj_idx] for obj_idx in self.obj_to_es_map]
+        return DataflowGraph.from_components(self.system_list, self.obj_list, self.es_list, es_obj)
+    
+    def compile_schedule(self):
+        """
+        Compile the order in which the components are stepped (lib.Graph_Module.DataflowGraph.schedule) into a list of
+        (kind, index) pairs, kind 0 for systems, 1 for objective functions and 2 for ES controllers, without the disabled components
+        """
+        
+        index = {}
+        for k1, sys in enumerate(self.system_list):
+            index[id(sys)] = (0, k1)
+        for k1, obj in enumerate(self.obj_list):
+            index[id(obj)] = (1, k1)
+        for k1, es in enumerate(self.es_list):
+            index[id(es)] = (2, k1)
+        
+        self.schedule = [index[id(component)] for component in self.dataflow_graph().schedule() if id(component) not in self.disabled]
+    
+    def set_branch_enabled(self, component, enabled=True):
+        """
+        Enable or disable the independent branch of the dataflow graph containing component (see DataflowGraph.branches)
+        
+        The components of a disabled branch are not stepped, and hold their most recent values, while the other branches progress.
+        """
+        
+        for branch in self.dataflow_graph().branches():
+            if any(node is component for node in branch):
+                for node in branch:
+                    if enabled:
+                        self.disabled.discard(id(node))
+                    else:
+                        self.disabled.add(id(node))
+                break
+        else:
+            raise ValueError(f"{type(component).__name__} is not a component of this simulation")
+        
+        if self.routing_compiled:
+            self.compile_schedule()
+    
+    def component_period(self, component):
+        """
+        Update period of a component, in timesteps of the simulation
+        
+        Each component declares its update rate through its own timestep dT (and time array), which must be a multiple of the
+        timestep of the simulation. A component with period P is updated every P timesteps of the simulation, at its own timestep
+        kt//P, and its outputs are held in between (sample and hold).
+        """
+        
+        period = int(round(component.dT/self.dT))
+        if period < 1 or abs(component.dT - period*self.dT) > 1e-9*self.dT:
+            raise ValueError(f"the timestep of {type(component).__name__} ({component.dT}) is not a multiple of the simulation timestep ({self.dT})")
+        
+        # the component must have a timestep for every update within the time array of the simulation
+        if component.n_steps is not None and self.time is not None and component.n_steps < (len(self.time) - 1)//period + 1:
+            raise ValueError(f"the time array of {type(component).__name__} is too short for the simulation, with period {period}")
+        
+        return period
 
-                obj.compute_objective_function(kt) # objective function(s) calculate value(s)
-            
-            # each ES controller calculates its setpoint and control
-            for k1, es in enumerate(self.es_list):
-                # if no objective to es mapping, then map 1 to 1 in indexed order
-                if self.obj_to_es_map is None:
-                    es.ES_function(kt, self.obj_list[k1].psi[kt])
-                # if objective to es mapping, then each ES contoller will receive the appropriate objective function value
+    def enable_profiling(self):
+        """
+        Time every stage of each timestep per component (see lib.Profiling_Module), until disable_profiling is called
+        
+        Outputs:
+        the SimulationProfiler, whose report() / export(path) / summary() give the timings
+        """
+        
+        if self.profiler is None:
+            self.profiler = SimulationProfiler()
+            self.profiler.attach(self)
+        return self.profiler
+        
+    def disable_profiling(self):
+        """
+        Stop timing the stages of each timestep, and restore the user callbacks of the components
+        
+        Outputs:
+        the SimulationProfiler that was attached (None if profiling was off)
+        """
+        
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.detach()
+        self.profiler = None
+        return profiler
+        
+    def step(self, kt):
+        """
+        Progress every system, objective function and ES controller by one timestep
+        
+        With a profiler (enable_profiling), each stage of each component is timed; without, the timers are skipped.
+        """
+        
+        if not self.routing_compiled:
+            self.compile_routing()
+        
+        profiler = self.profiler # per-stage timers (None when profiling is off)
+        if profiler is not None:
+            t_step = timer.perf_counter()
+        
+        self.kt_last = kt
+        
+        # components in the order of the schedule
+        for kind, k1 in self.schedule:
+            
+            # system takes a time step
+            if kind == 0:
+                period = self.sys_periods[k1]
+                if kt % period != 0:
+                    continue
+                sys = self.system_list[k1]
+                ks = kt//period # timestep of the system
+                if profiler is not None:
+                    t0 = timer.perf_counter()
+                if self.sys_u_index[k1] is None:
+                    sys.step(ks)
+                else:
+                    np.take(self.signal_buffer, self.sys_u_index[k1], out=self.sys_u[k1]) # gather system inputs
+                    sys.step(ks, self.sys_u[k1])
+                self.y_buffer[self.sys_slices[k1]] = sys.y[:,sys.buffer_index(ks)] # scatter system outputs
+                if profiler is not None:
+                    profiler.sys_timers[k1].add(timer.perf_counter() - t0)
+            
+            # objective function receives measurements and calculates its value
+            elif kind == 1:
+                period = self.obj_periods[k1]
+                if kt % period != 0:
+                    continue
+                obj = self.obj_list[k1]
+                ko = kt//period # timestep of the objective function
+                if profiler is not None:
+                    t0 = timer.perf_counter()
+                
+                # objective function(s) receive measurement(s)
+                if self.obj_y_index[k1] is None:
+                    obj.get_measurements(ko)
                 else:
-                    obj_idx = self.obj_to_es_map[k1]
-                    es.ES_function(kt, self.obj_list[obj_idx].psi[kt])
+                    np.take(self.y_buffer, self.obj_y_index[k1], out=self.obj_y[k1]) # gather measurements
+                    obj.get_measurements(ko, self.obj_y[k1])
+                if profiler is not None:
+                    t1 = timer.perf_counter()
+                
+                obj.compute_objective_function(ko) # objective function(s) calculate value(s)
+                if profiler is not None:
+                    profiler.obj_timers[k1][0].add(t1 - t0)
+                    profiler.obj_timers[k1][1].add(timer.perf_counter() - t1)
+            
+            # ES controller calculates its setpoint and control, from the most recent objective function value
+            else:
+                period = self.es_periods[k1]
+                if kt % period != 0:
+                    continue
+                es = self.es_list[k1]
+                kes = kt//period # timestep of the ES controller
+                if profiler is not None:
+                    t0 = timer.perf_counter()
+                obj = self.es_obj[k1]
+                es.ES_function(kes, obj.psi[...,obj.buffer_index(obj.kt_last)])
+                self.theta_buffer[self.es_slices[k1]] = es.theta[...,es.buffer_index(kes)].ravel() # scatter control values
+                if profiler is not None:
+                    profiler.es_timers[k1].add(timer.perf_counter() - t0)
+        
+        if profiler is not None:
+            profiler.step_timer.add(timer.perf_counter() - t_step)
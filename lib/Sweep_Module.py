@@ -0,0 +1,177 @@
+# Parameter Sweep Functions
+
+"""
+
+Run a simulation over a grid of parameters (e.g. ES fes/aes/kint) across a pool of worker processes.
+
+Each case of the sweep builds a Simulation with a user-supplied factory, runs it, and reduces it to a fixed-shape result
+(summary metrics or trajectories) with a user-supplied metric function. Workers write results directly into a memory-mapped
+.npy file on disk, in the deterministic order of the parameter grid, rather than sending them back to the parent process.
+A companion done-mask file records which cases have completed, so that an interrupted sweep resumes where it stopped.
+
+The simulation factory and metric function are sent to the worker processes, and must be picklable (e.g. module-level functions).
+
+"""
+
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+
+def parameter_grid(grid):
+    """
+    Expand a dictionary of parameter values into the list of all parameter combinations
+
+    The order is deterministic: the last parameter varies fastest, following the insertion order of grid.
+
+    Inputs:
+    grid: dict
+        parameter name -> list of values, e.g. {"fes": [0.5, 1.0], "kint": [0.1, 0.2, 0.5]}
+
+    Outputs:
+    list of dicts, one per case
+    """
+
+    names = list(grid.keys())
+    return [dict(zip(names, values)) for values in itertools.product(*[grid[name] for name in names])]
+
+
+def final_setpoints(sim):
+    """
+    Metric function returning the final setpoints of all ES controllers of a simulation, stacked in es_list order
+    """
+
+    return np.concatenate([np.ravel(es.thetahat[...,es.buffer_index(es.kt_last)]) for es in sim.es_list])
+
+
+def convergence_step(sim):
+    """
+    Metric function returning the timestep at which a simulation run with convergence criteria converged (-1 if it did not)
+    """
+
+    if sim.converged_step is None:
+        return np.array([-1])
+    return np.array([sim.converged_step])
+
+
+def final_setpoints_and_convergence(sim):
+    """
+    Metric function returning the final setpoints of all ES controllers (as final_setpoints), followed by the convergence step
+    """
+
+    return np.concatenate((final_setpoints(sim), convergence_step(sim)))
+
+
+def _sweep_paths(out_path):
+    """
+    Paths of the result, done-mask and manifest files of a sweep
+    """
+
+    return out_path, out_path + ".done.npy", out_path + ".json"
+
+
+def _run_cases(sim_factory, metric_func, cases, out_path, convergence=None):
+    """
+    Run a chunk of cases in a worker process, writing each result and its done flag into the memory-mapped files
+
+    Inputs:
+    cases: list of (case index, parameter dict)
+
+    Outputs:
+    number of cases run
+    """
+
+    result_path, done_path, _ = _sweep_paths(out_path)
+    results = np.load(result_path, mmap_mode="r+")
+    done = np.load(done_path, mmap_mode="r+")
+
+    for kc, params in cases:
+        sim = sim_factory(**params)
+        sim.run_simulation(convergence=convergence)
+        results[kc] = metric_func(sim)
+        results.flush()
+        # the done flag is set only once the result is on disk
+        done[kc] = 1
+        done.flush()
+
+    return len(cases)
+
+
+def run_sweep(sim_factory, grid, out_path, result_shape, metric_func=final_setpoints, n_workers=None, chunk_size=8, resume=True, dtype=np.float64, convergence=None):
+    """
+    Run a simulation for every case of a parameter grid, across a pool of worker processes
+
+    Inputs:
+    sim_factory: callable
+        sim_factory(**params) returns a Simulation (not yet run) for the parameters of one case
+    grid: dict or list of dicts
+        parameter grid (see parameter_grid), or explicit list of parameter dicts
+    out_path: str
+        path of the .npy result file, of shape (number of cases,) + result_shape
+    result_shape: tuple
+        shape of the result of one case
+    metric_func: callable, optional
+        metric_func(sim) returns the result of one case after the simulation has run (default is final_setpoints)
+    n_workers: int, optional
+        number of worker processes (default is None, one per CPU); 0 runs the cases in the calling process
+    chunk_size: int, optional
+        number of cases sent to a worker at a time (default is 8)
+    resume: bool, optional
+        if True and the result files of the same sweep exist, run only the cases that have not completed (default is True)
+    dtype: numpy dtype, optional
+        dtype of the result file (default is float64)
+    convergence: ConvergenceCriteria, optional
+        stop each case once its ES controllers have converged (see Simulation.run_simulation); sim.converged_step
+        is then available to metric_func, e.g. with convergence_step (default is None, run every case over its whole time array)
+
+    Outputs:
+    read-only memory-mapped array of results, of shape (number of cases,) + result_shape
+    """
+
+    if isinstance(grid, dict):
+        cases = parameter_grid(grid)
+    else:
+        cases = list(grid)
+    result_shape = tuple(result_shape)
+
+    result_path, done_path, manifest_path = _sweep_paths(out_path)
+
+    # the manifest identifies the sweep, so that only the same sweep is resumed
+    manifest = {
+        "n_cases": len(cases),
+        "result_shape": list(result_shape),
+        "dtype": np.dtype(dtype).str,
+        "cases": json.loads(json.dumps(cases, default=repr)),
+        "convergence": None if convergence is None else json.loads(json.dumps(vars(convergence), default=repr)),
+    }
+
+    existing = resume and os.path.exists(result_path) and os.path.exists(done_path) and os.path.exists(manifest_path)
+    if existing:
+        with open(manifest_path) as f:
+            if json.load(f) != manifest:
+                raise ValueError(f"existing sweep at {out_path} does not match this sweep; use another out_path or resume=False")
+    else:
+        np.lib.format.open_memmap(result_path, mode="w+", dtype=dtype, shape=(len(cases),) + result_shape).flush()
+        np.lib.format.open_memmap(done_path, mode="w+", dtype=np.uint8, shape=(len(cases),)).flush()
+        with open(manifest_path, "w") as f:
+            json.dump(manifest, f)
+
+    # cases not yet completed, in grid order, split into chunks
+    done = np.load(done_path, mmap_mode="r")
+    todo = [(kc, params) for kc, params in enumerate(cases) if not done[kc]]
+    del done
+    chunks = [todo[k1:k1 + chunk_size] for k1 in range(0, len(todo), chunk_size)]
+
+    if n_workers == 0:
+        for chunk in chunks:
+            _run_cases(sim_factory, metric_func, chunk, out_path, convergence)
+    elif len(chunks) > 0:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            futures = [pool.submit(_run_cases, sim_factory, metric_func, chunk, out_path, convergence) for chunk in chunks]
+            for future in as_completed(futures):
+                future.result() # re-raise errors from workers
+
+    return np.load(result_path, mmap_mode="r")
@@ -1,14 +1,48 @@
 import numpy as np
 
+from lib.History_Module import HistoryBuffer
+from lib.Noise_Module import noise_model
 
-class PassThroughSystem():
+
+def input_size(source):
+    """
+    Number of input values provided by an input source: the control values of an ES controller, or the outputs of a system
+    """
+
+    if hasattr(source, "ES_function"):
+        return source.theta[...,0].size # number of control values (M*nc for an ensemble)
+    return source.ny
+
+
+def input_values(source, kt):
+    """
+    Input values provided by an input source at timestep kt: the control values of an ES controller at the previous timestep
+    (at the first timestep, its initial control values), or the outputs of a system at the same timestep
+    """
+
+    if hasattr(source, "ES_function"):
+        return source.theta[...,source.buffer_index(max(kt-1,0))].ravel()
+    return source.y[:,source.buffer_index(kt)]
+
+
+class PassThroughSystem(HistoryBuffer):
+    """
+    If streaming is True, the u and y arrays are ring buffers holding history_length recent timesteps,
+    and ystar (if given) is a constant reference output.
+    With a recording policy (lib.History_Module.RecordingPolicy), only the selected signals are kept, in the record dictionary.
+    With noise (a model of lib.Noise_Module, or a list of models), measurement noise and disturbances are added to the outputs y.
+    """
     
-    def __init__(self, time, dT, nu, ny, pass_func=None, ystar=None):
+    history_signals = ["u", "y"] # signal arrays (time along the last axis)
+    
+    def __init__(self, time, dT, nu, ny, pass_func=None, ystar=None, streaming=False, history_length=None, recording=None, noise=None):
         
         self.time = time # time array
         
         self.dT = dT # time step
         
+        self.init_history(time, dT, streaming, history_length, recording) # number of stored timesteps
+        
         self.nu = nu # number of system inputs
         
         self.ny = ny # number of system outputs
@@ -16,55 +50,92 @@ class PassThroughSystem():
         self.pass_through_function = pass_func # pass-through function
         
         # reference output value
-        if ystar is None:
+        if ystar is None and self.streaming:
+            self.ystar = np.zeros((ny,1))
+        elif ystar is None:
             self.ystar = np.zeros((ny,len(self.time)))
+        elif self.streaming:
+            self.ystar = np.asarray(ystar).reshape(-1,1) # constant reference output
         else:
             self.ystar = ystar.reshape(-1,len(time)) 
         
-        self.u = np.zeros((self.nu,len(self.time))) # array of system input values
+        self.u = np.zeros((self.nu,self.buffer_length)) # array of system input values
         
-        self.y = np.zeros((self.ny,len(self.time))) # array of system output values
+        self.y = np.zeros((self.ny,self.buffer_length)) # array of system output values
+        
+        # measurement noise and disturbances on the outputs
+        self.noise = noise_model(noise)
+        if self.noise is not None:
+            self.noise.prepare(self, (self.ny,))
         
         self.es_list = None
         
-    # set list of ES controllers that provide input to the system
+    # set list of ES controllers (and systems) that provide input to the system
     # inputs are stacked vertically while timestepping
     def set_es_list(self, es_list):
         
-        self.es_list = es_list # list of ES controllers that provide input to the system
+        self.es_list = es_list # list of ES controllers (control values of the previous timestep) and systems (outputs of the same timestep)
         
         # calculate number of system inputs and create new system input array
         self.nu = 0
-        for k1, es in enumerate(self.es_list):
-            self.nu = self.nu + es.nc
-        self.u = np.zeros((self.nu,len(self.time)))
+        for k1, source in enumerate(self.es_list):
+            self.nu = self.nu + input_size(source)
+        self.u = np.zeros((self.nu,self.buffer_length))
     
     # step through time
     def step(self, kt, u=None):
         
-        # stack ES control values into system input vector
-        utemp = np.zeros((0,1))
-        if kt == 0:
-            for k1, es in enumerate(self.es_list):
-                utemp = np.vstack((utemp,es.theta[:,kt:kt+1]))
-        if kt >= 1:
-            for k1, es in enumerate(self.es_list):
-                utemp = np.vstack((utemp,es.theta[:,kt-1:kt]))
-        # utemp = utemp[1:,:]
-        
-        self.u[:,kt:kt+1] = utemp # store system input
+        k = self.buffer_index(kt) # column of the current timestep
+        self.kt_last = kt
+        
+        # system input vector given (e.g. gathered by a simulation with compiled routing)
+        if u is not None:
+            utemp = np.reshape(u,(-1,1))
+        # stack ES control values (and system outputs) into system input vector
+        else:
+            utemp = np.concatenate([input_values(source, kt) for source in self.es_list]).reshape(-1,1)
+        
+        self.u[:,k:k+1] = utemp # store system input
             
-        self.y[:,kt:kt+1] = self.pass_through_function(self.u[:,kt:kt+1]) # calculate system output
+        self.y[:,k:k+1] = self.pass_through_function(self.u[:,k:k+1]) # calculate system output
+        if self.noise is not None:
+            self.y[:,k] += self.noise.sample(kt) # measurement noise and disturbances
+        
+        self.record_step(kt) # copy recorded signals
         
         
-class LinearSystem():
+class LinearSystem(HistoryBuffer):
+    """
+    If streaming is True, the x, xdot, u and y arrays are ring buffers holding history_length recent timesteps,
+    and ystar (if given) is a constant reference output.
+    With a recording policy (lib.History_Module.RecordingPolicy), only the selected signals are kept, in the record dictionary.
+    With noise (a model of lib.Noise_Module, or a list of models), measurement noise and disturbances are added to the outputs y.
     
-    def __init__(self, time, dT, A, B, C, D, x0=None, ystar=None):
+    A, B, C and D may be numpy arrays or scipy.sparse matrices.
+    
+    discretization selects how the state is integrated over a timestep:
+    "euler": forward Euler, x[k+1] = x[k] + dT*(A x[k] + B u[k])
+    "zoh": exact zero-order-hold discretization, x[k+1] = Ad x[k] + Bd u[k], stable for any dT if the continuous system is stable.
+        Ad and Bd are computed once with a matrix exponential. For sparse A or B, Ad and Bd are computed once as sparse matrices,
+        with the entries below round-off of the exponential dropped (e.g. banded for a banded A), so that a timestep costs one sparse
+        product. If they would fill in (ZOH_FILL times the nonzeros of the augmented matrix), the exponential of the sparse augmented
+        matrix is instead applied to [x[k]; u[k]] at each timestep with a truncated Taylor series of sparse products (as
+        scipy.sparse.linalg.expm_multiply), which avoids forming the dense Ad.
+        The state is not integrated from xdot, which is then only computed if it is recorded (with a recording policy).
+    """
+    
+    history_signals = ["x", "xdot", "u", "y"] # signal arrays (time along the last axis)
+    
+    ZOH_FILL = 50 # largest ratio of the nonzeros of the sparse zero-order-hold exponential to those of the augmented matrix
+    
+    def __init__(self, time, dT, A, B, C, D, x0=None, ystar=None, streaming=False, history_length=None, recording=None, discretization="euler", noise=None):
         
         self.time = time
         
         self.dT = dT
         
+        self.init_history(time, dT, streaming, history_length, recording) # number of stored timesteps
+        
         self.A = A # system matrix
         
         self.B = B # input matrix
@@ -79,13 +150,25 @@ class LinearSystem():
         
         self.ny = self.C.shape[0] # number of outputs
         
-        self.x = np.zeros((self.nx,len(self.time))) # state
+        # state integration method
+        if discretization not in ("euler", "zoh"):
+            raise ValueError(f"unknown discretization: {discretization}, expected 'euler' or 'zoh'")
+        self.discretization = discretization
+        if self.discretization == "zoh":
+            self.discretize_zoh()
+        
+        self.x = np.zeros((self.nx,self.buffer_length)) # state
+        
+        self.xdot = np.zeros((self.nx,self.buffer_length)) # time derivative of state
         
-        self.xdot = np.zeros((self.nx,len(self.time))) # time derivative of state
+        self.u = np.zeros((self.nu,self.buffer_length)) # input
         
-        self.u = np.zeros((self.nu,len(self.time))) # input
+        self.y = np.zeros((self.ny,self.buffer_length)) # output
         
-        self.y = np.zeros((self.ny,len(self.time))) # output
+        # measurement noise and disturbances on the outputs
+        self.noise = noise_model(noise)
+        if self.noise is not None:
+            self.noise.prepare(self, (self.ny,))
         
         # initialize state
         # if no initial state condition, initialize as 0
@@ -96,43 +179,412 @@ class LinearSystem():
         
         # reference output value
         # if no reference value, initialize as 0
-        if ystar is None:
-            self.ystar = np.zeros((ny,len(self.time)))
+        if ystar is None and self.streaming:
+            self.ystar = np.zeros((self.ny,1))
+        elif ystar is None:
+            self.ystar = np.zeros((self.ny,len(self.time)))
+        elif self.streaming:
+            self.ystar = np.asarray(ystar).reshape(-1,1) # constant reference output
         else:
             self.ystar = ystar.reshape(-1,len(time))
                 
         self.es_list = None
         
-    # set list of ES controllers that provide input to the system
+    def discretize_zoh(self):
+        """
+        Compute the zero-order-hold discretization of the system, from the exponential of the augmented matrix dT*[[A, B], [0, 0]]
+        
+        For dense A and B, the exponential is [[Ad, Bd], [0, I]], and Ad and Bd are stored.
+        For sparse A or B, the exponential is computed as a sparse matrix by scaling and squaring a truncated Taylor series, with the
+        entries below round-off dropped after each product, and sparse Ad and Bd are stored. If it fills in beyond ZOH_FILL times
+        the nonzeros of the augmented matrix, the augmented matrix is stored instead, scaled by the number of substeps that bring its
+        1-norm to at most 1, and applied to [x; u] at each timestep (see zoh_propagate).
+        """
+        
+        import scipy.sparse
+        
+        if scipy.sparse.issparse(self.A) or scipy.sparse.issparse(self.B):
+            M = scipy.sparse.bmat([[self.A, self.B], [None, scipy.sparse.csr_matrix((self.nu,self.nu))]], format="csr")*self.dT
+            norm = abs(M).sum(axis=0).max() # 1-norm of the augmented matrix
+            
+            # scaling and squaring, with a budget of nonzeros
+            q = max(0, int(np.ceil(np.log2(max(norm, 1e-300))))) # number of squarings
+            X = (M/2**q).tocsr()
+            budget = self.ZOH_FILL*max(M.nnz, M.shape[0])
+            E = scipy.sparse.identity(M.shape[0], format="csr") + X
+            term = X
+            for j in range(2, 40):
+                term = self._prune(term@X/j)
+                E = E + term
+                if term.nnz == 0 or abs(term).max() <= 1e-17 or E.nnz > budget:
+                    break
+            for _ in range(q):
+                if E.nnz > budget:
+                    break
+                E = self._prune(E@E)
+            
+            if E.nnz <= budget:
+                E = E.tocsr()
+                self.Ad = E[:self.nx,:self.nx] # discrete system matrix (sparse)
+                self.Bd = E[:self.nx,self.nx:] # discrete input matrix (sparse)
+                self.M_zoh = None
+            else:
+                self.Ad = None # discrete system matrix (not formed)
+                self.Bd = None # discrete input matrix (not formed)
+                self.zoh_substeps = max(1, int(np.ceil(norm))) # substeps of the Taylor series
+                self.M_zoh = (M/self.zoh_substeps).tocsr() # augmented matrix of a substep
+        else:
+            from scipy.linalg import expm
+            
+            M = np.zeros((self.nx + self.nu,self.nx + self.nu)) # augmented matrix
+            M[:self.nx,:self.nx] = self.A
+            M[:self.nx,self.nx:] = self.B
+            E = expm(M*self.dT)
+            self.Ad = E[:self.nx,:self.nx] # discrete system matrix
+            self.Bd = E[:self.nx,self.nx:] # discrete input matrix
+            self.M_zoh = None
+    
+    @staticmethod
+    def _prune(E):
+        """
+        Sparse matrix without its entries below round-off relative to its largest entry
+        """
+        
+        E = E.tocsr()
+        if E.nnz > 0:
+            E.data[np.abs(E.data) < 1e-18*np.abs(E.data).max()] = 0
+            E.eliminate_zeros()
+        return E
+    
+    def zoh_propagate(self, xu):
+        """
+        Apply the exponential of the sparse augmented matrix to [x; u]: a truncated Taylor series in each substep, stopped once its
+        terms are below the round-off of the sum (the 1-norm of the substep matrix is at most 1, so the terms decrease as 1/j!)
+        """
+        
+        v = xu
+        for _ in range(self.zoh_substeps):
+            f = v.copy()
+            term = v
+            for j in range(1, 40):
+                term = (self.M_zoh@term)/j
+                f += term
+                if np.max(np.abs(term)) <= 1e-16*np.max(np.abs(f)):
+                    break
+            v = f
+        return v
+    
+    def get_history(self, name, length=None):
+        """
+        Recent values of signal array name, in chronological order (oldest first)
+        
+        With ring buffers, the state of the next timestep overwrites the oldest column of x, which is therefore not returned
+        """
+        
+        if name == "x" and (self.n_steps is None or self.buffer_length < self.n_steps):
+            if length is None or length > self.buffer_length - 1:
+                length = self.buffer_length - 1
+        return HistoryBuffer.get_history(self, name, length)
+    
+    def checkpoint_state(self):
+        """
+        Minimal state needed to progress the system: the signal values of the most recent timestep, and the state x of the next timestep
+        """
+        
+        state = HistoryBuffer.checkpoint_state(self)
+        if self.kt_last >= 0 and (self.n_steps is None or self.kt_last + 1 < self.n_steps):
+            state["x_next"] = self.x[:,self.buffer_index(self.kt_last+1)].copy()
+        return state
+    
+    def restore_state(self, state):
+        
+        HistoryBuffer.restore_state(self, state)
+        if "x_next" in state:
+            self.x[:,self.buffer_index(self.kt_last+1)] = state["x_next"]
+
+    # set list of ES controllers (and systems) that provide input to the system
     # inputs are stacked vertically while timestepping
     def set_es_list(self, es_list):
 
-        self.es_list = es_list # list of ES controllers that provide input to the system
+        self.es_list = es_list # list of ES controllers (control values of the previous timestep) and systems (outputs of the same timestep)
 
         # calculate number of system inputs and create new system input array
         self.nu = 0
-        for k1, es in enumerate(self.es_list):
-            self.nu = self.nu + es.nc
-        self.u = np.zeros((self.nu,len(self.time)))
+        for k1, source in enumerate(self.es_list):
+            self.nu = self.nu + input_size(source)
+        self.u = np.zeros((self.nu,self.buffer_length))
 
     # step through time
     def step(self, kt, u=None):
 
-        # stack ES control values into system input vector
-        utemp = np.zeros((0,1))
-        if kt == 0:
-            for k1, es in enumerate(self.es_list):
-                utemp = np.vstack((utemp,es.theta[:,kt:kt+1]))
-        if kt >= 1:
-            for k1, es in enumerate(self.es_list):
-                utemp = np.vstack((utemp,es.theta[:,kt-1:kt]))
-        # utemp = utemp[1:,:]
+        k = self.buffer_index(kt) # column of the current timestep
+        kp1 = self.buffer_index(kt+1) # column of the next timestep
+        self.kt_last = kt
 
-        self.u[:,kt:kt+1] = utemp # store system input        
-        
-        self.xdot[:,kt:kt+1] = self.A@self.x[:,kt:kt+1] + self.B@self.u[:,kt:kt+1] # time derivative of state
-        
-        self.x[:,kt+1:kt+2] = self.x[:,kt:kt+1] + self.dT*self.xdot[:,kt:kt+1] # integrate dx/dt to update state
+        # system input vector given (e.g. gathered by a simulation with compiled routing)
+        if u is not None:
+            utemp = np.reshape(u,(-1,1))
+        # stack ES control values (and system outputs) into system input vector
+        else:
+            utemp = np.concatenate([input_values(source, kt) for source in self.es_list]).reshape(-1,1)
+
+        self.u[:,k:k+1] = utemp # store system input        
+        
+        # time derivative of state (with zero-order hold, only if recorded)
+        if self.discretization == "euler" or (self.recording is not None and "xdot" in self.recording.signals):
+            self.xdot[:,k:k+1] = self.A@self.x[:,k:k+1] + self.B@self.u[:,k:k+1]
+        
+        # integrate dx/dt to update state
+        # the state after the last timestep is not stored
+        if self.n_steps is None or kt + 1 < self.n_steps:
+            if self.discretization == "euler":
+                self.x[:,kp1:kp1+1] = self.x[:,k:k+1] + self.dT*self.xdot[:,k:k+1]
+            # exact discretization with zero-order hold on the input
+            elif self.M_zoh is None:
+                self.x[:,kp1:kp1+1] = self.Ad@self.x[:,k:k+1] + self.Bd@self.u[:,k:k+1]
+            else:
+                xu = np.concatenate((self.x[:,k], self.u[:,k]))
+                self.x[:,kp1] = self.zoh_propagate(xu)[:self.nx]
+        
+        self.y[:,k:k+1] = self.C@self.x[:,k:k+1] + self.D@self.u[:,k:k+1] # calculate system output
+        if self.noise is not None:
+            self.y[:,k] += self.noise.sample(kt) # measurement noise and disturbances
+        
+        self.record_step(kt) # copy recorded signals
         
-        self.y[:,kt:kt+1] = self.C@self.x[:,kt:kt+1] + self.D@self.u[:,kt:kt+1] # calculate system output
-        
\ No newline at end of file
+
+class NonlinearSystem(HistoryBuffer):
+    """
+    M independent copies of a nonlinear system dx/dt = f(x, u, t), y = g(x, u, t), integrated with the classical fixed-step
+    Runge-Kutta method (RK4), with the input held constant over each timestep (zero-order hold).
+
+    f (and g) must be vectorized over the copies: x has shape (nx, M) and u has shape (nu, M), one column per copy (a column
+    vector for M = 1, as LinearSystem), and f returns an array of shape (nx, M) (g of shape (ny, M)). Without g, the output is the state.
+    Each timestep of all copies is 4*substeps calls of f, with the RK4 stages held in preallocated arrays.
+
+    The signal arrays stack the copies: copy m occupies rows m*nx to (m + 1)*nx of x and xdot, m*nu to (m + 1)*nu of u, and
+    m*ny to (m + 1)*ny of y, so that the M copies can be driven by the M members of an ES ensemble (lib.ExtremumSeekingEnsembleND,
+    with nu channels per member), or by M ES controllers in the list given to set_es_list.
+
+    RK4 has a local error of order (dT/substeps)**5: with substeps > 1, each timestep is split into substeps RK4 steps, for
+    stiffer dynamics than dT resolves.
+
+    If streaming is True, the x, xdot, u and y arrays are ring buffers holding history_length recent timesteps,
+    and ystar (if given) is a constant reference output.
+    With a recording policy (lib.History_Module.RecordingPolicy), only the selected signals are kept, in the record dictionary.
+
+    Inputs:
+    time: array
+        time array
+    dT: float
+        timestep
+    f: callable f(x, u, t)
+        time derivative of the state, vectorized over the copies
+    nx, nu: int
+        number of states and inputs of each copy
+    ny: int, optional
+        number of outputs of each copy (default is None, nx)
+    g: callable g(x, u, t), optional
+        output function, vectorized over the copies (default is None, y = x)
+    M: int, optional
+        number of copies (default is 1)
+    x0: array of shape (nx,), (nx, M) or (M*nx,), optional
+        initial state of every copy (default is None, zero)
+    ystar: array, optional
+        reference output of the stacked outputs (default is None, zero)
+    substeps: int, optional
+        number of RK4 steps per timestep (default is 1)
+    noise: noise model (lib.Noise_Module) or list of models, optional
+        measurement noise and disturbances added to the stacked outputs y (default is None)
+    """
+
+    history_signals = ["x", "xdot", "u", "y"] # signal arrays (time along the last axis)
+
+    def __init__(self, time, dT, f, nx, nu, ny=None, g=None, M=1, x0=None, ystar=None, substeps=1, streaming=False, history_length=None, recording=None, noise=None):
+
+        self.time = time # time array
+
+        self.dT = dT # timestep
+
+        self.init_history(time, dT, streaming, history_length, recording) # number of stored timesteps
+
+        self.f = f # time derivative of the state
+
+        self.g = g # output function (None: output is the state)
+
+        if g is None and ny is not None and ny != nx:
+            raise ValueError(f"without an output function, the outputs are the {nx} states, not {ny}")
+
+        self.M = M # number of copies
+
+        self.nx_copy = nx # number of states of each copy
+
+        self.nu_copy = nu # number of inputs of each copy
+
+        self.ny_copy = nx if ny is None else ny # number of outputs of each copy
+
+        self.nx = self.M*self.nx_copy # number of states (all copies)
+
+        self.nu = self.M*self.nu_copy # number of inputs (all copies)
+
+        self.ny = self.M*self.ny_copy # number of outputs (all copies)
+
+        if int(substeps) < 1:
+            raise ValueError(f"substeps must be a positive integer, not {substeps}")
+        self.substeps = int(substeps) # number of RK4 steps per timestep
+
+        self.x = np.zeros((self.nx,self.buffer_length)) # state
+
+        self.xdot = np.zeros((self.nx,self.buffer_length)) # time derivative of state
+
+        self.u = np.zeros((self.nu,self.buffer_length)) # input
+
+        self.y = np.zeros((self.ny,self.buffer_length)) # output
+
+        # measurement noise and disturbances on the outputs
+        self.noise = noise_model(noise)
+        if self.noise is not None:
+            self.noise.prepare(self, (self.ny,))
+
+        # initialize state
+        # if no initial state condition, initialize as 0
+        if x0 is not None:
+            x0 = np.asarray(x0, dtype=float)
+            if x0.size == self.nx_copy:
+                x0 = np.repeat(x0.reshape(-1,1), self.M, axis=1)
+            elif x0.ndim == 1:
+                x0 = x0.reshape(self.M,self.nx_copy).T
+            self.x[:,0] = x0.T.ravel()
+
+        # reference output value
+        # if no reference value, initialize as 0
+        if ystar is None and self.streaming:
+            self.ystar = np.zeros((self.ny,1))
+        elif ystar is None:
+            self.ystar = np.zeros((self.ny,len(self.time)))
+        elif self.streaming:
+            self.ystar = np.asarray(ystar).reshape(-1,1) # constant reference output
+        else:
+            self.ystar = ystar.reshape(-1,len(time))
+
+        # RK4 work arrays (one column per copy)
+        self.x_work = np.zeros((self.nx_copy,self.M)) # state during a timestep
+        self.x_stage = np.zeros((self.nx_copy,self.M)) # state of the current stage
+        self.k_stages = np.zeros((4,self.nx_copy,self.M)) # time derivatives of the four stages
+        self.xdot_work = np.zeros((self.nx_copy,self.M)) # time derivative at the start of a timestep
+
+        self.es_list = None
+
+    def rk4(self, x, u, t):
+        """
+        Integrate the state x (array of shape (nx, M), updated in place) over one timestep from time t, with input u held constant
+
+        Outputs:
+        time derivative of the state at the start of the timestep, array of shape (nx, M)
+        """
+
+        h = self.dT/self.substeps
+        k1, k2, k3, k4 = self.k_stages
+        xs = self.x_stage
+        for s in range(self.substeps):
+            ts = t + s*h
+            k1[...] = self.f(x, u, ts)
+            if s == 0:
+                self.xdot_work[...] = k1
+            np.multiply(k1, 0.5*h, out=xs)
+            xs += x
+            k2[...] = self.f(xs, u, ts + 0.5*h)
+            np.multiply(k2, 0.5*h, out=xs)
+            xs += x
+            k3[...] = self.f(xs, u, ts + 0.5*h)
+            np.multiply(k3, h, out=xs)
+            xs += x
+            k4[...] = self.f(xs, u, ts + h)
+            # x += h/6*(k1 + 2*k2 + 2*k3 + k4)
+            k2 += k3
+            k2 *= 2
+            k1 += k2
+            k1 += k4
+            k1 *= h/6
+            x += k1
+        return self.xdot_work
+
+    def get_history(self, name, length=None):
+        """
+        Recent values of signal array name, in chronological order (oldest first)
+
+        With ring buffers, the state of the next timestep overwrites the oldest column of x, which is therefore not returned
+        """
+
+        if name == "x" and (self.n_steps is None or self.buffer_length < self.n_steps):
+            if length is None or length > self.buffer_length - 1:
+                length = self.buffer_length - 1
+        return HistoryBuffer.get_history(self, name, length)
+
+    def checkpoint_state(self):
+        """
+        Minimal state needed to progress the system: the signal values of the most recent timestep, and the state x of the next timestep
+        """
+
+        state = HistoryBuffer.checkpoint_state(self)
+        if self.kt_last >= 0 and (self.n_steps is None or self.kt_last + 1 < self.n_steps):
+            state["x_next"] = self.x[:,self.buffer_index(self.kt_last+1)].copy()
+        return state
+
+    def restore_state(self, state):
+
+        HistoryBuffer.restore_state(self, state)
+        if "x_next" in state:
+            self.x[:,self.buffer_index(self.kt_last+1)] = state["x_next"]
+
+    # set list of ES controllers (and systems) that provide input to the system
+    # inputs are stacked vertically while timestepping
+    def set_es_list(self, es_list):
+
+        self.es_list = es_list # list of ES controllers (control values of the previous timestep) and systems (outputs of the same timestep)
+
+        # calculate number of system inputs
+        nu = 0
+        for k1, source in enumerate(self.es_list):
+            nu = nu + input_size(source)
+        if nu != self.nu:
+            raise ValueError(f"the input sources provide {nu} values, the {self.M} copies of the system have {self.nu} inputs")
+
+    # step through time
+    def step(self, kt, u=None):
+
+        k = self.buffer_index(kt) # column of the current timestep
+        kp1 = self.buffer_index(kt+1) # column of the next timestep
+        self.kt_last = kt
+
+        # system input vector given (e.g. gathered by a simulation with compiled routing)
+        if u is not None:
+            self.u[:,k] = np.ravel(u)
+        # stack ES control values (and system outputs) into system input vector
+        else:
+            self.u[:,k] = np.concatenate([input_values(source, kt) for source in self.es_list])
+
+        # copies along the columns
+        uc = self.u[:,k].reshape(self.M,self.nu_copy).T
+        x = self.x_work
+        x[...] = self.x[:,k].reshape(self.M,self.nx_copy).T
+        t = self.time_at(kt)
+
+        # calculate system output
+        if self.g is None:
+            self.y[:,k] = self.x[:,k]
+        else:
+            self.y[:,k] = np.asarray(self.g(x, uc, t)).T.ravel()
+        if self.noise is not None:
+            self.y[:,k] += self.noise.sample(kt) # measurement noise and disturbances
+
+        # integrate dx/dt over the timestep to update state
+        # the state after the last timestep is not stored
+        if self.n_steps is None or kt + 1 < self.n_steps:
+            xdot = self.rk4(x, uc, t)
+            self.x[:,kp1] = x.T.ravel()
+        else:
+            xdot = self.f(x, uc, t)
+        self.xdot[:,k] = np.asarray(xdot).T.ravel() # time derivative of state
+
+        self.record_step(kt) # copy recorded signals
@@ -0,0 +1,285 @@
+# Warm-Start Cache Classes
+
+"""
+
+Persistent cache of the converged states of the ES controllers of scenarios (lib.Scenario_Module), from which new runs of the same
+or a nearby scenario start, instead of from thetahat0.
+
+A scenario is identified by its fingerprint: the time step, systems, objective functions and ES controllers of the scenario, without
+the run and output options, the initial setpoints (thetahat0), the noise models and the kernel backends, which do not change the
+optimum the controllers converge to. The fingerprint has
+- a key: hash of the whole fingerprint, for exact lookups
+- a structure: hash of the fingerprint with its numbers left out (components, types, wiring, functions and array shapes)
+- features: the numbers of the fingerprint (plant parameters, references, objective weights, fes, aes, kint, ...), in a fixed order
+A nearby scenario has the same structure, and features within a relative tolerance; the lookup returns the entry of the nearest one.
+
+The state of an ES controller is the value of its warm-start signals (WARM_START_SIGNALS: the setpoint thetahat, the gradient estimate
+xihat, which is the state of the first-order low-pass filter, and the Hessian estimates hhat and gamma of the Newton controller) at its
+most recent timestep. A warm start sets these values at the first timestep of the controller, and shifts its initial control theta
+with the setpoint. The higher-order filter stages (lib.Filter_Module.ESFilters) are designed and initialized at the first timestep,
+as for a cold start, and so is the high-pass filter, from the first objective function value.
+
+The cache is a directory with one .npz file per entry and an index (index.json) of the fingerprints, sizes and last uses of the
+entries. It is bounded by a number of entries and a number of bytes, and the least recently used entries are evicted first.
+The files are replaced atomically, but the cache is not meant to be written by several processes at the same time.
+
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+
+# signals of the ES state restored by a warm start
+WARM_START_SIGNALS = ["thetahat", "xihat", "hhat", "gamma"]
+
+# scenario entries that do not change the optimum of a scenario
+FINGERPRINT_IGNORED = ["run", "output", "thetahat0", "noise", "backend", "n_steps", "t_end", "t_start"]
+
+
+def _split(value, numbers):
+    """
+    Structure of a scenario value, with its numbers replaced by "#" and appended to numbers, in a fixed order
+    """
+
+    if isinstance(value, dict):
+        return {key: _split(value[key], numbers) for key in sorted(value) if key not in FINGERPRINT_IGNORED}
+    if isinstance(value, np.ndarray):
+        value = value.tolist()
+    if isinstance(value, (list, tuple)):
+        return [_split(item, numbers) for item in value]
+    if isinstance(value, (bool, np.bool_)) or value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        numbers.append(float(value))
+        return "#"
+    return str(value)
+
+
+def scenario_fingerprint(scenario):
+    """
+    Fingerprint of a scenario (see the module documentation)
+
+    Outputs:
+    key: str
+        hash of the fingerprint
+    structure: str
+        hash of the fingerprint without its numbers
+    features: array of float
+        numbers of the fingerprint
+    """
+
+    numbers = []
+    structure = json.dumps(_split(scenario, numbers), sort_keys=True)
+    features = np.array(numbers)
+    key = hashlib.sha256((structure + features.tobytes().hex()).encode()).hexdigest()[:32]
+    return key, hashlib.sha256(structure.encode()).hexdigest()[:32], features
+
+
+def feature_distance(a, b):
+    """
+    Largest relative difference between the features of two fingerprints of the same structure (0 for identical features)
+    """
+
+    a = np.asarray(a, dtype=float)
+    b = np.asarray(b, dtype=float)
+    if len(a) == 0:
+        return 0.0
+    scale = np.maximum(np.abs(a), np.abs(b))
+    difference = np.abs(a - b)
+    return float(np.max(np.where(scale > 0, difference/np.where(scale > 0, scale, 1.0), 0.0)))
+
+
+def warm_state(es):
+    """
+    Warm-start state of an ES controller: its warm-start signals at its most recent timestep
+    """
+
+    if es.kt_last < 0:
+        raise ValueError("the ES controller has not been stepped")
+    k = es.buffer_index(es.kt_last)
+    return {name: np.array(getattr(es, name)[...,k]) for name in WARM_START_SIGNALS if name in es.history_signals}
+
+
+def apply_warm_state(es, state):
+    """
+    Set the warm-start signals of an ES controller at its first timestep, before it is stepped, and shift its initial control
+    with the setpoint
+    """
+
+    if es.kt_last >= 0:
+        raise ValueError("a warm start is applied before the first timestep of the ES controller")
+    k = es.buffer_index(0)
+    shift = state["thetahat"] - es.thetahat[...,k]
+    for name, value in state.items():
+        getattr(es, name)[...,k] = value
+    es.theta[...,k] += shift
+
+
+class WarmStartCache():
+    """
+    Size-bounded on-disk cache of the converged ES states of scenarios, with nearest lookup and least recently used eviction
+    (see the module documentation)
+
+    Inputs:
+    directory: str
+        directory of the cache (created if needed)
+    max_entries: int, optional
+        maximum number of entries (default is 100)
+    max_bytes: int, optional
+        maximum total size of the entry files (default is None, not bounded)
+    tolerance: float, optional
+        largest relative difference of the features of a nearby scenario (default is 0.1); 0 for exact lookups only
+    """
+
+    def __init__(self, directory, max_entries=100, max_bytes=None, tolerance=0.1):
+
+        self.directory = directory # cache directory
+
+        self.max_entries = max(1, int(max_entries)) # maximum number of entries
+
+        self.max_bytes = max_bytes # maximum total size of the entry files
+
+        self.tolerance = tolerance # relative tolerance of nearby scenarios
+
+        os.makedirs(directory, exist_ok=True)
+
+    def index_path(self):
+
+        return os.path.join(self.directory, "index.json")
+
+    def entry_path(self, key):
+
+        return os.path.join(self.directory, key + ".npz")
+
+    def load_index(self):
+        """
+        Index of the cache: {"clock": last use counter, "entries": {key: {"structure", "features", "bytes", "last_used"}}}
+        """
+
+        if not os.path.exists(self.index_path()):
+            return {"clock": 0, "entries": {}}
+        with open(self.index_path()) as f:
+            return json.load(f)
+
+    def save_index(self, index):
+
+        path_tmp = self.index_path() + ".tmp"
+        with open(path_tmp, "w") as f:
+            json.dump(index, f)
+        os.replace(path_tmp, self.index_path())
+
+    def __len__(self):
+
+        return len(self.load_index()["entries"])
+
+    def nearest(self, scenario):
+        """
+        Key of the entry of the same or the nearest scenario within the tolerance, and its feature distance (None, None if there is none)
+        """
+
+        key, structure, features = scenario_fingerprint(scenario)
+        entries = self.load_index()["entries"]
+        if key in entries:
+            return key, 0.0
+
+        best = (None, None)
+        for other, entry in entries.items():
+            if entry["structure"] != structure or len(entry["features"]) != len(features):
+                continue
+            distance = feature_distance(features, entry["features"])
+            if distance <= self.tolerance and (best[1] is None or distance < best[1]):
+                best = (other, distance)
+        return best
+
+    def lookup(self, scenario):
+        """
+        Cached ES states of the same or the nearest scenario, and its feature distance
+
+        Outputs:
+        states: dict, ES controller label (es<k>, as Simulation.component_labels) -> warm-start state, or None if there is no entry
+        distance: float, or None
+        """
+
+        key, distance = self.nearest(scenario)
+        if key is None:
+            return None, None
+
+        states = {}
+        with np.load(self.entry_path(key)) as data:
+            for name in data.files:
+                label, signal = name.split("/", 1)
+                states.setdefault(label, {})[signal] = data[name]
+
+        # mark as most recently used
+        index = self.load_index()
+        if key in index["entries"]:
+            index["clock"] += 1
+            index["entries"][key]["last_used"] = index["clock"]
+            self.save_index(index)
+
+        return states, distance
+
+    def store(self, scenario, sim):
+        """
+        Store the states of the ES controllers of a simulation at their most recent timestep, as the entry of a scenario, and evict
+        the least recently used entries beyond the bounds of the cache
+
+        Outputs:
+        True if the states were stored, False if they are not finite (diverged run)
+        """
+
+        key, structure, features = scenario_fingerprint(scenario)
+        arrays = {}
+        for k1, es in enumerate(sim.es_list):
+            for name, value in warm_state(es).items():
+                arrays[f"es{k1}/{name}"] = value
+        if not all(np.all(np.isfinite(value)) for value in arrays.values()):
+            return False
+
+        path_tmp = self.entry_path(key) + ".tmp"
+        with open(path_tmp, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(path_tmp, self.entry_path(key))
+
+        index = self.load_index()
+        index["clock"] += 1
+        index["entries"][key] = {"structure": structure, "features": features.tolist(), "bytes": os.path.getsize(self.entry_path(key)), "last_used": index["clock"]}
+        self.evict(index, keep=key)
+        self.save_index(index)
+        return True
+
+    def evict(self, index, keep=None):
+        """
+        Remove the least recently used entries of the index (and their files) until the cache is within its bounds
+        """
+
+        entries = index["entries"]
+        while len(entries) > 1 and (len(entries) > self.max_entries or
+                (self.max_bytes is not None and sum(entry["bytes"] for entry in entries.values()) > self.max_bytes)):
+            oldest = min((key for key in entries if key != keep), key=lambda key: entries[key]["last_used"])
+            del entries[oldest]
+            if os.path.exists(self.entry_path(oldest)):
+                os.remove(self.entry_path(oldest))
+
+    def warm_start(self, sim, scenario):
+        """
+        Start the ES controllers of a simulation (not yet run) from the cached states of the same or the nearest scenario
+
+        Controllers whose cached state does not match their shape keep their initial state.
+
+        Outputs:
+        feature distance of the scenario of the states, or None if there is no entry (cold start)
+        """
+
+        states, distance = self.lookup(scenario)
+        if states is None:
+            return None
+        for k1, es in enumerate(sim.es_list):
+            state = states.get(f"es{k1}")
+            if state is None or any(not hasattr(es, name) or np.shape(value) != getattr(es, name)[...,0].shape for name, value in state.items()):
+                continue
+            apply_warm_state(es, state)
+        return distance